@@ -0,0 +1,114 @@
+"""
+Benchmark for response and wire compression.
+
+HTTP: encodes the candidate listing, the election listing and an election's
+results as JSON and MessagePack, then compresses them with gzip and brotli.
+It reports the bytes sent, the time spent encoding and compressing, and the
+total latency on a link of the given speed (default 10 Mbit/s).
+
+MongoDB wire: BSON-encodes an election document with its ``votes`` map for
+N voters (default 100k) and compresses it with zlib, zstd and snappy, the
+codecs ``MONGO_COMPRESSORS`` can enable.
+
+Codecs whose optional package (brotli, msgpack, zstandard, python-snappy) is
+not installed are skipped.
+
+Usage: python benchmarks/bench_compression.py [voters] [mbit_per_second]
+"""
+
+import gzip
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+import bson
+from app import create_app
+from response_compression import brotli
+from datagen import DatasetGenerator
+from json_provider import bson_default, msgpack
+from results import compute_results
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+
+def timed(f, repeat=5):
+    """The result of ``f`` and its best time in ms."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = f()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def payloads(voters):
+    generator = DatasetGenerator(seed=0, constituencies=1)
+    candidates = generator.candidates(1000)
+    elections = [election for election, _ in DatasetGenerator(seed=0, constituencies=100).elections(
+        5000, 0, candidates)]
+    election, _ = next(generator.elections(1, voters, candidates))
+    listing = {"success": True, "message": "", "data": [
+        {"candidate_id": c["_id"], "name": c["name"], "party": c["party"]} for c in candidates]}
+    schedule = {"success": True, "message": "", "data": [
+        {"election_id": e["_id"], "name": e["name"]} for e in elections]}
+    results = {"success": True, "message": "", "data": compute_results(election)}
+    return {"candidates": listing, "elections": schedule, "results": results}, election
+
+
+def http(cases, mbit):
+    app = create_app({'TESTING': True})
+    encoders = [("json", lambda obj: app.json.dumps(obj).encode())]
+    if msgpack is not None:
+        encoders.append(("msgpack", lambda obj: msgpack.packb(obj, default=bson_default)))
+    compressors = [("identity", lambda data: data), ("gzip", lambda data: gzip.compress(data, 6))]
+    if brotli is not None:
+        compressors.append(("br", lambda data: brotli.compress(data, quality=5)))
+
+    bytes_per_ms = mbit * 1e6 / 8 / 1000
+    print(f"HTTP responses ({mbit} Mbit/s link)")
+    print(f"{'payload':>12} {'format':>16} {'bytes':>10} {'cpu ms':>8} {'total ms':>9}")
+    for name, obj in cases.items():
+        for encoding, encode in encoders:
+            body, encode_ms = timed(lambda: encode(obj))
+            for compression, compress in compressors:
+                sent, compress_ms = timed(lambda: compress(body))
+                cpu = encode_ms + compress_ms
+                print(f"{name:>12} {encoding + '+' + compression:>16} {len(sent):>10} "
+                      f"{cpu:>8.2f} {cpu + len(sent) / bytes_per_ms:>9.2f}")
+
+
+def wire(election):
+    codecs = [("none", lambda data: data), ("zlib-1", lambda data: zlib.compress(data, 1)),
+              ("zlib-6", lambda data: zlib.compress(data, 6))]
+    if zstandard is not None:
+        codecs.append(("zstd", zstandard.ZstdCompressor().compress))
+    if snappy is not None:
+        codecs.append(("snappy", snappy.compress))
+
+    document = bson.encode(election)
+    print(f"\nMongoDB wire: election document with {len(election['votes'])} vote entries")
+    print(f"{'codec':>12} {'bytes':>10} {'ratio':>7} {'ms':>8}")
+    for name, compress in codecs:
+        sent, ms = timed(lambda: compress(document))
+        print(f"{name:>12} {len(sent):>10} {len(document) / len(sent):>6.1f}x {ms:>8.2f}")
+
+
+def main(voters=100000, mbit=10):
+    cases, election = payloads(voters)
+    http(cases, mbit)
+    wire(election)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
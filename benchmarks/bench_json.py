@@ -0,0 +1,69 @@
+"""
+Benchmark for JSON encoding of listing and results payloads.
+
+Compares the stdlib encoder with manual ``str``/``isoformat`` conversion (what
+handlers used to do), the app's JSON provider on the stdlib path, and the
+provider with orjson (when installed).
+
+Usage: python benchmarks/bench_json.py [iterations]
+"""
+
+import json
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from bson.objectid import ObjectId
+from app import create_app
+from json_provider import orjson
+
+rng = random.Random(42)
+ELECTIONS = [
+    {
+        "_id": ObjectId(),
+        "name": f"NA-{i} General Election",
+        "start_date": datetime(2024, 2, 8, 8) + timedelta(hours=i % 24),
+        "end_date": datetime(2024, 2, 8, 17) + timedelta(hours=i % 24),
+    }
+    for i in range(5000)
+]
+RESULTS = {
+    "results": [
+        {"name": f"Candidate {i}", "party": f"Party {i % 40}", "votes": rng.randint(0, 250000)}
+        for i in range(300)
+    ],
+    "winner": {"name": "Candidate 7", "party": "Party 7", "votes": 250000},
+}
+
+
+def manual(elections):
+    return json.dumps([
+        {"election_id": str(e["_id"]), "name": e["name"],
+         "start_date": e["start_date"].isoformat(), "end_date": e["end_date"].isoformat()}
+        for e in elections
+    ])
+
+
+def main(iterations=50):
+    cases = [("stdlib + manual conversion", lambda: manual(ELECTIONS))]
+    stdlib_app = create_app({'EMS_FAST_JSON': False})
+    cases.append(("provider (stdlib)", lambda: stdlib_app.json.dumps(ELECTIONS)))
+    cases.append(("provider (stdlib) results", lambda: stdlib_app.json.dumps(RESULTS)))
+    if orjson is not None:
+        fast_app = create_app({'EMS_FAST_JSON': True})
+        cases.append(("provider (orjson)", lambda: fast_app.json.dumps(ELECTIONS)))
+        cases.append(("provider (orjson) results", lambda: fast_app.json.dumps(RESULTS)))
+    else:
+        print("orjson not installed; skipping the fast encoder")
+
+    print(f"{len(ELECTIONS)} elections / {len(RESULTS['results'])} result rows")
+    for label, fn in cases:
+        seconds = timeit.timeit(fn, number=iterations)
+        print(f"{label:<28} {seconds / iterations * 1000:8.2f} ms/response")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,97 @@
+"""
+Benchmark for the parallel recount engine.
+
+Loads a synthetic election of N ballots (default 1M) into a MongoDB
+database, then recounts it through ``recount()`` with 1, 2, 4, ... worker
+processes up to the number of cores. Every run plans partitions on the
+``(election_id, shard, seq)`` index and counts them with ``count_partition``,
+the same path as ``flask ems recount``. Workers open their own connections.
+
+The ballots are loaded into ``MONGO_URI`` (default
+``mongodb://localhost:27017``), database ``ems_bench``, and removed
+afterwards.
+
+Usage: python benchmarks/bench_recount.py [ballots] [partition_size]
+"""
+
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+from ballot_log import DEFAULT_SHARDS, COUNTED, ballot_hash
+from datagen import load
+from recount import recount
+
+CANDIDATES = [f"candidate-{i}" for i in range(12)]
+WEIGHTS = [12 - i for i in range(12)]
+DBNAME = "ems_bench"
+
+
+def ballots(election_id, count, shards=DEFAULT_SHARDS):
+    """Counted ballots spread evenly over the shards."""
+    rng = random.Random(0)
+    cast_at = datetime(2024, 1, 1, 8)
+    for index, candidate_id in enumerate(rng.choices(CANDIDATES, WEIGHTS, k=count)):
+        shard, seq = index % shards, index // shards + 1
+        when = cast_at + timedelta(milliseconds=index)
+        yield {
+            "_id": f"{election_id}:{shard}:{seq}",
+            "election_id": election_id,
+            "shard": shard,
+            "seq": seq,
+            "candidate_id": candidate_id,
+            "cast_at": when,
+            "status": COUNTED,
+            "hash": ballot_hash(election_id, shard, seq, candidate_id, when),
+        }
+
+
+def main(count=1000000, partition_size=250000):
+    uri = os.getenv("MONGO_URI") or "mongodb://localhost:27017"
+    db = MongoClient(uri)[DBNAME]
+    db.ballots.create_index([("election_id", 1), ("shard", 1), ("seq", 1)], unique=True)
+
+    election_id = ObjectId()
+    tally = {}
+
+    def counted(documents):
+        for ballot in documents:
+            tally[ballot["candidate_id"]] = tally.get(ballot["candidate_id"], 0) + 1
+            yield ballot
+
+    started = time.perf_counter()
+    load(db.ballots, counted(ballots(election_id, count)), 10000)
+    election = {"_id": election_id, "name": "recount benchmark", "candidates": [], "votes": tally}
+    db.elections.insert_one(election)
+    print(f"{count} ballots loaded in {time.perf_counter() - started:.1f} s")
+
+    cores = os.cpu_count() or 1
+    workers = [1]
+    while workers[-1] * 2 <= cores:
+        workers.append(workers[-1] * 2)
+    if workers[-1] != cores:
+        workers.append(cores)
+
+    try:
+        baseline = None
+        for processes in workers:
+            started = time.perf_counter()
+            report = recount(db, election, workers=processes, partition_size=partition_size,
+                             source=(uri, DBNAME))
+            seconds = time.perf_counter() - started
+            baseline = baseline or seconds
+            assert not report["discrepancies"] and report["ballots"] == count, "recount disagrees with the tally"
+            print(f"{processes:>3} workers {seconds:8.2f} s  {count / seconds / 1e6:6.2f} M ballots/s"
+                  f"  {report['partitions']} partitions  speedup {baseline / seconds:5.2f}x")
+    finally:
+        db.ballots.delete_many({"election_id": election_id})
+        db.elections.delete_one({"_id": election_id})
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,51 @@
+"""
+Benchmark for the in-memory name search index.
+
+Indexes N synthetic voter names (default 1M) from the seeded dataset
+generator, then times prefix searches of one to four letters and two-word
+queries, reporting the median and 99th percentile latency per query kind.
+
+Usage: python benchmarks/bench_search.py [voters] [queries]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from datagen import DatasetGenerator
+from search import PrefixIndex
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def main(voters=1000000, queries=2000):
+    names = [(voter["cnic"], voter["name"]) for voter in DatasetGenerator(seed=0).voters(voters)]
+    started = time.perf_counter()
+    index = PrefixIndex()
+    index.build(names)
+    print(f"{voters} voters indexed in {time.perf_counter() - started:.2f} s")
+
+    rng = random.Random(0)
+    kinds = {
+        "1 letter": lambda name: name[:1],
+        "2 letters": lambda name: name[:2],
+        "4 letters": lambda name: name[:4],
+        "two words": lambda name: f"{name.split()[0]} {name.split()[1][:2]}",
+    }
+    for kind, make_query in kinds.items():
+        samples = []
+        for _ in range(queries):
+            query = make_query(rng.choice(names)[1])
+            started = time.perf_counter()
+            index.search(query, 20)
+            samples.append((time.perf_counter() - started) * 1000)
+        print(f"{kind:>10}  p50 {percentile(samples, 0.5):7.3f} ms  p99 {percentile(samples, 0.99):7.3f} ms")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,42 @@
+"""
+Startup-time benchmark for worker processes.
+
+Each sample runs in a fresh interpreter so module import cost is included.
+Compares building the app through ``create_app`` (lazy MongoDB client) with
+creating the PyMongo client eagerly, the way the app used to at import time.
+
+Usage: python benchmarks/bench_startup.py [runs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/evote")
+
+LAZY = "import app; app.create_app()"
+EAGER = (
+    "import app; from flask_pymongo import PyMongo; "
+    "PyMongo(app.create_app())"
+)
+
+
+def sample(code):
+    env = dict(os.environ, PYTHONPATH=SRC, MONGO_URI=URI)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+    return time.perf_counter() - start
+
+
+def main(runs=10):
+    for label, code in (("lazy create_app", LAZY), ("eager PyMongo", EAGER)):
+        timings = [sample(code) for _ in range(runs)]
+        print(f"{label:<16} median {statistics.median(timings) * 1000:8.1f} ms"
+              f"  min {min(timings) * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,56 @@
+"""
+Micro-benchmark for request validation overhead.
+
+Times the compiled schemas in ``validation.py`` on valid and malformed payloads
+and compares them with the hand-written parsing the handlers used before.
+
+Usage: python benchmarks/bench_validation.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+from bson.objectid import ObjectId
+from validation import ValidationError, REGISTER_VOTER, ELECTION, CAST_VOTE
+
+PAYLOADS = {
+    "register_voter": (REGISTER_VOTER, {"name": "John Doe", "cnic": "35202-1234567-1", "dob": "2000-01-01"}),
+    "create_election": (ELECTION, {
+        "name": "General Election",
+        "start_date": "2024-12-12T08:00",
+        "end_date": "2024-12-12T17:00",
+        "candidate_ids": [str(ObjectId()) for _ in range(20)],
+    }),
+    "cast_vote": (CAST_VOTE, {"election_id": str(ObjectId()), "candidate_id": str(ObjectId())}),
+    "cast_vote (malformed)": (CAST_VOTE, {"election_id": "bad", "candidate_id": str(ObjectId())}),
+}
+
+
+def validate(schema, payload):
+    try:
+        schema.validate(payload)
+    except ValidationError:
+        pass
+
+
+def hand_parsed_election(payload):
+    datetime.fromisoformat(payload.get('start_date'))
+    datetime.fromisoformat(payload.get('end_date'))
+    [ObjectId(c) for c in payload.get('candidate_ids')]
+
+
+def main(iterations=100000):
+    for label, (schema, payload) in PAYLOADS.items():
+        seconds = timeit.timeit(lambda: validate(schema, payload), number=iterations)
+        print(f"{label:<24} {seconds / iterations * 1e6:7.2f} us/request")
+
+    payload = PAYLOADS["create_election"][1]
+    seconds = timeit.timeit(lambda: hand_parsed_election(payload), number=iterations)
+    print(f"{'create_election (hand)':<24} {seconds / iterations * 1e6:7.2f} us/request")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,224 @@
+"""
+Admin mutations shared by the single-item endpoints and the batch API.
+
+Each operation takes the database and an optional client session, so the same
+code runs on its own or inside a multi-document transaction. Operations raise
+``OperationError`` with a user-facing message when a change is rejected.
+
+``patch_election`` only runs the checks a change needs: renaming an election
+does not re-check its schedule or re-resolve its candidates.
+"""
+
+from lifecycle import initial_status, CERTIFIED
+from eligibility import is_eligible, eligible_from, CANDIDATE_AGE
+from validation import (
+    ValidationError, Schema, Field, String, DateTime, ObjectIdField, ListOf, ADD_CANDIDATE
+)
+
+MAX_BATCH_OPERATIONS = 100
+
+
+class OperationError(Exception):
+    """Raised when an admin operation is rejected."""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def find_schedule_conflict(db, constituency, start_date, end_date, exclude_id=None, session=None):
+    """Finds an election in the same constituency whose schedule overlaps the given one."""
+    query = {
+        "constituency": constituency,
+        "start_date": {"$lte": end_date},
+        "end_date": {"$gte": start_date}
+    }
+    if exclude_id is not None:
+        query["_id"] = {"$ne": exclude_id}
+    return db.elections.find_one(query, {"_id": 1}, session=session)
+
+
+def resolve_candidates(db, candidate_ids, session=None):
+    """Looks up candidates in one query, keeping the requested order and dropping unknown IDs."""
+    found = {
+        candidate["_id"]: candidate
+        for candidate in db.candidates.find(
+            {"_id": {"$in": list(candidate_ids)}}, {"name": 1, "party": 1}, session=session
+        )
+    }
+    return [
+        {"_id": str(found[candidate_id]["_id"]), "name": found[candidate_id]["name"],
+         "party": found[candidate_id]["party"]}
+        for candidate_id in dict.fromkeys(candidate_ids) if candidate_id in found
+    ]
+
+
+def insert_candidate(db, data, session=None):
+    """Adds a candidate if they are old enough and not already registered. Returns the new ID."""
+    if not is_eligible(data['dob'], CANDIDATE_AGE):
+        raise OperationError("Candidate must be at least 25 years old.")
+
+    if db.candidates.find_one({"cnic": data['cnic'], "dob": data['dob']}, {"_id": 1}, session=session):
+        raise OperationError("Candidate already exists.")
+
+    return db.candidates.insert_one({
+        "name": data['name'],
+        "party": data['party'],
+        "cnic": data['cnic'],
+        "dob": data['dob'],
+        "eligible_from": eligible_from(data['dob'], CANDIDATE_AGE)
+    }, session=session).inserted_id
+
+
+def patch_election(db, election_id, changes, session=None):
+    """Applies a partial update to an election. Returns the fields that were set."""
+    update = {}
+    if 'name' in changes:
+        update['name'] = changes['name']
+
+    if {'start_date', 'end_date', 'constituency'} & changes.keys():
+        current = db.elections.find_one(
+            {"_id": election_id}, {"start_date": 1, "end_date": 1, "constituency": 1}, session=session
+        )
+        if not current:
+            raise OperationError("Election not found.")
+        start_date = changes.get('start_date', current['start_date'])
+        end_date = changes.get('end_date', current['end_date'])
+        constituency = changes.get('constituency', current.get('constituency'))
+        if start_date >= end_date:
+            raise OperationError("Invalid election schedule.")
+        if find_schedule_conflict(db, constituency, start_date, end_date, election_id, session):
+            raise OperationError("Election schedule conflicts with an existing election.")
+        update.update({
+            "start_date": start_date,
+            "end_date": end_date,
+            "constituency": constituency,
+            "status": initial_status(start_date, end_date)
+        })
+
+    if 'candidate_ids' in changes:
+        update['candidates'] = resolve_candidates(db, changes['candidate_ids'], session)
+
+    if not update:
+        raise OperationError("No changes to apply.")
+
+    modifier = {"$set": update}
+    # A new schedule or roster invalidates a tally frozen at close
+    if update.keys() - {'name'}:
+        modifier["$unset"] = {"final_results": ""}
+    result = db.elections.update_one(
+        {"_id": election_id, "status": {"$ne": CERTIFIED}}, modifier, session=session
+    )
+    if result.matched_count == 0:
+        raise OperationError("Election not found.")
+    return update
+
+
+def attach_candidates(db, election_id, candidate_ids, session=None):
+    """Adds candidates to an election's roster, keeping the ones already on it."""
+    candidates = resolve_candidates(db, candidate_ids, session)
+    result = db.elections.update_one(
+        {"_id": election_id, "status": {"$ne": CERTIFIED}},
+        {"$addToSet": {"candidates": {"$each": candidates}}, "$unset": {"final_results": ""}},
+        session=session
+    )
+    if result.matched_count == 0:
+        raise OperationError("Election not found.")
+    return candidates
+
+
+def _election_patch_schema(**fields):
+    return Schema(
+        name=String(required=False),
+        start_date=DateTime(required=False),
+        end_date=DateTime(required=False),
+        candidate_ids=ListOf(ObjectIdField(), required=False),
+        constituency=String(max_length=50, required=False),
+        **fields
+    )
+
+
+ELECTION_PATCH = _election_patch_schema()
+UPDATE_ELECTION_OP = _election_patch_schema(election_id=ObjectIdField())
+ATTACH_CANDIDATES_OP = Schema(election_id=ObjectIdField(), candidate_ids=ListOf(ObjectIdField()))
+RESCHEDULE_OP = Schema(election_id=ObjectIdField(), start_date=DateTime(), end_date=DateTime())
+# Operations are validated one by one, against the schema for their "op"
+BATCH = Schema(operations=ListOf(Field(), max_items=MAX_BATCH_OPERATIONS))
+
+
+def _resolve_refs(operation, refs):
+    """Replaces ``@ref`` candidate IDs with the IDs of candidates added earlier in the batch."""
+    candidate_ids = operation.get('candidate_ids')
+    if not isinstance(candidate_ids, list):
+        return operation
+    resolved = []
+    for candidate_id in candidate_ids:
+        if isinstance(candidate_id, str) and candidate_id.startswith('@'):
+            if candidate_id[1:] not in refs:
+                raise OperationError(f"Unknown candidate reference '{candidate_id}'.")
+            candidate_id = refs[candidate_id[1:]]
+        resolved.append(candidate_id)
+    return dict(operation, candidate_ids=resolved)
+
+
+def _add_candidate(db, operation, refs, session):
+    candidate_id = insert_candidate(db, ADD_CANDIDATE.validate(operation), session)
+    if operation.get('ref'):
+        refs[operation['ref']] = str(candidate_id)
+    return {"candidate_id": candidate_id}
+
+
+def _update_election(db, operation, refs, session):
+    changes = UPDATE_ELECTION_OP.validate(_resolve_refs(operation, refs))
+    election_id = changes.pop('election_id')
+    return patch_election(db, election_id, changes, session)
+
+
+def _attach_candidates(db, operation, refs, session):
+    data = ATTACH_CANDIDATES_OP.validate(_resolve_refs(operation, refs))
+    return {"candidates": attach_candidates(db, data['election_id'], data['candidate_ids'], session)}
+
+
+def _reschedule(db, operation, refs, session):
+    data = RESCHEDULE_OP.validate(operation)
+    election_id = data.pop('election_id')
+    return patch_election(db, election_id, data, session)
+
+
+BATCH_OPERATIONS = {
+    "add_candidate": _add_candidate,
+    "update_election": _update_election,
+    "attach_candidates": _attach_candidates,
+    "reschedule": _reschedule,
+}
+
+
+def _apply_all(db, operations, session=None):
+    refs = {}
+    results = []
+    for index, operation in enumerate(operations):
+        handler = BATCH_OPERATIONS.get(operation.get('op')) if isinstance(operation, dict) else None
+        if handler is None:
+            raise OperationError(f"Operation {index}: unknown operation.")
+        try:
+            results.append(handler(db, operation, refs, session))
+        except (OperationError, ValidationError) as e:
+            raise OperationError(f"Operation {index} ({operation['op']}): {e}") from None
+    return results
+
+
+def run_batch(db, operations, client=None):
+    """Applies a list of admin operations in order and returns their results.
+
+    With a ``client`` the batch runs in one transaction (requires a replica set)
+    and is all-or-nothing. Without one, operations are applied until the first
+    failure.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise OperationError("A batch needs at least one operation.")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise OperationError(f"A batch can contain at most {MAX_BATCH_OPERATIONS} operations.")
+    if client is None:
+        return _apply_all(db, operations)
+    with client.start_session() as session:
+        return session.with_transaction(lambda s: _apply_all(db, operations, s))
@@ -0,0 +1,171 @@
+"""
+Admission control and load shedding.
+
+Every request is assigned a priority class by endpoint. Each class has its own
+concurrency limit, a bounded wait queue and a maximum wait. When a class is
+saturated, the request is shed immediately with a 503 and a ``Retry-After``
+header instead of queueing without bound. ``/cast_vote`` gets its own
+generous class, so floods of listings or analytics cannot take vote slots, and
+once ``EMS_ADMISSION_TOTAL`` requests are in flight every other class is shed
+so the vote path keeps the remaining capacity.
+
+Config (``EMS_ADMISSION``), per class: ``limit`` (concurrent requests),
+``queue`` (waiting requests) and ``timeout`` (seconds a request may wait).
+Counters are available from ``/admission_metrics``.
+"""
+
+import threading
+import time
+from flask import request, jsonify
+
+EXTENSION_KEY = "ems_admission"
+ENVIRON_KEY = "ems.admission_class"
+
+VOTE = 'vote'
+INTERACTIVE = 'interactive'
+LISTING = 'listing'
+ANALYTICS = 'analytics'
+
+DEFAULT_CLASSES = {
+    VOTE: {"limit": 64, "queue": 256, "timeout": 2.0},
+    INTERACTIVE: {"limit": 32, "queue": 64, "timeout": 1.0},
+    LISTING: {"limit": 16, "queue": 32, "timeout": 0.5},
+    ANALYTICS: {"limit": 4, "queue": 8, "timeout": 0.25},
+}
+
+ENDPOINT_CLASSES = {
+    'ems.cast_vote': VOTE,
+    'ems.edge_sync': VOTE,
+    'ems.get_candidates': LISTING,
+    'ems.available_elections': LISTING,
+    'ems.all_elections': LISTING,
+    'ems.get_election': LISTING,
+    'ems.search_voters': LISTING,
+    'ems.search_candidates': LISTING,
+    'ems.get_results': ANALYTICS,
+    'ems.verify_ballots': ANALYTICS,
+    'ems.recount_election': ANALYTICS,
+    'ems.turnout': ANALYTICS,
+    'ems.warmup_election': ANALYTICS,
+}
+
+# Never shed: static assets, the metrics endpoint itself and readiness probes
+EXEMPT_ENDPOINTS = {'static', 'ems.admission_metrics', 'ems.readiness'}
+
+
+class AdmissionClass:
+    """A concurrency limit with a bounded, time-limited wait queue."""
+
+    def __init__(self, name, limit, queue, timeout):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+
+    def acquire(self):
+        """Admits the request, waiting if needed. Returns False if it was shed."""
+        with self._condition:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue:
+                self.shed += 1
+                return False
+            self.waiting += 1
+            try:
+                deadline = time.monotonic() + self.timeout
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        self.shed += 1
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def reject(self):
+        """Counts a request shed before it reached this class's queue."""
+        with self._condition:
+            self.shed += 1
+
+    def metrics(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+        }
+
+
+class AdmissionController:
+    """Assigns requests to admission classes and sheds them under overload."""
+
+    def __init__(self, app=None):
+        self.classes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config.get("EMS_ADMISSION") or {}
+        for name, defaults in DEFAULT_CLASSES.items():
+            self.classes[name] = AdmissionClass(name, **dict(defaults, **config.get(name, {})))
+        self.retry_after = str(app.config.get("EMS_ADMISSION_RETRY_AFTER", 1))
+        self.total_limit = app.config.get("EMS_ADMISSION_TOTAL", 96)
+        app.extensions[EXTENSION_KEY] = self
+        if app.config.get("EMS_ADMISSION_ENABLED", True):
+            app.before_request(self._admit)
+            app.teardown_request(self._release)
+
+    def class_for(self, endpoint):
+        return self.classes[ENDPOINT_CLASSES.get(endpoint, INTERACTIVE)]
+
+    def _admit(self):
+        if request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        admission_class = self.class_for(request.endpoint)
+        if admission_class.name != VOTE and self.in_flight() >= self.total_limit:
+            admission_class.reject()
+            return self._shed_response()
+        if not admission_class.acquire():
+            return self._shed_response()
+        request.environ[ENVIRON_KEY] = admission_class
+        return None
+
+    def _shed_response(self):
+        response = jsonify({
+            "success": False,
+            "message": "The server is busy. Please try again shortly.",
+            "data": None
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = self.retry_after
+        return response
+
+    def in_flight(self):
+        return sum(c.active for c in self.classes.values())
+
+    def _release(self, exc=None):
+        admission_class = request.environ.pop(ENVIRON_KEY, None)
+        if admission_class is not None:
+            admission_class.release()
+
+    def metrics(self):
+        return {name: c.metrics() for name, c in self.classes.items()}
@@ -1,23 +1,93 @@
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for
-from flask_pymongo import PyMongo
+from flask import Flask, Blueprint, current_app, request, jsonify, g, render_template, session, redirect, url_for
 from datetime import datetime
 from functools import wraps
 from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from dotenv import load_dotenv
+from db import mongo
+from idempotency import idempotent
+from validation import validate_json, ValidationError, REGISTER_VOTER, ADD_CANDIDATE, ELECTION, CAST_VOTE
+from indexes import ensure_indexes, ensure_indexes_in_background
+from json_provider import EMSJSONProvider
+from voter_roll import get_voter_roll
+from results import compute_results
+from lifecycle import LifecycleScheduler, initial_status, certify, FINAL, CERTIFIED
+from admission import AdmissionController
+from response_compression import ResponseCompressor
+import invalidation
+from invalidation import (
+    get_cache, publish, load_election, load_candidate, load_candidate_list, load_open_elections,
+    ELECTIONS, CANDIDATES, RESULTS, VOTERS, ALL
+)
+import search
+from search import get_voter_search, get_candidate_search, search_cnic, is_cnic_prefix, DEFAULT_LIMIT, MAX_LIMIT
+from query_profiling import QueryProfiler
+from ballot_log import record_vote, verify_election, DEFAULT_SHARDS
+from recount import recount
+import edge
+from edge import get_edge_store
+from datagen import populate
+from warmup import Warmup, WarmupError, get_warmup
+from eligibility import (
+    is_eligible, eligible_from, eligibility_dates, turnout_by_age_band, VOTING_AGE, CANDIDATE_AGE
+)
+from admin_ops import (
+    OperationError, find_schedule_conflict, resolve_candidates, insert_candidate,
+    patch_election, run_batch, ELECTION_PATCH, BATCH
+)
 import os
-
-load_dotenv()
-
-app = Flask(__name__)
-app.secret_key = 'your_secret_key'
-
-# Configure MongoDB
-app.config["MONGO_URI"] = os.getenv("MONGO_URI")
-app.config["MONGO_DBNAME"] = "evote"
-mongo = PyMongo(app)
+import click
+
+bp = Blueprint('ems', __name__)
+mongo.on_connect(ensure_indexes_in_background)
+mongo.on_connect(invalidation.start_bus)
+
+def create_app(config=None):
+    """Builds a configured application; MongoDB is connected lazily on first use."""
+    load_dotenv()
+
+    app = Flask(__name__)
+    app.json = EMSJSONProvider(app)
+    app.secret_key = 'your_secret_key'
+
+    # Configure MongoDB
+    app.config["MONGO_URI"] = os.getenv("MONGO_URI")
+    app.config["MONGO_DBNAME"] = "evote"
+    if config:
+        app.config.update(config)
+
+    mongo.init_app(app)
+    # Registered first so it runs last, after every other after_request hook
+    ResponseCompressor(app)
+    AdmissionController(app)
+    QueryProfiler(app)
+    invalidation.init_app(app)
+    edge.init_app(app)
+    search.init_app(app)
+    Warmup(app)
+    app.register_blueprint(bp)
+
+    # Run the lifecycle scheduler in-process, or as its own process with `flask ems run-scheduler`
+    if app.config.get("EMS_SCHEDULER_ENABLED"):
+        app.extensions['ems_scheduler'] = LifecycleScheduler(
+            app, app.config.get("EMS_SCHEDULER_INTERVAL", 60.0)
+        ).start()
+    return app
+
+_default_app = None
+
+def __getattr__(name):
+    # ``from app import app`` keeps working, but the default app is only built when asked for
+    global _default_app
+    if name == 'app':
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Initialize admin user
-# @app.before_first_request
+# @bp.before_app_first_request
 # def create_admin():
 #     if not mongo.db.admins.find_one({"cnic": "admin_cnic"}):
 #         mongo.db.admins.insert_one({
@@ -34,7 +104,7 @@ def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user' not in session:
-            return redirect(url_for('login_page'))
+            return redirect(url_for('ems.login_page'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -47,14 +117,14 @@ def admin_required(f):
     return decorated_function
 
 # User Login
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def login():
     data = request.json
     cnic = data.get('cnic')
     dob = data.get('dob')
 
-    user = mongo.db.voters.find_one({"cnic": cnic, "dob": dob})
-    if user:
+    user = get_voter_roll().lookup(cnic)
+    if user and user['dob'] == dob:
         session['user'] = {"id": user['cnic'], "role": "voter"}
         return format_response(True, "Login successful", {"role": "voter"})
 
@@ -67,252 +137,547 @@ def login():
     return format_response(False, "Invalid credentials")
 
 # Voter Registration
-@app.route('/register_voter', methods=['POST'])
+@bp.route('/register_voter', methods=['POST'])
 @admin_required
+@validate_json(REGISTER_VOTER)
 def register_voter():
-    data = request.json
-    name = data.get('name')
-    cnic = data.get('cnic')
-    dob = data.get('dob')
-
-    dob_date = datetime.strptime(dob, "%Y-%m-%d")
-    age = (datetime.now() - dob_date).days // 365
-
-    if mongo.db.voters.find_one({"cnic": cnic}):
+    data = g.payload
+    name = data['name']
+    cnic = data['cnic']
+    dob = data['dob']
+    constituency = data.get('constituency')
+
+    voter_roll = get_voter_roll()
+    if voter_roll.is_registered(cnic):
         return format_response(False, "Voter already registered.")
-    if age < 18:
+    if not is_eligible(dob, VOTING_AGE):
         return format_response(False, "Voter must be at least 18 years old.")
 
-    mongo.db.voters.insert_one({"name": name, "cnic": cnic, "dob": dob, "age": age, "voted": False})
+    voter = {
+        "name": name,
+        "cnic": cnic,
+        "dob": dob,
+        "constituency": constituency,
+        "eligible_from": eligible_from(dob, VOTING_AGE),
+        "voted": False
+    }
+    # The roll can lag behind other processes; the unique index has the final say
+    try:
+        mongo.db.voters.insert_one(voter)
+    except DuplicateKeyError:
+        return format_response(False, "Voter already registered.")
+    voter_roll.add(voter)
+    publish((VOTERS, cnic))
     return format_response(True, "Voter registered successfully.")
 
 # Candidate Management
-@app.route('/add_candidate', methods=['POST'])
+@bp.route('/add_candidate', methods=['POST'])
 @admin_required
+@validate_json(ADD_CANDIDATE)
 def add_candidate():
-    data = request.json
-    name = data.get('name')
-    party = data.get('party')
-    cnic = data.get('cnic')
-    dob = data.get('dob')
-
+    data = g.payload
     try:
-        dob_date = datetime.strptime(dob, "%Y-%m-%d")
-        age = (datetime.now() - dob_date).days // 365
-    except ValueError:
-        return format_response(False, "Invalid date format. Use YYYY-MM-DD.")
-
-    if age < 25:
-        return format_response(False, "Candidate must be at least 25 years old.")
-
-    if mongo.db.candidates.find_one({"cnic": cnic, "dob": dob}):
-        return format_response(False, "Candidate already exists.")
-
-    mongo.db.candidates.insert_one({"name": name, "party": party, "cnic": cnic, "dob": dob, "age": age})
+        candidate_id = insert_candidate(mongo.db, data)
+    except OperationError as e:
+        return format_response(False, e.message)
+    publish((CANDIDATES, candidate_id))
     return format_response(True, "Candidate added successfully.")
 
 # Get all candidates
-@app.route('/get_candidates', methods=['GET'])
+@bp.route('/get_candidates', methods=['GET'])
 @login_required
 def get_candidates():
-    candidates = mongo.db.candidates.find()
-    candidate_list = [{"candidate_id": str(candidate["_id"]), "name": candidate["name"], "party": candidate["party"]} for candidate in candidates]
+    store = get_edge_store(current_app)
+    if store is not None:
+        candidate_list = [{"candidate_id": candidate["_id"], "name": candidate["name"], "party": candidate["party"]}
+                          for candidate in store.candidates()]
+        return format_response(True, "Candidates retrieved successfully.", candidate_list)
+
+    candidate_list = get_cache().get_or_load(CANDIDATES, ALL, lambda: load_candidate_list(mongo.reader('listings')))
     return format_response(True, "Candidates retrieved successfully.", candidate_list)
 
+# Search
+def search_params():
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    return query, limit, request.args.get('cursor') or None
+
+@bp.route('/search/voters', methods=['GET'])
+@admin_required
+def search_voters():
+    query, limit, cursor = search_params()
+    if is_cnic_prefix(query):
+        voters, next_cursor = search_cnic(mongo.reader('listings').voters, query, limit, cursor)
+    else:
+        index = get_voter_search()
+        cnics, next_cursor = index.search(query, limit, cursor)
+        voters = index.fetch(cnics, {"_id": 0, "cnic": 1, "name": 1, "constituency": 1})
+    return format_response(True, "Voters retrieved successfully.", {"results": voters, "next": next_cursor})
+
+@bp.route('/search/candidates', methods=['GET'])
+@admin_required
+def search_candidates():
+    query, limit, cursor = search_params()
+    index = get_candidate_search()
+    candidate_ids, next_cursor = index.search(query, limit, cursor)
+    candidates = [{"candidate_id": candidate["_id"], "name": candidate["name"], "party": candidate["party"]}
+                  for candidate in index.fetch(candidate_ids, {"name": 1, "party": 1})]
+    return format_response(True, "Candidates retrieved successfully.", {"results": candidates, "next": next_cursor})
+
 # Election Scheduling
-@app.route('/create_election', methods=['POST'])
+@bp.route('/create_election', methods=['POST'])
 @admin_required
+@validate_json(ELECTION)
 def create_election():
-    data = request.json
-    name = data.get('name')
-    start_date = datetime.fromisoformat(data.get('start_date'))
-    end_date = datetime.fromisoformat(data.get('end_date'))
-    candidate_ids = data.get('candidate_ids')
+    data = g.payload
+    name = data['name']
+    start_date = data['start_date']
+    end_date = data['end_date']
+    candidate_ids = data['candidate_ids']
+    constituency = data.get('constituency')
 
     if start_date >= end_date:
         return format_response(False, "Invalid election schedule.")
 
     # Check for scheduling conflicts
-    conflict = mongo.db.elections.find_one({
-        "$or": [
-            {"start_date": {"$lte": end_date, "$gte": start_date}},
-            {"end_date": {"$lte": end_date, "$gte": start_date}},
-            {"start_date": {"$lte": start_date}, "end_date": {"$gte": end_date}}
-        ]
-    })
-    if conflict:
+    if find_schedule_conflict(mongo.db, constituency, start_date, end_date):
         return format_response(False, "Election schedule conflicts with an existing election.")
 
-    candidates = []
-    for candidate_id in candidate_ids:
-        candidate = mongo.db.candidates.find_one({"_id": ObjectId(candidate_id)})
-        if candidate:
-            candidates.append({"_id": str(candidate["_id"]), "name": candidate["name"], "party": candidate["party"]})
+    candidates = resolve_candidates(mongo.db, candidate_ids)
 
-    mongo.db.elections.insert_one({
+    election_id = mongo.db.elections.insert_one({
         "name": name,
+        "constituency": constituency,
         "start_date": start_date,
         "end_date": end_date,
+        "status": initial_status(start_date, end_date),
         "candidates": candidates,
         "votes": {}
-    })
+    }).inserted_id
+    publish((ELECTIONS, election_id))
     return format_response(True, "Election created successfully.", {"candidates": candidates})
 
-@app.route('/edit_election/<election_id>', methods=['PUT'])
+@bp.route('/edit_election/<election_id>', methods=['PUT'])
 @admin_required
+@validate_json(ELECTION)
 def edit_election(election_id):
-    data = request.json
-    name = data.get('name')
-    start_date = datetime.fromisoformat(data.get('start_date'))
-    end_date = datetime.fromisoformat(data.get('end_date'))
-    candidate_ids = data.get('candidate_ids')
+    if not ObjectId.is_valid(election_id):
+        return format_response(False, "Election not found.")
+    data = g.payload
+    name = data['name']
+    start_date = data['start_date']
+    end_date = data['end_date']
+    candidate_ids = data['candidate_ids']
+    constituency = data.get('constituency')
 
     if start_date >= end_date:
         return format_response(False, "Invalid election schedule.")
 
     # Check for scheduling conflicts
-    conflict = mongo.db.elections.find_one({
-        "_id": {"$ne": ObjectId(election_id)},
-        "$or": [
-            {"start_date": {"$lte": end_date, "$gte": start_date}},
-            {"end_date": {"$lte": end_date, "$gte": start_date}},
-            {"start_date": {"$lte": start_date}, "end_date": {"$gte": end_date}}
-        ]
-    })
-    if conflict:
+    if find_schedule_conflict(mongo.db, constituency, start_date, end_date, exclude_id=ObjectId(election_id)):
         return format_response(False, "Election schedule conflicts with an existing election.")
 
-    candidates = []
-    for candidate_id in candidate_ids:
-        candidate = mongo.db.candidates.find_one({"_id": ObjectId(candidate_id)})
-        if candidate:
-            candidates.append({"_id": str(candidate["_id"]), "name": candidate["name"], "party": candidate["party"]})
+    candidates = resolve_candidates(mongo.db, candidate_ids)
 
+    # Rescheduling re-derives the lifecycle status; certified results are never edited
     result = mongo.db.elections.update_one(
-        {"_id": ObjectId(election_id)},
+        {"_id": ObjectId(election_id), "status": {"$ne": CERTIFIED}},
         {"$set": {
             "name": name,
+            "constituency": constituency,
             "start_date": start_date,
             "end_date": end_date,
+            "status": initial_status(start_date, end_date),
             "candidates": candidates
-        }}
+        }, "$unset": {"final_results": ""}}
     )
     if result.matched_count == 0:
         return format_response(False, "Election not found.")
+    publish((ELECTIONS, election_id), (RESULTS, election_id))
     return format_response(True, "Election updated successfully.", {"candidates": candidates})
 
-@app.route('/delete_election/<election_id>', methods=['DELETE'])
+@bp.route('/edit_election/<election_id>', methods=['PATCH'])
+@admin_required
+@validate_json(ELECTION_PATCH)
+def patch_election_route(election_id):
+    if not ObjectId.is_valid(election_id):
+        return format_response(False, "Election not found.")
+    try:
+        update = patch_election(mongo.db, ObjectId(election_id), g.payload)
+    except OperationError as e:
+        return format_response(False, e.message)
+    publish((ELECTIONS, election_id), (RESULTS, election_id))
+    return format_response(True, "Election updated successfully.", update)
+
+@bp.route('/admin/batch', methods=['POST'])
+@admin_required
+@validate_json(BATCH)
+def admin_batch():
+    # Transactions need a replica set; set EMS_BATCH_TRANSACTIONS = True there for all-or-nothing batches
+    client = mongo.cx if current_app.config.get("EMS_BATCH_TRANSACTIONS", False) else None
+    try:
+        results = run_batch(mongo.db, g.payload['operations'], client)
+    except OperationError as e:
+        return format_response(False, e.message)
+    publish((ELECTIONS, ALL), (RESULTS, ALL), (CANDIDATES, ALL))
+    return format_response(True, "Batch applied successfully.", results)
+
+@bp.route('/delete_election/<election_id>', methods=['DELETE'])
 @admin_required
 def delete_election(election_id):
+    if not ObjectId.is_valid(election_id):
+        return format_response(False, "Election not found.")
     result = mongo.db.elections.delete_one({"_id": ObjectId(election_id)})
     if result.deleted_count == 0:
         return format_response(False, "Election not found.")
+    publish((ELECTIONS, election_id), (RESULTS, election_id))
     return format_response(True, "Election deleted successfully.")
 
 # Vote Casting
-@app.route('/cast_vote', methods=['POST'])
+@bp.route('/cast_vote', methods=['POST'])
 @login_required
+@validate_json(CAST_VOTE)
+@idempotent('cast_vote')
 def cast_vote():
     if session['user']['role'] == 'admin':
         return format_response(False, "Admins are not allowed to cast votes.")
     
-    data = request.json
+    data = g.payload
     voter_id = session['user']['id']
-    election_id = data.get('election_id')
-    candidate_id = data.get('candidate_id')
-
-    voter = mongo.db.voters.find_one({"cnic": voter_id})
+    store = get_edge_store(current_app)
+    if store is not None:
+        return cast_edge_vote(store, voter_id, str(data['election_id']), str(data['candidate_id']))
+    election_id = data['election_id']
+    candidate_id = str(data['candidate_id'])
+
+    validation_db = mongo.reader('vote_validation')
+    cache = get_cache()
+    voter = get_voter_roll().lookup(voter_id)
     if not voter:
         return format_response(False, "Voter not registered.")
-    
-    # Check if the voter has already voted in this election
-    if mongo.db.elections.find_one({"_id": ObjectId(election_id), f"votes.{voter_id}": {"$exists": True}}):
-        return format_response(False, "Voter has already cast a vote in this election.")
 
-    election = mongo.db.elections.find_one({"_id": ObjectId(election_id)})
+    # Election and candidate details are cached until a write invalidates them;
+    # whether the voter has voted is only decided by the conditional update below
+    election = cache.get_or_load(ELECTIONS, election_id, lambda: load_election(validation_db, election_id))
     if not election:
         return format_response(False, "Election not found.")
 
-    candidate = mongo.db.candidates.find_one({"_id": ObjectId(candidate_id)})
+    # Voters can only vote in their own constituency's elections; one without a constituency is open to all
+    if election.get('constituency') and election['constituency'] != voter.get('constituency'):
+        return format_response(False, "Election is not open to this voter's constituency.")
+
+    if voter.get('eligible_from') and voter['eligible_from'] > election['start_date']:
+        return format_response(False, "Voter was not eligible on election day.")
+
+    candidate = cache.get_or_load(CANDIDATES, candidate_id, lambda: load_candidate(validation_db, data['candidate_id']))
     if not candidate:
         return format_response(False, "Candidate not found.")
 
     current_time = datetime.now()
-    if current_time < election['start_date'] or current_time > election['end_date']:
+    if election.get('status') in FINAL or not election['start_date'] <= current_time <= election['end_date']:
         return format_response(False, "Election is not active.")
 
-    votes = election.get('votes', {})
-    votes[candidate_id] = votes.get(candidate_id, 0) + 1
-    votes[voter_id] = True  # Mark that the voter has voted in this election
-    mongo.db.elections.update_one({"_id": ObjectId(election_id)}, {"$set": {"votes": votes}})
+    # Count the vote and mark the voter in one conditional update, so concurrent
+    # requests from the same voter can never both be counted, and no vote lands
+    # outside the stored schedule or after the election has closed, whatever the
+    # cached copy says; the ballot is appended to the audit log
+    client = mongo.cx if current_app.config.get("EMS_VOTE_TRANSACTIONS", False) else None
+    shards = current_app.config.get("EMS_BALLOT_SHARDS", DEFAULT_SHARDS)
+    if not record_vote(mongo.db, election_id, voter_id, candidate_id, shards, client, current_time):
+        # Either the voter already voted or the election changed or closed since it was cached
+        cache.invalidate(ELECTIONS, election_id)
+        current = mongo.db.elections.find_one({"_id": election_id}, {"status": 1, "start_date": 1, "end_date": 1})
+        if current is None or current.get('status') in FINAL \
+                or not current['start_date'] <= current_time <= current['end_date']:
+            return format_response(False, "Election is not active.")
+        return format_response(False, "Voter has already cast a vote in this election.")
+
+    publish((RESULTS, election_id))
+    return format_response(True, "Vote cast successfully.")
+
+def cast_edge_vote(store, voter_id, election_id, candidate_id):
+    """Records a vote in the polling station's local store, to be synced later."""
+    voter = store.lookup(voter_id)
+    if not voter:
+        return format_response(False, "Voter not registered.")
+    election = store.election(election_id)
+    if not election:
+        return format_response(False, "Election not found.")
+    if election.get('constituency') and election['constituency'] != voter.get('constituency'):
+        return format_response(False, "Election is not open to this voter's constituency.")
+    if voter.get('eligible_from') and voter['eligible_from'] > election['start_date']:
+        return format_response(False, "Voter was not eligible on election day.")
+    if candidate_id not in {candidate['_id'] for candidate in election['candidates']}:
+        return format_response(False, "Candidate not found.")
+    if not election['start_date'] <= datetime.now() <= election['end_date']:
+        return format_response(False, "Election is not active.")
 
+    # The store's unique (election, voter) constraint stands in for the conditional update;
+    # a retry with the same Idempotency-Key gets the original success back
+    key = request.headers.get('Idempotency-Key')
+    if store.record_vote(election_id, voter_id, candidate_id, key) is None:
+        existing = store.existing_vote(election_id, voter_id)
+        if key and existing and existing['idempotency_key'] == key:
+            response = format_response(True, "Vote cast successfully.")
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        return format_response(False, "Voter has already cast a vote in this election.")
     return format_response(True, "Vote cast successfully.")
 
+@bp.route('/edge/sync', methods=['POST'])
+def edge_sync():
+    station = request.headers.get('X-Edge-Station')
+    if not edge.authenticate(current_app.config.get("EMS_EDGE_STATIONS") or {}, station,
+                             request.headers.get('Authorization')):
+        return format_response(False, "Unknown station or invalid token."), 403
+    try:
+        batch = edge.decode_batch(request.get_data(), request.headers.get('Content-Encoding'),
+                                  current_app.config.get("EMS_EDGE_MAX_BATCH_BYTES", edge.DEFAULT_MAX_BATCH_BYTES))
+    except ValidationError as e:
+        return format_response(False, str(e)), 400
+    if batch.get('station') != station:
+        return format_response(False, "Batch does not belong to this station."), 403
+    outcomes = edge.apply_batch(mongo.db, batch, get_voter_roll(),
+                                current_app.config.get("EMS_BALLOT_SHARDS", DEFAULT_SHARDS))
+    applied = {vote['election_id'] for vote, outcome in zip(batch['votes'], outcomes)
+               if outcome['status'] == edge.APPLIED}
+    publish(*[(RESULTS, election_id) for election_id in applied])
+    return format_response(True, "Batch synced successfully.", {"outcomes": outcomes})
+
 # Results and Analytics
-@app.route('/get_results/<election_id>', methods=['GET'])
+@bp.route('/get_results/<election_id>', methods=['GET'])
 @login_required
 def get_results(election_id):
-    election = mongo.db.elections.find_one({"_id": ObjectId(election_id)})
-    if not election:
+    if not ObjectId.is_valid(election_id):
+        return format_response(False, "Election not found.")
+
+    def load():
+        election = mongo.reader('results').elections.find_one({"_id": ObjectId(election_id)})
+        # Closed elections serve the tally frozen at close
+        return election and (election.get('final_results') or compute_results(election))
+
+    results = get_cache().get_or_load(RESULTS, election_id, load)
+    if not results:
         return format_response(False, "Election not found.")
 
-    votes = election.get('votes', {})
-    if not votes:
+    if results['winner'] is None:
         return format_response(True, "No votes have been cast yet.", {"results": [], "winner": None})
 
-    candidates = election.get('candidates', [])
-    results = []
-    for candidate in candidates:
-        candidate_id = str(candidate['_id'])
-        candidate_votes = votes.get(candidate_id, 0)
-        results.append({
-            "name": candidate['name'],
-            "party": candidate['party'],
-            "votes": candidate_votes
-        })
+    return format_response(True, "Results retrieved successfully.", results)
 
+@bp.route('/certify_election/<election_id>', methods=['POST'])
+@admin_required
+def certify_election(election_id):
+    if not ObjectId.is_valid(election_id) or not certify(mongo.db, ObjectId(election_id)):
+        return format_response(False, "Only closed elections with final results can be certified.")
+    publish((ELECTIONS, election_id), (RESULTS, election_id))
+    return format_response(True, "Election certified successfully.")
 
-    max_votes = max(results, key=lambda x: x['votes'])['votes']
-    winners = [candidate for candidate in results if candidate['votes'] == max_votes]
+@bp.route('/verify_ballots/<election_id>', methods=['POST'])
+@admin_required
+def verify_ballots(election_id):
+    if not ObjectId.is_valid(election_id):
+        return format_response(False, "Election not found.")
+    shards = verify_election(
+        mongo.db, ObjectId(election_id),
+        current_app.config.get("EMS_BALLOT_SHARDS", DEFAULT_SHARDS),
+        current_app.config.get("EMS_BALLOT_VERIFY_WORKERS", 1)
+    )
+    if not all(shard["ok"] for shard in shards):
+        return format_response(False, "Ballot log failed verification.", shards)
+    return format_response(True, "Ballot log verified successfully.", shards)
 
-    if len(winners) > 1:
-        winner = {"name": "Draw", "party": "N/A", "votes": max_votes}
-    else:
-        winner = winners[0]
+@bp.route('/recount/<election_id>', methods=['POST'])
+@admin_required
+def recount_election(election_id):
+    election = mongo.db.elections.find_one({"_id": ObjectId(election_id)}) if ObjectId.is_valid(election_id) else None
+    if not election:
+        return format_response(False, "Election not found.")
+    # Counting processes open their own connections; the default counts in this process
+    workers = current_app.config.get("EMS_RECOUNT_WORKERS", 1)
+    report = recount(mongo.db, election, current_app.config.get("EMS_BALLOT_SHARDS", DEFAULT_SHARDS), workers,
+                     source=(current_app.config["MONGO_URI"], mongo.db.name))
+    if not report["ok"]:
+        return format_response(False, "Recount does not match the stored tally.", report)
+    return format_response(True, "Recount matches the stored tally.", report)
+
+@bp.route('/turnout/<election_id>', methods=['GET'])
+@admin_required
+def turnout(election_id):
+    db = mongo.reader('results')
+    election = db.elections.find_one({"_id": ObjectId(election_id)}) if ObjectId.is_valid(election_id) else None
+    if not election:
+        return format_response(False, "Election not found.")
+    return format_response(True, "Turnout retrieved successfully.", turnout_by_age_band(db, election))
 
-    return format_response(True, "Results retrieved successfully.", {
-        "results": results,
-        "winner": winner
-    })
+@bp.route('/warmup/<election_id>', methods=['POST'])
+@admin_required
+def warmup_election(election_id):
+    if not ObjectId.is_valid(election_id):
+        return format_response(False, "Election not found.")
+    try:
+        report = get_warmup(current_app).warm(ObjectId(election_id))
+    except WarmupError as e:
+        return format_response(False, str(e))
+    return format_response(True, "Election warmed up successfully.", report)
 
-@app.route('/available_elections', methods=['GET'])
+@bp.route('/healthz/ready', methods=['GET'])
+def readiness():
+    try:
+        mongo.cx.admin.command("ping")
+        status = get_warmup(current_app).readiness(mongo.db)
+    except PyMongoError:
+        return format_response(False, "Database unavailable.", {"ready": False}), 503
+    return format_response(status["ready"], "Ready." if status["ready"] else "Warming up.", status), \
+        200 if status["ready"] else 503
+
+@bp.route('/admission_metrics', methods=['GET'])
+@admin_required
+def admission_metrics():
+    controller = current_app.extensions['ems_admission']
+    return format_response(True, "Admission metrics retrieved successfully.", controller.metrics())
+
+@bp.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    """Creates the indexes the application relies on and waits for them."""
+    ensure_indexes(current_app, mongo.db)
+    click.echo("Indexes created.")
+
+@bp.cli.command('run-scheduler')
+def run_scheduler():
+    """Runs the election lifecycle scheduler in the foreground."""
+    LifecycleScheduler(current_app._get_current_object(),
+                       current_app.config.get("EMS_SCHEDULER_INTERVAL", 60.0)).run()
+
+@bp.cli.command('verify-ballots')
+@click.argument('election_id')
+@click.option('--workers', type=int, default=None, help="Hashing processes (default: one per core).")
+@click.option('--full', is_flag=True, help="Re-verify every ballot, ignoring checkpoints.")
+def verify_ballots_command(election_id, workers, full):
+    """Verifies an election's ballot log from its last checkpoint."""
+    if not ObjectId.is_valid(election_id):
+        raise click.ClickException("Election not found.")
+    shards = verify_election(mongo.db, ObjectId(election_id),
+                             current_app.config.get("EMS_BALLOT_SHARDS", DEFAULT_SHARDS), workers, full=full)
+    for shard in shards:
+        click.echo(f"shard {shard['shard']}: " + (f"ok, {shard['verified']} new, seq {shard['seq']}"
+                                                  if shard['ok'] else shard['error']))
+    if not all(shard["ok"] for shard in shards):
+        raise SystemExit(1)
+
+@bp.cli.command('recount')
+@click.argument('election_id')
+@click.option('--workers', type=int, default=None, help="Counting processes (default: one per core).")
+def recount_command(election_id, workers):
+    """Rebuilds an election's tally from its ballots and reports discrepancies."""
+    election = mongo.db.elections.find_one({"_id": ObjectId(election_id)}) if ObjectId.is_valid(election_id) else None
+    if not election:
+        raise click.ClickException("Election not found.")
+    report = recount(mongo.db, election, current_app.config.get("EMS_BALLOT_SHARDS", DEFAULT_SHARDS),
+                     workers, source=(current_app.config["MONGO_URI"], mongo.db.name))
+    click.echo(f"{report['ballots']} ballots in {report['partitions']} partitions, "
+               f"{report['voters_marked']} voters marked")
+    for item in report["discrepancies"]:
+        click.echo(f"{item['candidate_id']} ({item['name']}): stored {item['stored']}, "
+                   f"recounted {item['recounted']}")
+    if not report["ok"]:
+        raise SystemExit(1)
+
+@bp.cli.command('seed')
+@click.option('--seed', type=int, default=0, help="Random seed; the same seed gives the same dataset.")
+@click.option('--voters', type=int, default=100000)
+@click.option('--candidates', type=int, default=1000)
+@click.option('--parties', type=int, default=11)
+@click.option('--elections', type=int, default=100)
+@click.option('--constituencies', type=int, default=100)
+@click.option('--batch-size', type=int, default=10000)
+def seed_command(seed, voters, candidates, parties, elections, constituencies, batch_size):
+    """Bulk-loads a synthetic dataset of voters, candidates, elections and ballots."""
+    report = populate(mongo.db, seed, voters, candidates, elections, constituencies, parties,
+                      current_app.config.get("EMS_BALLOT_SHARDS", DEFAULT_SHARDS), batch_size)
+    for name in ("voters", "candidates", "elections"):
+        click.echo(f"{name}: {report[name]} in {report[name + '_seconds']} s")
+    click.echo(f"ballots: {report['ballots']}")
+
+@bp.cli.command('backfill-eligibility')
+@click.option('--batch-size', type=int, default=10000)
+def backfill_eligibility_command(batch_size):
+    """Replaces the stored ``age`` of voters and candidates with ``eligible_from``."""
+    for collection, age in ((mongo.db.voters, VOTING_AGE), (mongo.db.candidates, CANDIDATE_AGE)):
+        updated = 0
+        while True:
+            people = list(collection.find({"eligible_from": {"$exists": False}}, {"dob": 1}).limit(batch_size))
+            if not people:
+                break
+            dates = eligibility_dates([person['dob'] for person in people], age)
+            collection.bulk_write([
+                UpdateOne({"_id": person['_id']}, {"$set": {"eligible_from": day}, "$unset": {"age": ""}})
+                for person, day in zip(people, dates)
+            ], ordered=False)
+            updated += len(people)
+        click.echo(f"{collection.name}: {updated} updated")
+
+@bp.cli.command('edge-provision')
+@click.option('--constituency', required=True, help="The constituency the station serves.")
+def edge_provision_command(constituency):
+    """Copies a constituency's voters and elections into the station's local store."""
+    store = get_edge_store(current_app)
+    if store is None:
+        raise click.ClickException("Set EMS_EDGE_MODE to provision a polling station.")
+    report = store.provision(mongo.db, constituency)
+    click.echo(f"{report['voters']} voters, {report['elections']} elections")
+
+@bp.cli.command('edge-sync')
+def edge_sync_command():
+    """Pushes the station's pending votes to the central server."""
+    if get_edge_store(current_app) is None:
+        raise click.ClickException("Set EMS_EDGE_MODE to sync a polling station.")
+    totals = edge.EdgeSyncer(current_app._get_current_object()).sync_once()
+    click.echo(", ".join(f"{status}: {count}" for status, count in totals.items()))
+
+@bp.route('/available_elections', methods=['GET'])
 @login_required
 def available_elections():
-    current_time = datetime.now()
-    elections = mongo.db.elections.find({"start_date": {"$lte": current_time}, "end_date": {"$gte": current_time}})
-    election_list = [{"election_id": str(election["_id"]), "name": election["name"]} for election in elections]
+    store = get_edge_store(current_app)
+    if store is not None:
+        voter = store.lookup(session['user']['id']) if session['user']['role'] == 'voter' else None
+        elections = store.active_elections(voter.get('constituency') if voter else None)
+        election_list = [{"election_id": election["election_id"], "name": election["name"]} for election in elections]
+        return format_response(True, "Available elections retrieved successfully.", election_list)
+
+    # Voters only see their constituency's elections and those open to all; admins see every active election
+    constituencies = None
+    if session['user']['role'] == 'voter':
+        voter = get_voter_roll().lookup(session['user']['id'])
+        constituencies = [voter.get('constituency') if voter else None, None]
+    elections = load_open_elections(mongo.reader('listings'), datetime.now(), constituencies)
+    election_list = [{"election_id": election["_id"], "name": election["name"]} for election in elections]
     return format_response(True, "Available elections retrieved successfully.", election_list)
 
-@app.route('/all_elections', methods=['GET'])
+@bp.route('/all_elections', methods=['GET'])
 @login_required
 def all_elections():
-    elections = mongo.db.elections.find()
-    election_list = [{"election_id": str(election["_id"]), "name": election["name"]} for election in elections]
+    elections = mongo.reader('listings').elections.find({}, {"name": 1})
+    election_list = [{"election_id": election["_id"], "name": election["name"]} for election in elections]
     return format_response(True, "All elections retrieved successfully.", election_list)
 
 # Get election details
-@app.route('/get_election/<election_id>', methods=['GET'])
+@bp.route('/get_election/<election_id>', methods=['GET'])
 @admin_required
 def get_election(election_id):
-    election = mongo.db.elections.find_one({"_id": ObjectId(election_id)})
+    if not ObjectId.is_valid(election_id):
+        return format_response(False, "Election not found.")
+    election = get_cache().get_or_load(ELECTIONS, election_id, lambda: load_election(
+        mongo.reader('listings'), ObjectId(election_id)))
     if not election:
         return format_response(False, "Election not found.")
 
     election_data = {
         "name": election["name"],
-        "start_date": election["start_date"].isoformat(),
-        "end_date": election["end_date"].isoformat(),
-        "candidates": [{"_id": str(candidate["_id"]), "name": candidate["name"], "party": candidate["party"]} for candidate in election["candidates"]]
+        "constituency": election.get("constituency"),
+        "start_date": election["start_date"],
+        "end_date": election["end_date"],
+        "candidates": [{"_id": candidate["_id"], "name": candidate["name"], "party": candidate["party"]} for candidate in election["candidates"]]
     }
     return format_response(True, "Election details retrieved successfully.", election_data)
 
@@ -320,29 +685,29 @@ def access_denied():
     return render_template('access_denied.html'), 403
 
 # Admin Dashboard
-@app.route('/admin_dashboard')
+@bp.route('/admin_dashboard')
 @admin_required
 def admin_dashboard():
     return render_template('admin_dashboard.html')
 
 # Voter Dashboard
-@app.route('/voter_dashboard')
+@bp.route('/voter_dashboard')
 @login_required
 def voter_dashboard():
     if session['user']['role'] != 'voter':
         return access_denied()
     return render_template('voter_dashboard.html')
 
-@app.route('/')
+@bp.route('/')
 @login_required
 def home():
     if session['user']['role'] == 'admin':
-        return redirect(url_for('admin_dashboard'))
-    return redirect(url_for('voter_dashboard'))
+        return redirect(url_for('ems.admin_dashboard'))
+    return redirect(url_for('ems.voter_dashboard'))
 
-@app.route('/login_page')
+@bp.route('/login_page')
 def login_page():
     return render_template('login.html')
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
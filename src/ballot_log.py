@@ -0,0 +1,390 @@
+"""
+Tamper-evident, append-only ballot log.
+
+Every counted vote appends a ballot to the ``ballots`` collection. Ballots are
+split into per-election shards. Each ballot's position in its shard comes
+from a per-shard counter in ``ballot_counters`` (one atomic ``$inc``), so
+concurrent writers never race for the same slot. A ballot's ``_id`` is
+``<election>:<shard>:<seq>``.
+
+Each ballot stores the hash of its own fields. The verifier folds those
+hashes, in ``seq`` order, into a chain per shard and stores the chain value
+in a checkpoint. Editing, removing or inserting a ballot behind a checkpoint
+changes the chain, and a gap in ``seq`` is reported as a break. Ballots are
+only chained when a verification checkpoints them: a ballot written since the
+last checkpoint is protected by nothing but its own hash, so it can be
+rewritten together with that hash without detection until it is verified.
+Verify often (e.g. at every close) to keep that window short.
+
+A vote is counted in two writes, the ballot and the tally update. With
+``EMS_VOTE_TRANSACTIONS`` they share a transaction (requires a replica set).
+Without a transaction, the ballot is written first as *pending* and carries
+the voter ID. A unique ``(election_id, voter_id)`` index allows one pending
+ballot per voter. The conditional tally update then counts the vote and
+marks the voter with the ballot's ``_id``, and the ballot is finalized as
+*counted*, which removes the voter ID. A ballot is counted only if the voter's
+marker names it, so a second request that slips in after the first ballot
+was finalized is void rather than counted twice. If a write fails part-way,
+the pending ballot is settled by the voter's next attempt, by a recount or by
+a verification, so the tally never holds a vote without a ballot. Ballots that
+were never counted are kept in their slot as *void*.
+Ballots do not keep the voter after settling, so the log does not break
+ballot secrecy.
+
+Verification re-checks each shard from its last checkpoint. The chain is
+folded in order, while ballot hashes are recomputed in batches that can be
+spread over a process pool.
+"""
+
+import hashlib
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from lifecycle import FINAL
+
+DEFAULT_SHARDS = 16
+DEFAULT_BATCH_SIZE = 50000
+
+# A slot is reserved before its ballot is written; a gap younger than this is a
+# write in progress rather than a missing ballot
+GAP_GRACE = timedelta(minutes=1)
+
+PENDING = 'pending'
+COUNTED = 'counted'
+VOID = 'void'
+
+BALLOT_FIELDS = {"_id": 0, "seq": 1, "candidate_id": 1, "cast_at": 1, "hash": 1}
+
+
+class _NotCounted(Exception):
+    """Aborts a vote transaction whose tally update did not apply."""
+
+
+def is_voter_marker(value):
+    """Whether a ``votes`` entry marks a voter rather than counting a candidate.
+
+    Voters are marked with the ``_id`` of their counted ballot; older tallies
+    mark them with ``True``.
+    """
+    return value is True or isinstance(value, str)
+
+
+def shard_for(voter_id, shards):
+    """The shard a voter's ballot goes to."""
+    digest = hashlib.blake2b(voter_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % shards
+
+
+def genesis_hash(election_id, shard):
+    """The value a shard's chain starts from."""
+    return hashlib.sha256(f"genesis|{election_id}|{shard}".encode()).hexdigest()
+
+
+def ballot_hash(election_id, shard, seq, candidate_id, cast_at):
+    """The hash of one ballot's fields."""
+    payload = f"{election_id}|{shard}|{seq}|{candidate_id}|{cast_at.isoformat()}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def chain_hash(chain, ballot):
+    """Folds a ballot's hash into its shard's chain."""
+    return hashlib.sha256(f"{chain}|{ballot}".encode()).hexdigest()
+
+
+def _now():
+    # MongoDB stores milliseconds; truncate so the stored value hashes the same
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def next_seq(db, election_id, shard, session=None):
+    """Reserves the next position in a shard."""
+    counter = db.ballot_counters.find_one_and_update(
+        {"_id": f"{election_id}:{shard}"}, {"$inc": {"seq": 1}},
+        upsert=True, return_document=ReturnDocument.AFTER, session=session
+    )
+    return counter["seq"]
+
+
+def _ballot(election_id, shard, seq, candidate_id, status):
+    cast_at = _now()
+    return {
+        "_id": f"{election_id}:{shard}:{seq}",
+        "election_id": election_id,
+        "shard": shard,
+        "seq": seq,
+        "candidate_id": candidate_id,
+        "cast_at": cast_at,
+        "status": status,
+        "hash": ballot_hash(election_id, shard, seq, candidate_id, cast_at),
+    }
+
+
+def append_ballot(db, election_id, voter_id, candidate_id, shards=DEFAULT_SHARDS, session=None, pending=False):
+    """Appends a ballot to the voter's shard and returns it.
+
+    A ``pending`` ballot keeps the voter ID until it is settled. If the write
+    fails after the slot was reserved, the slot is filled with a void ballot
+    so the shard has no gap.
+    """
+    shard = shard_for(voter_id, shards)
+    seq = next_seq(db, election_id, shard, session)
+    ballot = _ballot(election_id, shard, seq, candidate_id, PENDING if pending else COUNTED)
+    if pending:
+        ballot["voter_id"] = voter_id
+    try:
+        db.ballots.insert_one(ballot, session=session)
+    except PyMongoError:
+        if session is None:
+            try:
+                db.ballots.insert_one(_ballot(election_id, shard, seq, None, VOID))
+            except PyMongoError:
+                pass  # reported as a gap by verification
+        raise
+    return ballot
+
+
+def _count(db, election_id, voter_id, candidate_id, ballot_id, session=None, now=None):
+    """Adds a vote to the tally and marks the voter with its ballot, unless they voted already or the election closed.
+
+    With ``now``, the election must also be open at that time, so a vote is
+    never counted against a cached schedule that has since changed.
+    """
+    query = {"_id": election_id, f"votes.{voter_id}": {"$exists": False}, "status": {"$nin": FINAL}}
+    if now is not None:
+        query.update({"start_date": {"$lte": now}, "end_date": {"$gte": now}})
+    result = db.elections.update_one(
+        query,
+        {"$inc": {f"votes.{candidate_id}": 1}, "$set": {f"votes.{voter_id}": ballot_id}},
+        session=session
+    )
+    return result.modified_count == 1
+
+
+def _marker(db, election_id, voter_id):
+    """The voter's marker in the tally, or None if they have not voted."""
+    election = db.elections.find_one({"_id": election_id, f"votes.{voter_id}": {"$exists": True}},
+                                     {f"votes.{voter_id}": 1})
+    return None if election is None else election["votes"][voter_id]
+
+
+def _finalize(db, ballot, status):
+    db.ballots.update_one({"_id": ballot["_id"], "status": PENDING},
+                          {"$set": {"status": status}, "$unset": {"voter_id": ""}})
+
+
+def settle(db, ballot, count=True, now=None):
+    """Settles a pending ballot. Returns whether it is counted.
+
+    The ballot is counted if its own tally update applies now, or if the
+    voter's marker names it (an earlier attempt counted it). A ballot whose
+    voter is marked with another ballot is void. Otherwise, with ``count`` it
+    is counted now if the election is still open, and without it the ballot is
+    left to its request while the election is open and void once it closed.
+    """
+    election_id, voter_id = ballot["election_id"], ballot["voter_id"]
+    if count and _count(db, election_id, voter_id, ballot["candidate_id"], ballot["_id"], now=now):
+        _finalize(db, ballot, COUNTED)
+        return True
+    marker = _marker(db, election_id, voter_id)
+    if marker == ballot["_id"]:
+        _finalize(db, ballot, COUNTED)
+        return True
+    if marker is not None or count or \
+            db.elections.find_one({"_id": election_id, "status": {"$in": FINAL}}, {"_id": 1}) is not None:
+        _finalize(db, ballot, VOID)
+    return False
+
+
+def settle_pending(db, election_id):
+    """Settles the pending ballots a failed vote left behind. Returns how many were found.
+
+    Ballots still in flight for an open election are left to their request.
+    """
+    settled = 0
+    # Only pending ballots carry a voter, so this reads the partial voter index
+    for ballot in db.ballots.find({"election_id": election_id, "voter_id": {"$exists": True}},
+                                  {"election_id": 1, "voter_id": 1, "candidate_id": 1}):
+        settle(db, ballot, count=False)
+        settled += 1
+    return settled
+
+
+def record_vote(db, election_id, voter_id, candidate_id, shards=DEFAULT_SHARDS, client=None, now=None):
+    """Counts a vote and appends its ballot. Returns False if the voter had already voted.
+
+    With ``now``, the vote is only counted if the election is open at that time.
+
+    The tally update marks the voter in the same conditional write, so only one
+    request per voter is counted. With a ``client`` the ballot and the tally
+    update run in one transaction, which is aborted (slot included) if the
+    update does not apply. Otherwise the ballot is written first, as pending,
+    and settled after the tally update. A pending ballot left by an earlier
+    attempt is settled first, so a retry never counts a vote twice.
+    """
+    if client is not None:
+        def write(session):
+            ballot = append_ballot(db, election_id, voter_id, candidate_id, shards, session)
+            if not _count(db, election_id, voter_id, candidate_id, ballot["_id"], session, now):
+                raise _NotCounted()
+            return True
+
+        with client.start_session() as session:
+            try:
+                return session.with_transaction(write)
+            except _NotCounted:
+                return False
+
+    ballot = db.ballots.find_one({"election_id": election_id, "voter_id": voter_id})
+    if ballot is None:
+        if _marker(db, election_id, voter_id) is not None:
+            return False
+        try:
+            ballot = append_ballot(db, election_id, voter_id, candidate_id, shards, pending=True)
+        except DuplicateKeyError:
+            # A concurrent request for this voter wrote its ballot first
+            ballot = db.ballots.find_one({"election_id": election_id, "voter_id": voter_id})
+            if ballot is None:
+                raise
+    return settle(db, ballot, now=now) and ballot["candidate_id"] == candidate_id
+
+
+def hash_batch(election_id, shard, ballots):
+    """Recomputes hashes for a batch of ballots. Returns the seq of the first mismatch, or None."""
+    for ballot in ballots:
+        expected = ballot_hash(election_id, shard, ballot["seq"], ballot["candidate_id"], ballot["cast_at"])
+        if expected != ballot["hash"]:
+            return ballot["seq"]
+    return None
+
+
+def _fold(batch, seq, chain, expected=None):
+    """Checks that a batch continues the shard from ``seq`` and folds it into the chain.
+
+    ``expected`` is a ``(seq, chain)`` pair the fold must pass through.
+    Returns ``(ballots folded, chain, bad seq or None)``.
+    """
+    for folded, ballot in enumerate(batch):
+        seq += 1
+        if ballot["seq"] != seq:
+            return folded, chain, seq
+        chain = chain_hash(chain, ballot["hash"])
+        if expected is not None and expected[0] == seq and expected[1] != chain:
+            return folded, chain, seq
+    return len(batch), chain, None
+
+
+def _in_flight(ballot, seq):
+    """Whether a gap before ``ballot`` can be a slot whose write has not landed yet."""
+    return ballot["seq"] > seq + 1 and ballot["cast_at"] >= datetime.utcnow() - GAP_GRACE
+
+
+def _failed(shard, seq, error):
+    return {"shard": shard, "verified": 0, "seq": seq, "ok": False,
+            "error": f"Ballot chain broken at seq {error}."}
+
+
+def verify_shard(db, election_id, shard, executor=None, batch_size=DEFAULT_BATCH_SIZE, full=False, max_pending=4):
+    """Verifies one shard from its checkpoint and advances the checkpoint.
+
+    The checkpointed ballot itself is re-hashed first, so the chain is anchored
+    to what was verified last time. ``full`` re-verifies the whole shard and
+    checks that the chain still passes through the checkpoint. Returns
+    {"shard", "verified", "seq", "ok", "error"}.
+    """
+    checkpoint_id = f"{election_id}:{shard}"
+    checkpoint = db.ballot_checkpoints.find_one({"_id": checkpoint_id})
+    expected = None
+    if full or checkpoint is None:
+        seq, chain = 0, genesis_hash(election_id, shard)
+        expected = checkpoint and (checkpoint["seq"], checkpoint["hash"])
+    else:
+        seq, chain = checkpoint["seq"], checkpoint["hash"]
+    start_seq = seq
+
+    if seq:
+        anchor = db.ballots.find_one({"election_id": election_id, "shard": shard, "seq": seq}, BALLOT_FIELDS)
+        if anchor is None or anchor["hash"] != checkpoint["ballot"] or hash_batch(election_id, shard, [anchor]):
+            return _failed(shard, start_seq, seq)
+
+    cursor = db.ballots.find(
+        {"election_id": election_id, "shard": shard, "seq": {"$gt": seq}}, dict(BALLOT_FIELDS)
+    ).sort("seq", 1)
+
+    pending = []
+    error = None
+    last = None
+    for batch in _batches(cursor, batch_size):
+        folded, chain, error = _fold(batch, seq, chain, expected)
+        if folded:
+            pending.append(_submit(executor, election_id, shard, batch[:folded]))
+            seq, last = batch[folded - 1]["seq"], batch[folded - 1]["hash"]
+        if error is not None:
+            # A recent gap is a slot still being written; verify up to it
+            if folded < len(batch) and (expected is None or seq >= expected[0]) \
+                    and _in_flight(batch[folded], seq):
+                error = None
+            break
+        # Bound memory: wait for the oldest batches once enough are in flight
+        while len(pending) > max_pending and error is None:
+            error = pending.pop(0).result()
+        if error is not None:
+            break
+    for result in pending:
+        if error is None:
+            error = result.result()
+        else:
+            result.cancel()
+    if error is None and expected is not None and seq < expected[0]:
+        error = seq + 1  # ballots behind the checkpoint are missing
+
+    if error is not None:
+        return _failed(shard, start_seq, error)
+
+    if last is not None:
+        db.ballot_checkpoints.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"seq": seq, "hash": chain, "ballot": last, "verified_at": datetime.utcnow()}},
+            upsert=True
+        )
+    return {"shard": shard, "verified": seq - start_seq, "seq": seq, "ok": True, "error": None}
+
+
+def _batches(cursor, batch_size):
+    batch = []
+    for ballot in cursor:
+        batch.append(ballot)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _submit(executor, election_id, shard, batch):
+    if executor is not None:
+        return executor.submit(hash_batch, election_id, shard, batch)
+    future = Future()
+    future.set_result(hash_batch(election_id, shard, batch))
+    return future
+
+
+def verify_election(db, election_id, shards=DEFAULT_SHARDS, workers=None,
+                    batch_size=DEFAULT_BATCH_SIZE, full=False):
+    """Verifies every shard of an election's ballot log.
+
+    Shards are read concurrently and their hash batches are recomputed on a
+    pool of ``workers`` processes; ``workers=1`` hashes in the calling process.
+    Pending ballots are settled first.
+    """
+    settle_pending(db, election_id)
+
+    def verify(shard, executor):
+        return verify_shard(db, election_id, shard, executor, batch_size, full)
+
+    with ThreadPoolExecutor(max_workers=min(shards, 8)) as readers:
+        if workers == 1:
+            return list(readers.map(lambda shard: verify(shard, None), range(shards)))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(readers.map(lambda shard: verify(shard, executor), range(shards)))
@@ -0,0 +1,251 @@
+"""
+Seeded synthetic datasets for scale testing.
+
+``DatasetGenerator`` produces voters, candidates and elections (with their
+ballots) shaped like the documents the application writes itself. The same
+seed always gives the same dataset. Each stream has its own random generator,
+so asking for more voters does not change the candidates or elections.
+
+Voter ``i`` lives in constituency ``i % constituencies`` and has a CNIC derived
+from ``i`` by a bijection, so CNICs are unique without being remembered and
+ballots can pick voters without keeping the roll in memory.
+
+``populate`` bulk-loads a dataset with unordered ``insert_many`` batches into
+any pymongo-compatible database, either a real one or an in-memory stand-in
+such as mongomock. Election documents keep a marker per voter in their
+``votes`` map, so keep voters per constituency well under a few hundred
+thousand to stay inside MongoDB's document size limit.
+"""
+
+import random
+import time
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from ballot_log import DEFAULT_SHARDS, shard_for, ballot_hash, COUNTED
+from lifecycle import initial_status, CLOSED
+from results import compute_results
+from eligibility import add_years, eligibility_dates, VOTING_AGE, CANDIDATE_AGE
+
+# Share of voters per age band (inclusive), roughly a young national electorate
+AGE_BANDS = [((18, 25), 0.22), ((26, 35), 0.26), ((36, 45), 0.20),
+             ((46, 55), 0.15), ((56, 65), 0.10), ((66, 90), 0.07)]
+CANDIDATE_AGE_BANDS = [((25, 35), 0.15), ((36, 50), 0.40), ((51, 65), 0.35), ((66, 80), 0.10)]
+
+FIRST_NAMES = [
+    "Ahmed", "Ali", "Ayesha", "Bilal", "Fatima", "Hamza", "Hina", "Imran", "Kashif", "Khadija",
+    "Maryam", "Muhammad", "Nadia", "Omar", "Rabia", "Saad", "Sana", "Shahid", "Usman", "Zainab",
+]
+LAST_NAMES = [
+    "Abbasi", "Akhtar", "Baig", "Butt", "Chaudhry", "Farooq", "Hussain", "Iqbal", "Javed", "Khan",
+    "Malik", "Mirza", "Qureshi", "Rana", "Raza", "Shah", "Sheikh", "Siddiqui", "Tariq", "Yousaf",
+]
+PARTIES = ["PTI", "PML-N", "PPP", "JUI-F", "MQM-P", "JI", "ANP", "BAP", "GDA", "TLP", "Independent"]
+
+# CNICs are the first 12 digits of a permutation of [0, 7e11) plus a check digit;
+# the multiplier is coprime with the modulus, so distinct indexes never collide
+CNIC_SPACE = 7 * 10 ** 11
+CNIC_MULTIPLIER = 4294967311
+VOTER_CNIC_OFFSET = 0
+CANDIDATE_CNIC_OFFSET = 6 * 10 ** 11
+
+SCHEDULE_HOURS = (365 + 90) * 24
+
+
+def _weighted_ages(rng, bands, count):
+    ranges = rng.choices([band for band, _ in bands], [weight for _, weight in bands], k=count)
+    return [rng.randint(low, high) for low, high in ranges]
+
+
+def _object_id(rng, when):
+    return ObjectId(int(when.timestamp()).to_bytes(4, 'big') + rng.getrandbits(64).to_bytes(8, 'big'))
+
+
+def _truncate_ms(when):
+    return when.replace(microsecond=when.microsecond // 1000 * 1000)
+
+
+class DatasetGenerator:
+    """Deterministic generator of voters, candidates and elections."""
+
+    def __init__(self, seed=0, constituencies=100, now=None):
+        # A fixed default "now" keeps datasets reproducible across runs
+        self.seed = seed
+        self.constituencies = constituencies
+        self.now = now or datetime(2024, 12, 1, 12)
+
+    def _rng(self, stream):
+        return random.Random(f"{self.seed}:{stream}")
+
+    @staticmethod
+    def cnic(index, offset=VOTER_CNIC_OFFSET):
+        """The CNIC of the ``index``-th generated person, formatted XXXXX-XXXXXXX-X."""
+        digits = f"{(index + offset) * CNIC_MULTIPLIER % CNIC_SPACE + 10 ** 11:012d}"
+        return f"{digits[:5]}-{digits[5:]}-{(index * 7 + 3) % 10}"
+
+    def constituency(self, index):
+        return f"NA-{index + 1}"
+
+    def voter_constituency(self, voter_index):
+        return self.constituency(voter_index % self.constituencies)
+
+    def _dobs(self, rng, bands, count):
+        today = self.now.date()
+        return [(add_years(today, -age) - timedelta(days=rng.randint(0, 364))).isoformat()
+                for age in _weighted_ages(rng, bands, count)]
+
+    def voters(self, count):
+        """Yields voter documents as ``/register_voter`` stores them."""
+        rng = self._rng("voters")
+        for start in range(0, count, 10000):
+            block = min(10000, count - start)
+            dobs = self._dobs(rng, AGE_BANDS, block)
+            for offset, (dob, eligible) in enumerate(zip(dobs, eligibility_dates(dobs, VOTING_AGE))):
+                index = start + offset
+                yield {
+                    "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                    "cnic": self.cnic(index),
+                    "dob": dob,
+                    "constituency": self.voter_constituency(index),
+                    "eligible_from": eligible,
+                    "voted": False,
+                }
+
+    def parties(self, count):
+        return PARTIES[:count] + [f"Party {i}" for i in range(len(PARTIES), count)]
+
+    def candidates(self, count, parties=len(PARTIES)):
+        """Returns candidate documents as ``/add_candidate`` stores them."""
+        rng = self._rng("candidates")
+        party_names = self.parties(parties)
+        candidates = []
+        dobs = self._dobs(rng, CANDIDATE_AGE_BANDS, count)
+        for index, (dob, eligible) in enumerate(zip(dobs, eligibility_dates(dobs, CANDIDATE_AGE))):
+            candidates.append({
+                "_id": _object_id(rng, self.now),
+                "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                "party": rng.choice(party_names),
+                "cnic": self.cnic(index, CANDIDATE_CNIC_OFFSET),
+                "dob": dob,
+                "eligible_from": eligible,
+            })
+        return candidates
+
+    def elections(self, count, voters, candidates, shards=DEFAULT_SHARDS, turnout=(0.35, 0.65),
+                  candidates_per_election=(3, 12)):
+        """Yields ``(election, ballots)`` pairs.
+
+        Elections that have started come with ballots from a share of their
+        constituency's voters, a matching ``votes`` map and counted ballots.
+        """
+        rng = self._rng("elections")
+        # Each constituency's elections get consecutive, non-overlapping slots
+        # between a year ago and three months ahead
+        slots = -(-count // self.constituencies)
+        slot_hours = max(SCHEDULE_HOURS // slots, 24)
+        for index in range(count):
+            constituency_index = index % self.constituencies
+            slot = index // self.constituencies
+            start_date = self.now - timedelta(days=365) + timedelta(
+                hours=slot * slot_hours + rng.randint(0, max(slot_hours - 72, 0)))
+            end_date = start_date + timedelta(hours=rng.randint(8, min(72, slot_hours)))
+            status = initial_status(start_date, end_date, self.now)
+            roster = rng.sample(candidates, min(len(candidates), rng.randint(*candidates_per_election)))
+            election = {
+                "_id": _object_id(rng, min(start_date, self.now)),
+                "name": f"{self.constituency(constituency_index)} election {index + 1}",
+                "start_date": start_date,
+                "end_date": end_date,
+                "constituency": self.constituency(constituency_index),
+                "status": status,
+                "candidates": [{"_id": str(c["_id"]), "name": c["name"], "party": c["party"]} for c in roster],
+                "votes": {},
+            }
+            ballots = []
+            if roster and start_date <= self.now:
+                electorate = range(constituency_index, voters, self.constituencies)
+                sample = rng.sample(electorate, int(len(electorate) * rng.uniform(*turnout)))
+                ballots = self._ballots(rng, election, sample, shards)
+            if status == CLOSED:
+                election["final_results"] = compute_results(election)
+            yield election, ballots
+
+    def _ballots(self, rng, election, voter_indexes, shards):
+        votes = election["votes"]
+        roster = [candidate["_id"] for candidate in election["candidates"]]
+        # Some candidates draw far more support than others
+        weights = [rng.paretovariate(1.5) for _ in roster]
+        choices = rng.choices(roster, weights, k=len(voter_indexes))
+        window = (min(election["end_date"], self.now) - election["start_date"]).total_seconds()
+        chains = {}
+        for voter_index, candidate_id in zip(voter_indexes, choices):
+            cnic = self.cnic(voter_index)
+            votes[candidate_id] = votes.get(candidate_id, 0) + 1
+            cast_at = _truncate_ms(election["start_date"] + timedelta(seconds=rng.uniform(0, window)))
+            chains.setdefault(shard_for(cnic, shards), []).append((cast_at, candidate_id, cnic))
+
+        election_id = election["_id"]
+        ballots = []
+        for shard, entries in chains.items():
+            for seq, (cast_at, candidate_id, cnic) in enumerate(sorted(entries), start=1):
+                # Voters are marked with their ballot, as record_vote does
+                votes[cnic] = f"{election_id}:{shard}:{seq}"
+                ballots.append({
+                    "_id": f"{election_id}:{shard}:{seq}",
+                    "election_id": election_id,
+                    "shard": shard,
+                    "seq": seq,
+                    "candidate_id": candidate_id,
+                    "cast_at": cast_at,
+                    "status": COUNTED,
+                    "hash": ballot_hash(election_id, shard, seq, candidate_id, cast_at),
+                })
+        return ballots
+
+
+def load(collection, documents, batch_size=10000):
+    """Bulk-inserts documents in unordered batches. Returns the number inserted."""
+    inserted = 0
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == batch_size:
+            inserted += len(collection.insert_many(batch, ordered=False).inserted_ids)
+            batch = []
+    if batch:
+        inserted += len(collection.insert_many(batch, ordered=False).inserted_ids)
+    return inserted
+
+
+def populate(db, seed=0, voters=100000, candidates=1000, elections=100, constituencies=100,
+             parties=len(PARTIES), shards=DEFAULT_SHARDS, batch_size=10000, now=None):
+    """Generates a dataset and loads it into ``db``. Returns counts and load times."""
+    generator = DatasetGenerator(seed, constituencies, now)
+    report = {}
+
+    def timed(name, fn):
+        started = time.perf_counter()
+        report[name] = fn()
+        report[f"{name}_seconds"] = round(time.perf_counter() - started, 3)
+
+    timed("voters", lambda: load(db.voters, generator.voters(voters), batch_size))
+    roster = generator.candidates(candidates, parties)
+    timed("candidates", lambda: load(db.candidates, roster, batch_size))
+
+    def load_elections():
+        ballots_loaded = 0
+        loaded = 0
+        for election, ballots in generator.elections(elections, voters, roster, shards):
+            db.elections.insert_one(election)
+            ballots_loaded += load(db.ballots, ballots, batch_size)
+            # Later votes continue each shard after the loaded ballots
+            heads = {}
+            for ballot in ballots:
+                heads[ballot["shard"]] = max(heads.get(ballot["shard"], 0), ballot["seq"])
+            load(db.ballot_counters, ({"_id": f"{election['_id']}:{shard}", "seq": seq}
+                                      for shard, seq in heads.items()), batch_size)
+            loaded += 1
+        report["ballots"] = ballots_loaded
+        return loaded
+
+    timed("elections", load_elections)
+    return report
@@ -0,0 +1,140 @@
+"""
+Lazy MongoDB access for the election management system.
+
+The client is only created the first time a request (or CLI command) touches
+``mongo.db``, so importing the app or forking workers never pays for DNS/SRV
+resolution or connection setup.
+"""
+
+import threading
+from flask import current_app
+from flask_pymongo import PyMongo
+from pymongo import read_preferences
+
+EXTENSION_KEY = "ems_mongo"
+
+READ_PREFERENCES = {
+    "primary": read_preferences.Primary,
+    "primaryPreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondaryPreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+
+# Listings and results tolerate bounded staleness; vote validation must see the primary.
+DEFAULT_READ_ROUTING = {
+    "listings": "secondaryPreferred",
+    "results": "secondaryPreferred",
+    "vote_validation": "primary",
+}
+
+# MongoDB rejects max staleness below 90 seconds.
+DEFAULT_MAX_STALENESS = 90
+
+
+def build_read_preference(route_config, default_staleness=DEFAULT_MAX_STALENESS):
+    """Turns a route's config ("mode" or {"mode": ..., "max_staleness": ...}) into a read preference."""
+    if isinstance(route_config, str):
+        route_config = {"mode": route_config}
+    mode = route_config.get("mode", "primary")
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference: {mode}")
+    if mode == "primary":
+        return read_preferences.Primary()
+    max_staleness = route_config.get("max_staleness", default_staleness)
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+
+class LazyMongo:
+    """Per-app PyMongo holder that builds the client on first use."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._connect_hooks = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Registers the extension without opening a client."""
+        app.config.setdefault("MONGO_READ_ROUTING", {})
+        app.config.setdefault("MONGO_MAX_STALENESS_SECONDS", DEFAULT_MAX_STALENESS)
+        app.extensions[EXTENSION_KEY] = {"client": None, "db": None, "readers": {}}
+
+    def _state(self, app=None):
+        app = app or current_app._get_current_object()
+        return app, app.extensions[EXTENSION_KEY]
+
+    def _connect(self, app, state):
+        with self._lock:
+            if state["client"] is None:
+                client = PyMongo(app, **self.client_options(app))
+                database = client.db
+                if database is None:
+                    database = client.cx[app.config["MONGO_DBNAME"]]
+                state["db"] = database
+                for hook in self._connect_hooks:
+                    hook(app, database)
+                state["client"] = client
+        return state
+
+    def on_connect(self, f):
+        """Registers ``f(app, db)`` to run once when an app's client is created."""
+        self._connect_hooks.append(f)
+        return f
+
+    def client_options(self, app):
+        """Keyword arguments passed through to ``MongoClient``.
+
+        ``MONGO_COMPRESSORS`` (e.g. ``"zstd,snappy,zlib"``) enables wire
+        compression; the server picks the first one it also supports.
+        """
+        options = dict(app.config.get("MONGO_CLIENT_OPTIONS") or {})
+        if app.config.get("MONGO_COMPRESSORS"):
+            options.setdefault("compressors", app.config["MONGO_COMPRESSORS"])
+            if app.config.get("MONGO_ZLIB_COMPRESSION_LEVEL") is not None:
+                options.setdefault("zlibCompressionLevel", app.config["MONGO_ZLIB_COMPRESSION_LEVEL"])
+        return options
+
+    def is_connected(self, app=None):
+        """Returns True once the client for the app has been created."""
+        _, state = self._state(app)
+        return state["client"] is not None
+
+    @property
+    def cx(self):
+        """The underlying ``MongoClient``, created on first access."""
+        app, state = self._state()
+        if state["client"] is None:
+            self._connect(app, state)
+        return state["client"].cx
+
+    @property
+    def db(self):
+        """The configured database, created on first access."""
+        app, state = self._state()
+        if state["client"] is None:
+            self._connect(app, state)
+        return state["db"]
+
+    def read_preference(self, route, app=None):
+        """Resolves the read preference configured for a read route."""
+        app, _ = self._state(app)
+        routing = dict(DEFAULT_READ_ROUTING, **app.config["MONGO_READ_ROUTING"])
+        return build_read_preference(
+            routing.get(route, "primary"),
+            app.config["MONGO_MAX_STALENESS_SECONDS"],
+        )
+
+    def reader(self, route):
+        """The database handle for a read route, e.g. ``mongo.reader('listings')``.
+
+        Unknown routes read from the primary.
+        """
+        app, state = self._state()
+        readers = state["readers"]
+        if route not in readers:
+            readers[route] = self.db.with_options(read_preference=self.read_preference(route, app))
+        return readers[route]
+
+
+mongo = LazyMongo()
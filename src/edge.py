@@ -0,0 +1,536 @@
+"""
+Offline polling-station (edge) mode.
+
+With ``EMS_EDGE_MODE = True`` the app records votes in a local SQLite store
+(``EMS_EDGE_DB``) instead of the central database. The store holds the
+station's voter segment and elections, copied from the central database with
+``flask ems edge-provision`` while the station is connected. Voting keeps the
+same guarantees offline: a ``UNIQUE(election_id, voter_id)`` constraint lets
+each voter vote once per election at the station.
+
+Votes are pushed to the central ``/edge/sync`` endpoint in gzip-compressed
+batches, by a background thread (``EMS_EDGE_SYNC_INTERVAL``) or by
+``flask ems edge-sync``. Every vote carries a ballot ID generated at the
+station, and the central side records each ballot ID once, so re-sending a
+batch after a timeout never counts a vote twice. For each ballot, the
+central side answers one of:
+
+- applied: counted now;
+- duplicate: counted by an earlier sync;
+- conflict: not counted, with a reason. For example, the voter already voted
+  elsewhere or the election closed before the vote arrived.
+
+The station stores conflicts for review and does not resend them. Batches
+are validated before any vote is applied, and a compressed batch may inflate
+to at most ``EMS_EDGE_MAX_BATCH_BYTES`` (default 16 MiB).
+Stations authenticate with a per-station token (``EMS_EDGE_STATIONS`` on the
+central side, ``EMS_EDGE_TOKEN`` on the station).
+"""
+
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import sqlite3
+import threading
+import urllib.request
+import uuid
+import zlib
+from datetime import datetime
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from ballot_log import DEFAULT_SHARDS, COUNTED, PENDING as BALLOT_PENDING, append_ballot, record_vote, settle
+from lifecycle import FINAL
+from validation import (
+    Field, DateTime, ListOf, Schema, String, ValidationError, CNIC_PATTERN
+)
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_KEY = "ems_edge_store"
+SYNC_PATH = "/edge/sync"
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_BATCH_BYTES = 16 * 1024 * 1024
+MAX_BATCH_VOTES = 5000
+
+PENDING = 'pending'
+SYNCED = 'synced'
+CONFLICT = 'conflict'
+
+APPLIED = 'applied'
+DUPLICATE = 'duplicate'
+
+ALREADY_VOTED = "Voter has already cast a vote in this election."
+CLOSED_BEFORE_SYNC = "Election closed before the vote was synced."
+
+
+class Nested(Field):
+    """A JSON object matching ``schema``."""
+
+    def __init__(self, schema, **kwargs):
+        super().__init__(**kwargs)
+        self.schema = schema
+
+    def convert(self, value):
+        return self.schema.validate(value)
+
+
+VOTE = Schema(
+    ballot_id=String(max_length=64),
+    election_id=String(max_length=24),
+    voter_id=String(max_length=15, pattern=CNIC_PATTERN),
+    candidate_id=String(max_length=24),
+    cast_at=DateTime(),
+)
+BATCH = Schema(
+    station=String(max_length=100),
+    batch_id=String(max_length=64, required=False),
+    votes=ListOf(Nested(VOTE), max_items=MAX_BATCH_VOTES),
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS voters (
+    cnic TEXT PRIMARY KEY,
+    name TEXT,
+    dob TEXT NOT NULL,
+    constituency TEXT,
+    eligible_from TEXT
+);
+CREATE TABLE IF NOT EXISTS elections (
+    election_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    constituency TEXT,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    candidates TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS votes (
+    ballot_id TEXT PRIMARY KEY,
+    election_id TEXT NOT NULL,
+    voter_id TEXT NOT NULL,
+    candidate_id TEXT NOT NULL,
+    cast_at TEXT NOT NULL,
+    idempotency_key TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    reason TEXT,
+    UNIQUE (election_id, voter_id)
+);
+CREATE INDEX IF NOT EXISTS votes_status ON votes (status);
+"""
+
+
+def _datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class EdgeStore:
+    """SQLite store of a station's voters, elections and votes.
+
+    It also answers ``lookup`` like ``VoterRoll``, so login and vote validation
+    work offline.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # Provisioning
+
+    def provision(self, db, constituency, now=None):
+        """Copies a constituency's voters, and the unfinished elections it votes in, from the central database."""
+        now = now or datetime.now()
+        voters = [
+            (v["cnic"], v.get("name"), v["dob"], v.get("constituency"),
+             v["eligible_from"].isoformat() if v.get("eligible_from") else None)
+            for v in db.voters.find({"constituency": constituency},
+                                    {"_id": 0, "cnic": 1, "name": 1, "dob": 1, "constituency": 1, "eligible_from": 1})
+        ]
+        elections = [
+            (str(e["_id"]), e["name"], e.get("constituency"), e["start_date"].isoformat(),
+             e["end_date"].isoformat(), json.dumps(e.get("candidates", []), default=str))
+            for e in db.elections.find(
+                {"constituency": {"$in": [constituency, None]}, "end_date": {"$gte": now}, "status": {"$nin": FINAL}},
+                {"votes": 0, "final_results": 0})
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR REPLACE INTO voters VALUES (?, ?, ?, ?, ?)", voters)
+            self._conn.executemany("INSERT OR REPLACE INTO elections VALUES (?, ?, ?, ?, ?, ?)", elections)
+            self._conn.execute("COMMIT")
+        return {"voters": len(voters), "elections": len(elections)}
+
+    # Voter roll interface
+
+    def lookup(self, cnic):
+        if not isinstance(cnic, str):
+            return None
+        rows = self._execute("SELECT cnic, name, dob, constituency, eligible_from FROM voters WHERE cnic = ?", (cnic,))
+        if not rows:
+            return None
+        record = dict(rows[0])
+        record["eligible_from"] = _datetime(record["eligible_from"])
+        return record
+
+    def is_registered(self, cnic):
+        return self.lookup(cnic) is not None
+
+    def add(self, voter):
+        pass  # the segment only changes through provisioning
+
+    def discard(self, cnic):
+        pass
+
+    def invalidate(self, cnic):
+        pass
+
+    # Elections
+
+    def _election(self, row):
+        election = dict(row)
+        election["start_date"] = _datetime(election["start_date"])
+        election["end_date"] = _datetime(election["end_date"])
+        election["candidates"] = json.loads(election["candidates"])
+        return election
+
+    def election(self, election_id):
+        rows = self._execute("SELECT * FROM elections WHERE election_id = ?", (str(election_id),))
+        return self._election(rows[0]) if rows else None
+
+    def active_elections(self, constituency=None, now=None):
+        now = (now or datetime.now()).isoformat()
+        sql = "SELECT * FROM elections WHERE start_date <= ? AND end_date >= ?"
+        params = [now, now]
+        if constituency is not None:
+            sql += " AND (constituency = ? OR constituency IS NULL)"
+            params.append(constituency)
+        return [self._election(row) for row in self._execute(sql, params)]
+
+    def candidates(self):
+        """Every candidate on a provisioned election's roster."""
+        found = {}
+        for election in self.active_elections():
+            for candidate in election["candidates"]:
+                found.setdefault(candidate["_id"], candidate)
+        return list(found.values())
+
+    # Votes
+
+    def record_vote(self, election_id, voter_id, candidate_id, idempotency_key=None):
+        """Records a vote. Returns the vote's row, or None if the voter already voted here."""
+        row = (str(uuid.uuid4()), str(election_id), voter_id, str(candidate_id),
+               datetime.now().isoformat(), idempotency_key)
+        try:
+            self._execute("INSERT INTO votes (ballot_id, election_id, voter_id, candidate_id, cast_at, "
+                          "idempotency_key) VALUES (?, ?, ?, ?, ?, ?)", row)
+        except sqlite3.IntegrityError:
+            return None
+        return row
+
+    def existing_vote(self, election_id, voter_id):
+        rows = self._execute("SELECT * FROM votes WHERE election_id = ? AND voter_id = ?",
+                             (str(election_id), voter_id))
+        return dict(rows[0]) if rows else None
+
+    def pending(self, limit=DEFAULT_BATCH_SIZE):
+        rows = self._execute(
+            "SELECT ballot_id, election_id, voter_id, candidate_id, cast_at FROM votes "
+            "WHERE status = ? ORDER BY cast_at LIMIT ?", (PENDING, limit))
+        return [dict(row) for row in rows]
+
+    def mark(self, outcomes):
+        """Stores the central outcome for each ballot ID."""
+        updates = [
+            (CONFLICT if outcome["status"] == CONFLICT else SYNCED, outcome.get("reason"), outcome["ballot_id"])
+            for outcome in outcomes
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("UPDATE votes SET status = ?, reason = ? WHERE ballot_id = ?", updates)
+            self._conn.execute("COMMIT")
+
+    def counts(self):
+        return {row["status"]: row["total"] for row in
+                self._execute("SELECT status, COUNT(*) AS total FROM votes GROUP BY status")}
+
+
+def get_edge_store(app):
+    """The station's store, or None when the app is not in edge mode."""
+    return app.extensions.get(EXTENSION_KEY)
+
+
+def init_app(app):
+    """Opens the edge store and serves voter lookups from it."""
+    if not app.config.get("EMS_EDGE_MODE"):
+        return None
+    store = EdgeStore(app.config.get("EMS_EDGE_DB", "ems_edge.sqlite3"))
+    app.extensions[EXTENSION_KEY] = store
+    app.extensions["ems_voter_roll"] = store
+    if app.config.get("EMS_EDGE_SYNC_INTERVAL"):
+        app.extensions["ems_edge_syncer"] = EdgeSyncer(app).start()
+    return store
+
+
+# Station side: sending batches
+
+def batch_id(votes):
+    """A batch's ID is derived from its ballots, so a re-sent batch keeps its ID."""
+    return hashlib.sha256("|".join(sorted(vote["ballot_id"] for vote in votes)).encode()).hexdigest()
+
+
+def encode_batch(station, votes):
+    return gzip.compress(json.dumps({"station": station, "batch_id": batch_id(votes), "votes": votes}).encode())
+
+
+def http_transport(url, token, station, body, timeout=30):
+    """POSTs a compressed batch to the central server and returns the decoded reply."""
+    request = urllib.request.Request(url, data=body, method="POST", headers={
+        "Content-Type": "application/json",
+        "Content-Encoding": "gzip",
+        "Authorization": f"Bearer {token}",
+        "X-Edge-Station": station,
+    })
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+class EdgeSyncer:
+    """Pushes a station's pending votes to the central server."""
+
+    def __init__(self, app, transport=http_transport):
+        self.app = app
+        self.transport = transport
+        self.station = app.config.get("EMS_EDGE_STATION", "edge")
+        self.url = app.config.get("EMS_EDGE_CENTRAL_URL", "").rstrip("/") + SYNC_PATH
+        self.token = app.config.get("EMS_EDGE_TOKEN", "")
+        self.batch_size = app.config.get("EMS_EDGE_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+        self.interval = app.config.get("EMS_EDGE_SYNC_INTERVAL") or 30.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sync_once(self):
+        """Sends pending votes batch by batch. Returns counts per outcome."""
+        store = get_edge_store(self.app)
+        totals = {APPLIED: 0, DUPLICATE: 0, CONFLICT: 0}
+        while True:
+            votes = store.pending(self.batch_size)
+            if not votes:
+                return totals
+            reply = self.transport(self.url, self.token, self.station, encode_batch(self.station, votes))
+            outcomes = reply["data"]["outcomes"]
+            store.mark(outcomes)
+            for outcome in outcomes:
+                totals[outcome["status"]] += 1
+            if len(outcomes) < len(votes):
+                return totals  # the server did not answer for every ballot; retry later
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                totals = self.sync_once()
+                if any(totals.values()):
+                    logger.info("Edge sync: %s", totals)
+            except Exception:
+                logger.warning("Edge sync failed; will retry", exc_info=True)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="ems-edge-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# Central side: receiving batches
+
+def authenticate(stations, station, authorization):
+    """Checks a station's bearer token against ``EMS_EDGE_STATIONS``."""
+    token = stations.get(station) if station else None
+    if not token or not authorization or not authorization.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(authorization[len("Bearer "):], token)
+
+
+def decode_batch(body, encoding, max_bytes=DEFAULT_MAX_BATCH_BYTES):
+    """Decodes and validates a batch. Raises ValidationError for a malformed or oversized one.
+
+    Compressed bodies are inflated at most ``max_bytes`` far, so a small
+    body cannot expand into an unbounded one.
+    """
+    if encoding == "gzip":
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = inflater.decompress(body, max_bytes + 1)
+        except zlib.error:
+            raise ValidationError("Invalid batch encoding.") from None
+        if len(body) <= max_bytes and not inflater.eof:
+            raise ValidationError("Invalid batch encoding.")
+    if len(body) > max_bytes:
+        raise ValidationError("Batch is too large.")
+    try:
+        batch = json.loads(body)
+    except ValueError:
+        raise ValidationError("Invalid JSON payload.") from None
+    return BATCH.validate(batch)
+
+
+def _check(vote, election, voter, candidate_ids):
+    """Returns why a synced vote cannot be counted, or None."""
+    if election is None:
+        return "Election not found."
+    if voter is None:
+        return "Voter not registered."
+    if election.get("constituency") and election["constituency"] != voter.get("constituency"):
+        return "Election is not open to this voter's constituency."
+    if voter.get("eligible_from") and voter["eligible_from"] > election["start_date"]:
+        return "Voter was not eligible on election day."
+    if vote["candidate_id"] not in candidate_ids:
+        return "Candidate is not on the election's roster."
+    if not election["start_date"] <= vote["cast_at"] <= election["end_date"]:
+        return "Vote was cast outside the election window."
+    if election.get("status") in FINAL:
+        return CLOSED_BEFORE_SYNC
+    return None
+
+
+def _conflict(db, election_id):
+    """Why a vote that passed its checks was not counted."""
+    current = db.elections.find_one({"_id": election_id}, {"status": 1})
+    if current is not None and current.get("status") in FINAL:
+        return CLOSED_BEFORE_SYNC
+    return ALREADY_VOTED
+
+
+def _apply_group(db, election_id, votes, shards):
+    """Counts one election's votes. Returns a conflict reason (or None) per vote.
+
+    Each vote's ballot is written first, as pending, and the edge ballot
+    records it, so a sync that stops part-way can be resumed. The whole group
+    is then counted in one conditional update; if any voter in it has already
+    voted, or the election has closed, the ballots are settled one by one.
+    """
+    election = db.elections.find_one(
+        {"_id": election_id}, {f"votes.{vote['voter_id']}": 1 for vote in votes}) or {}
+    marked = election.get("votes") or {}
+    reasons = [ALREADY_VOTED if vote["voter_id"] in marked else None for vote in votes]
+    ballots = {}
+    for index, vote in enumerate(votes):
+        if reasons[index] is None:
+            try:
+                ballots[index] = append_ballot(db, election_id, vote["voter_id"], vote["candidate_id"],
+                                               shards, pending=True)
+            except DuplicateKeyError:
+                pass  # the voter has a pending ballot; settled below
+    if ballots:
+        db.edge_ballots.bulk_write([UpdateOne({"_id": votes[index]["ballot_id"]},
+                                              {"$set": {"ballot": ballot["_id"]}})
+                                    for index, ballot in ballots.items()], ordered=False)
+
+    group = [votes[index] for index in ballots]
+    tally = {}
+    for vote in group:
+        tally[vote["candidate_id"]] = tally.get(vote["candidate_id"], 0) + 1
+    query = {"_id": election_id, "status": {"$nin": FINAL}}
+    query.update({f"votes.{vote['voter_id']}": {"$exists": False} for vote in group})
+    if group and len(group) == reasons.count(None) and db.elections.update_one(query, {
+        "$inc": {f"votes.{candidate_id}": count for candidate_id, count in tally.items()},
+        "$set": {f"votes.{votes[index]['voter_id']}": ballot["_id"] for index, ballot in ballots.items()},
+    }).modified_count:
+        db.ballots.update_many({"_id": {"$in": [ballot["_id"] for ballot in ballots.values()]},
+                                "status": BALLOT_PENDING},
+                               {"$set": {"status": COUNTED}, "$unset": {"voter_id": ""}})
+        return reasons
+
+    for index, vote in enumerate(votes):
+        if reasons[index] is not None:
+            continue
+        if index in ballots:
+            counted = settle(db, ballots[index])
+        else:
+            counted = record_vote(db, election_id, vote["voter_id"], vote["candidate_id"], shards)
+        if not counted:
+            reasons[index] = _conflict(db, election_id)
+    return reasons
+
+
+def _resume(db, election_id, ballot_id):
+    """The outcome of a ballot an earlier sync wrote before stopping part-way."""
+    ballot = db.ballots.find_one({"_id": ballot_id})
+    if ballot is None:
+        return CONFLICT, ALREADY_VOTED
+    counted = settle(db, ballot) if ballot["status"] == BALLOT_PENDING else ballot["status"] == COUNTED
+    return (APPLIED, None) if counted else (CONFLICT, _conflict(db, election_id))
+
+
+def _election_id(value):
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def apply_batch(db, batch, voter_roll, shards=DEFAULT_SHARDS):
+    """Counts a station's batch. Returns one outcome per ballot, in order."""
+    station = batch["station"]
+    outcomes = {}
+    to_apply = {}
+    elections = {}
+    for vote in batch["votes"]:
+        ballot_id = vote["ballot_id"]
+        election_id = _election_id(vote["election_id"])
+        # Each ballot is recorded once; re-sent ballots get their first outcome
+        try:
+            db.edge_ballots.insert_one({
+                "_id": ballot_id, "station": station, "status": PENDING, "election_id": vote["election_id"],
+                "voter_id": vote["voter_id"], "cast_at": vote["cast_at"], "received_at": datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            previous = db.edge_ballots.find_one({"_id": ballot_id})
+            if previous["status"] != PENDING:
+                status = DUPLICATE if previous["status"] == APPLIED else previous["status"]
+                outcomes[ballot_id] = {"ballot_id": ballot_id, "status": status, "reason": previous.get("reason")}
+                continue
+            # An earlier sync stopped part-way; settle the ballot it wrote, or apply the vote afresh
+            if previous.get("ballot"):
+                status, reason = _resume(db, election_id, previous["ballot"])
+                outcomes[ballot_id] = {"ballot_id": ballot_id, "status": status, "reason": reason}
+                continue
+
+        if election_id not in elections:
+            elections[election_id] = election_id and db.elections.find_one(
+                {"_id": election_id}, {"votes": 0, "final_results": 0})
+        election = elections[election_id]
+        reason = _check(vote, election, voter_roll.lookup(vote["voter_id"]),
+                        {c["_id"] for c in (election or {}).get("candidates", [])})
+        if reason is None:
+            to_apply.setdefault(election_id, []).append(vote)
+        else:
+            outcomes[ballot_id] = {"ballot_id": ballot_id, "status": CONFLICT, "reason": reason}
+
+    for election_id, votes in to_apply.items():
+        for vote, reason in zip(votes, _apply_group(db, election_id, votes, shards)):
+            outcomes[vote["ballot_id"]] = {"ballot_id": vote["ballot_id"],
+                                           "status": APPLIED if reason is None else CONFLICT, "reason": reason}
+
+    ordered = [outcomes[vote["ballot_id"]] for vote in batch["votes"]]
+    for outcome in ordered:
+        db.edge_ballots.update_one({"_id": outcome["ballot_id"], "status": PENDING},
+                                   {"$set": {"status": outcome["status"], "reason": outcome["reason"]}})
+    return ordered
@@ -0,0 +1,183 @@
+"""
+Age and eligibility.
+
+Ages are counted in calendar years. A person born on 29 February turns a year
+older on 1 March in non-leap years. Instead of an ``age`` that is stale the
+next day, voters and candidates store ``eligible_from``: the day they reach
+the voting (18) or candidacy (25) age. "Eligible on election day" is then
+the indexed range query ``eligible_from <= start_date``.
+
+``eligibility_dates`` and ``ages_on`` work on whole lists of dates of birth,
+for bulk imports and analytics. They are vectorized with numpy when it is
+installed and fall back to a plain loop otherwise.
+"""
+
+from datetime import date, datetime
+from ballot_log import is_voter_marker
+
+try:
+    import numpy
+except ImportError:  # numpy is optional; the pure-Python path gives the same results
+    numpy = None
+
+VOTING_AGE = 18
+CANDIDATE_AGE = 25
+
+AGE_BANDS = [(18, 25), (26, 35), (36, 45), (46, 55), (56, 65), (66, None)]
+
+# CNICs sent per turnout query, keeping each command well under 16 MB
+VOTED_CHUNK_SIZE = 50000
+
+
+def parse_dob(dob):
+    """Parses a YYYY-MM-DD date of birth."""
+    return date.fromisoformat(dob) if isinstance(dob, str) else dob
+
+
+def add_years(day, years):
+    """The same calendar day ``years`` later; 29 February becomes 1 March in non-leap years."""
+    try:
+        return day.replace(year=day.year + years)
+    except ValueError:
+        return date(day.year + years, 3, 1)
+
+
+def age_on(dob, on):
+    """Completed years of age on the given day."""
+    dob, on = parse_dob(dob), _as_date(on)
+    return on.year - dob.year - ((on.month, on.day) < (dob.month, dob.day))
+
+
+def eligible_from(dob, age):
+    """The day a person born on ``dob`` reaches ``age``, as a datetime for MongoDB."""
+    day = add_years(parse_dob(dob), age)
+    return datetime(day.year, day.month, day.day)
+
+
+def is_eligible(dob, age, on=None):
+    """Whether a person is at least ``age`` on the given day (today by default)."""
+    return age_on(dob, on or date.today()) >= age
+
+
+def eligible_query(on, constituency=None):
+    """Filter for people eligible on the given day (uses the ``eligible_from`` indexes)."""
+    query = {"eligible_from": {"$lte": on}}
+    if constituency is not None:
+        query["constituency"] = constituency
+    return query
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _datetime64(dobs):
+    return numpy.array([dob if isinstance(dob, str) else dob.isoformat() for dob in dobs],
+                       dtype='datetime64[D]')
+
+
+def eligibility_dates(dobs, age):
+    """``eligible_from`` for a list of dates of birth."""
+    if numpy is None or not len(dobs):
+        return [eligible_from(dob, age) for dob in dobs]
+    days = _datetime64(dobs)
+    years = days.astype('datetime64[Y]')
+    months = days.astype('datetime64[M]')
+    # Same month and day, ``age`` years on; a 29 February overflows into 1 March
+    target = (years + age).astype('datetime64[M]') + (months - years.astype('datetime64[M]'))
+    target = target.astype('datetime64[D]') + (days - months.astype('datetime64[D]'))
+    return target.astype('datetime64[ms]').astype(datetime).tolist()
+
+
+def ages_on(dobs, on):
+    """Completed years of age on the given day, for a list of dates of birth."""
+    on = _as_date(on)
+    if numpy is None or not len(dobs):
+        return [age_on(dob, on) for dob in dobs]
+    days = _datetime64(dobs)
+    years = days.astype('datetime64[Y]')
+    months = days.astype('datetime64[M]')
+    month = (months - years.astype('datetime64[M]')).astype(int) + 1
+    day = (days - months.astype('datetime64[D]')).astype(int) + 1
+    not_yet = (month > on.month) | ((month == on.month) & (day > on.day))
+    return (on.year - 1970 - years.astype(int) - not_yet).tolist()
+
+
+def band_label(band):
+    low, high = band
+    return f"{low}+" if high is None else f"{low}-{high}"
+
+
+def band_counts(ages, bands=AGE_BANDS):
+    """Counts ages per band; ages outside every band are dropped."""
+    counts = [0] * len(bands)
+    for age in ages:
+        for index, (low, high) in enumerate(bands):
+            if age >= low and (high is None or age <= high):
+                counts[index] += 1
+                break
+    return counts
+
+
+def born_by(on, age):
+    """The latest date of birth of someone at least ``age`` years old on the given day."""
+    on = _as_date(on)
+    try:
+        return on.replace(year=on.year - age)
+    except ValueError:  # 29 February, in a year that is not a leap year
+        return date(on.year - age, 2, 28)
+
+
+def band_query(band, on):
+    """Filter for people whose age on the given day falls in ``band``.
+
+    The ``eligible_from`` range selects the band through the
+    ``(constituency, eligible_from)`` index; the ``dob`` bounds make it exact
+    for people born on 29 February, whose ``eligible_from`` is 1 March.
+    """
+    low, high = band
+    latest = born_by(on, low)
+    query = {"eligible_from": {"$lte": min(eligible_from(latest, VOTING_AGE), on)},
+             "dob": {"$lte": latest.isoformat()}}
+    if high is not None:
+        too_old = born_by(on, high + 1)
+        query["eligible_from"]["$gte"] = eligible_from(too_old, VOTING_AGE)
+        query["dob"]["$gt"] = too_old.isoformat()
+    return query
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def turnout_by_age_band(db, election, bands=AGE_BANDS, chunk_size=VOTED_CHUNK_SIZE):
+    """Turnout per age band (age on election day) among the constituency's eligible voters.
+
+    Voters are counted in the database: eligible voters with one indexed
+    count per band, and those who voted with one ``$facet`` aggregation per
+    ``chunk_size`` voters, looked up by CNIC.
+    """
+    on = election['start_date']
+    constituency = election.get('constituency')
+    base = eligible_query(on, constituency)
+    eligible_counts = [db.voters.count_documents(dict(base, **band_query(band, on))) for band in bands]
+
+    voted_counts = [0] * len(bands)
+    facets = {str(index): [{"$match": band_query(band, on)}, {"$count": "n"}] for index, band in enumerate(bands)}
+    voted = (key for key, value in (election.get('votes') or {}).items() if is_voter_marker(value))
+    for chunk in _chunks(voted, chunk_size):
+        for result in db.voters.aggregate([{"$match": dict(base, cnic={"$in": chunk})}, {"$facet": facets}]):
+            for index in range(len(bands)):
+                rows = result[str(index)]
+                voted_counts[index] += rows[0]["n"] if rows else 0
+    return [
+        {
+            "band": band_label(band),
+            "eligible": eligible_count,
+            "voted": voted_count,
+            "turnout": round(voted_count / eligible_count * 100, 2) if eligible_count else 0.0,
+        }
+        for band, eligible_count, voted_count in zip(bands, eligible_counts, voted_counts)
+    ]
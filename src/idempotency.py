@@ -0,0 +1,121 @@
+"""
+Idempotency-key support for state-changing endpoints.
+
+A client sends an ``Idempotency-Key`` header with a request it may retry. The
+first request claims the key and its outcome is stored; retries with the same
+key get the stored outcome back without re-running validation or writes.
+
+A claim is a lease of ``EMS_IDEMPOTENCY_LEASE_SECONDS`` (default 30). Retries
+during the lease get a 409; once it lapses, a request whose worker died before
+completing can be retried. Stored outcomes are kept for
+``EMS_IDEMPOTENCY_TTL_SECONDS`` (default 24 hours). Both expire through the
+TTL index on ``expires_at`` (see ``indexes.py``).
+"""
+
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import current_app, request, session, jsonify, make_response
+from pymongo.errors import DuplicateKeyError
+from db import mongo
+from json_provider import response_data
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+PENDING = 'pending'
+COMPLETE = 'complete'
+
+DEFAULT_LEASE = 30
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def _now():
+    # MongoDB stores milliseconds; truncate so a claim's timestamp matches what was stored
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def claim(collection, key_id, lease=DEFAULT_LEASE):
+    """Claims a key. Returns ``(claimed_at, None)`` if claimed, otherwise ``(None, existing record)``.
+
+    A pending claim older than ``lease`` seconds was left by a request that
+    never completed, and is taken over.
+    """
+    now = _now()
+    expires_at = now + timedelta(seconds=lease)
+    try:
+        collection.insert_one({"_id": key_id, "status": PENDING, "claimed_at": now, "expires_at": expires_at})
+        return now, None
+    except DuplicateKeyError:
+        taken = collection.find_one_and_update(
+            {"_id": key_id, "status": PENDING, "claimed_at": {"$lt": now - timedelta(seconds=lease)}},
+            {"$set": {"claimed_at": now, "expires_at": expires_at}}
+        )
+        if taken is not None:
+            return now, None
+        return None, collection.find_one({"_id": key_id}) or {"_id": key_id, "status": PENDING}
+
+
+def complete(collection, key_id, claimed_at, body, status_code, ttl=DEFAULT_TTL):
+    """Stores the outcome of the request that claimed the key, unless its lease was taken over."""
+    collection.update_one(
+        {"_id": key_id, "status": PENDING, "claimed_at": claimed_at},
+        {"$set": {"status": COMPLETE, "body": body, "status_code": status_code,
+                  "expires_at": _now() + timedelta(seconds=ttl)}}
+    )
+
+
+def release(collection, key_id, claimed_at):
+    """Releases a claimed key so the request can be retried."""
+    collection.delete_one({"_id": key_id, "status": PENDING, "claimed_at": claimed_at})
+
+
+def idempotent(scope):
+    """Decorator that replays the stored outcome for a repeated ``Idempotency-Key``.
+
+    Keys are scoped to the route and the logged-in user, so two users can never
+    see each other's outcomes. Requests without the header run as usual.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            # Polling stations run offline and keep the key with the vote itself
+            if not key or current_app.config.get("EMS_EDGE_MODE"):
+                return f(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({"success": False, "message": "Invalid idempotency key.", "data": None}), 400
+
+            collection = mongo.db.idempotency_keys
+            key_id = f"{scope}:{session['user']['id']}:{key}"
+            config = current_app.config
+            claimed_at, existing = claim(collection, key_id, config.get("EMS_IDEMPOTENCY_LEASE_SECONDS", DEFAULT_LEASE))
+            if existing is not None:
+                if existing["status"] != COMPLETE:
+                    response = jsonify({
+                        "success": False,
+                        "message": "A request with this idempotency key is still being processed.",
+                        "data": None
+                    })
+                    response.status_code = 409
+                    response.headers['Retry-After'] = '1'
+                    return response
+                response = jsonify(existing["body"])
+                response.status_code = existing["status_code"]
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+
+            try:
+                response = f(*args, **kwargs)
+            except Exception:
+                release(collection, key_id, claimed_at)
+                raise
+            response = make_response(response)
+            if response.status_code >= 500:
+                release(collection, key_id, claimed_at)
+            else:
+                complete(collection, key_id, claimed_at, response_data(response), response.status_code,
+                         config.get("EMS_IDEMPOTENCY_TTL_SECONDS", DEFAULT_TTL))
+            return response
+        return decorated_function
+    return decorator
+
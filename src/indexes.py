@@ -0,0 +1,55 @@
+"""
+Index definitions for the election management system.
+
+Indexes are created once per process, on a background thread started when
+the MongoDB client for an app is first created, so the first request never
+waits for the server. Run ``flask ems ensure-indexes`` to create them in the
+foreground, e.g. before a deployment, and set ``MONGO_ENSURE_INDEXES = False``
+to manage them only that way.
+"""
+
+import logging
+import threading
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_indexes_in_background(app, db):
+    """Starts ``ensure_indexes`` on a daemon thread, unless ``MONGO_ENSURE_INDEXES`` is off."""
+    if not app.config.get("MONGO_ENSURE_INDEXES", True):
+        return
+
+    def run():
+        try:
+            ensure_indexes(app, db)
+        except PyMongoError:
+            logger.warning("Could not create indexes; run `flask ems ensure-indexes`", exc_info=True)
+
+    threading.Thread(target=run, name="ems-ensure-indexes", daemon=True).start()
+
+
+def ensure_indexes(app, db):
+    """Creates the indexes the application relies on (idempotent)."""
+
+    # Voter lookups by CNIC (login, registration, vote validation); one voter per CNIC
+    db.voters.create_index("cnic", unique=True)
+    # Eligible-on-election-day queries: turnout and eligibility counts
+    db.voters.create_index([("constituency", 1), ("eligible_from", 1)])
+    # Per-constituency schedule queries: conflict checks and available elections
+    db.elections.create_index([("constituency", 1), ("start_date", 1), ("end_date", 1)])
+
+    # Lifecycle scheduler: elections due to open or close
+    db.elections.create_index([("status", 1), ("start_date", 1)])
+    db.elections.create_index([("status", 1), ("end_date", 1)])
+
+    # Ballot log: ordered scans on verification and recount
+    db.ballots.create_index([("election_id", 1), ("shard", 1), ("seq", 1)], unique=True)
+    # One pending ballot per voter; settled ballots drop the voter
+    db.ballots.create_index(
+        [("election_id", 1), ("voter_id", 1)], unique=True,
+        partialFilterExpression={"voter_id": {"$exists": True}},
+    )
+
+    # Expire lapsed claims and stored responses; each record carries its own expiry
+    db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
@@ -0,0 +1,297 @@
+"""
+Cache invalidation across app instances.
+
+Each app has an invalidation bus and a ``Cache`` subscribed to it. Writes
+publish fine-grained invalidations: ``(topic, key)`` pairs such as
+``("election", id)``, ``("results", id)`` or ``("candidate", id)``. Every
+cache on the bus drops the matching entries. Invalidating a key also drops the
+topic's ``ALL`` entry (e.g. the candidate list); invalidating ``ALL`` drops
+the whole topic.
+
+``EMS_INVALIDATION_BUS`` selects the bus:
+
+- ``"local"`` (default): in-process delivery only. Suits a single instance and tests.
+- ``"change_stream"``: also tails MongoDB change streams on elections,
+  candidates and voters (requires a replica set), so writes made by any
+  instance, the lifecycle scheduler or a shell invalidate every node. The
+  streams start with the app's MongoDB client, on first use. Updates that
+  only count votes invalidate the election's results, not the election.
+- any object with ``publish`` and ``subscribe``, for another pub/sub.
+
+Cached entries also expire after ``EMS_CACHE_TTL_SECONDS`` as a safety net.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app
+from pymongo.errors import PyMongoError
+from db import mongo
+
+logger = logging.getLogger(__name__)
+
+BUS_KEY = "ems_invalidation_bus"
+CACHE_KEY = "ems_cache"
+
+ELECTIONS = 'election'
+CANDIDATES = 'candidate'
+RESULTS = 'results'
+VOTERS = 'voter'
+ALL = '*'
+
+# Change streams tailed by ``ChangeStreamBus``: (collections, extra stages, full_document).
+# Election and candidate events only need their ``_id``. Voter events need the
+# CNIC, looked up after the update and cut down to that one field.
+WATCHED_STREAMS = [
+    (["elections", "candidates"], [], None),
+    (["voters"], [{"$project": {"operationType": 1, "ns": 1, "documentKey": 1, "fullDocument.cnic": 1}}],
+     "updateLookup"),
+]
+
+# Election details without the tally, as cached for vote validation and /get_election
+ELECTION_FIELDS = {"votes": 0, "final_results": 0}
+SCHEDULE_FIELDS = {"name": 1, "constituency": 1, "start_date": 1, "end_date": 1}
+
+
+class LocalBus:
+    """In-process pub/sub for invalidations."""
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """Registers ``callback(topic, key)``."""
+        self._subscribers.append(callback)
+        return callback
+
+    def publish(self, topic, key=ALL):
+        self._deliver(topic, key)
+
+    def _deliver(self, topic, key):
+        key = ALL if key is None else str(key)
+        for callback in self._subscribers:
+            try:
+                callback(topic, key)
+            except Exception:
+                logger.exception("Invalidation subscriber failed for %s %s", topic, key)
+
+
+def tally_only(change):
+    """Whether a change stream event is an update that only touched ``votes.*``, i.e. counted votes."""
+    description = change.get("updateDescription") or {}
+    fields = list(description.get("updatedFields") or {}) + list(description.get("removedFields") or [])
+    return (change.get("operationType") == "update" and bool(fields)
+            and all(field.startswith("votes.") for field in fields))
+
+
+def invalidations_for(change):
+    """The ``(topic, key)`` pairs a change stream event invalidates."""
+    collection = change.get("ns", {}).get("coll")
+    operation = change.get("operationType")
+    document_id = change.get("documentKey", {}).get("_id")
+    if operation in ("drop", "rename", "dropDatabase", "invalidate") or document_id is None:
+        keys = [ALL]
+    else:
+        keys = [document_id]
+
+    if collection == "elections":
+        if tally_only(change):
+            return [(RESULTS, document_id)]
+        return [(topic, key) for key in keys for topic in (ELECTIONS, RESULTS)]
+    if collection == "candidates":
+        return [(CANDIDATES, key) for key in keys]
+    if collection == "voters":
+        cnic = (change.get("fullDocument") or {}).get("cnic")
+        return [(VOTERS, cnic if cnic is not None else ALL)]
+    return []
+
+
+class ChangeStreamBus(LocalBus):
+    """A bus that also delivers invalidations for writes seen on a MongoDB change stream."""
+
+    def __init__(self, app, retry_interval=1.0):
+        super().__init__()
+        self.app = app
+        self.retry_interval = retry_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def run(self, db, collections, stages=(), full_document=None):
+        """Tails one change stream until stopped, resuming after errors."""
+        pipeline = [{"$match": {"ns.coll": {"$in": collections}}}] + list(stages)
+        resume_token = None
+        while not self._stop.is_set():
+            try:
+                with db.watch(pipeline, full_document=full_document,
+                              resume_after=resume_token, max_await_time_ms=1000) as stream:
+                    while not self._stop.is_set():
+                        change = stream.try_next()
+                        if change is None:
+                            continue
+                        resume_token = stream.resume_token
+                        for topic, key in invalidations_for(change):
+                            self._deliver(topic, key)
+            except PyMongoError:
+                logger.exception("Change stream on %s failed; invalidating all cached entries", collections)
+                # Changes may have been missed while the stream was down
+                for topic in (ELECTIONS, RESULTS, CANDIDATES, VOTERS):
+                    self._deliver(topic, ALL)
+                self._stop.wait(self.retry_interval)
+
+    def start(self, db):
+        """Starts one thread per stream in ``WATCHED_STREAMS``, reading from ``db``."""
+        if not self._threads:
+            for collections, stages, full_document in WATCHED_STREAMS:
+                thread = threading.Thread(target=self.run, args=(db, collections, stages, full_document),
+                                          name="ems-invalidation", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+class Cache:
+    """TTL + LRU cache of ``(topic, key)`` entries, emptied by invalidations.
+
+    Each topic has a generation that every invalidation bumps. ``get_or_load``
+    only stores what it loaded if the topic's generation did not change during
+    the load, so a value read before an invalidation arrived is not cached.
+    """
+
+    def __init__(self, max_size=10000, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, topic, key):
+        entry_key = (topic, str(key))
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry_key)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self, topic):
+        with self._lock:
+            return self._generations.get(topic, 0)
+
+    def set(self, topic, key, value, generation=None):
+        """Caches a value; with ``generation``, only if the topic was not invalidated since."""
+        with self._lock:
+            if generation is not None and self._generations.get(topic, 0) != generation:
+                return
+            self._entries[(topic, str(key))] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end((topic, str(key)))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, topic, key, loader):
+        """Returns the cached value, or loads and caches it. ``None`` results are not cached."""
+        value = self.get(topic, key)
+        if value is None:
+            generation = self.generation(topic)
+            value = loader()
+            if value is not None:
+                self.set(topic, key, value, generation)
+        return value
+
+    def invalidate(self, topic, key=ALL):
+        with self._lock:
+            self._generations[topic] = self._generations.get(topic, 0) + 1
+            if key == ALL:
+                for entry_key in [k for k in self._entries if k[0] == topic]:
+                    del self._entries[entry_key]
+            else:
+                self._entries.pop((topic, str(key)), None)
+                self._entries.pop((topic, ALL), None)
+
+    def metrics(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# Loaders for cached entries, shared by the routes and the warm-up
+
+def load_election(db, election_id):
+    return db.elections.find_one({"_id": election_id}, ELECTION_FIELDS)
+
+
+def load_candidate(db, candidate_id):
+    return db.candidates.find_one({"_id": candidate_id}, {"name": 1, "party": 1})
+
+
+def load_candidate_list(db):
+    return [{"candidate_id": candidate["_id"], "name": candidate["name"], "party": candidate["party"]}
+            for candidate in db.candidates.find({}, {"name": 1, "party": 1})]
+
+
+def load_open_elections(db, now=None, constituencies=None):
+    """Elections open at ``now``, optionally only those in ``constituencies`` (``None`` for national ones).
+
+    Filtered on the ``(constituency, start_date, end_date)`` index and not
+    cached: every vote writes its election, so a cached schedule would be
+    dropped on every vote anyway.
+    """
+    now = now or datetime.now()
+    query = {"start_date": {"$lte": now}, "end_date": {"$gte": now}}
+    if constituencies is not None:
+        query["constituency"] = {"$in": list(constituencies)}
+    return list(db.elections.find(query, SCHEDULE_FIELDS))
+
+
+def _build_bus(app):
+    bus = app.config.get("EMS_INVALIDATION_BUS", "local")
+    if bus == "local":
+        return LocalBus()
+    if bus == "change_stream":
+        return ChangeStreamBus(app)
+    return bus
+
+
+def start_bus(app, db):
+    """Starts the app's change streams, if it uses them. Registered to run when the MongoDB client is created."""
+    bus = app.extensions.get(BUS_KEY)
+    if isinstance(bus, ChangeStreamBus):
+        bus.start(db)
+
+
+def init_app(app):
+    """Creates the app's bus and cache and subscribes the cache and voter roll to it."""
+    bus = _build_bus(app)
+    cache = Cache(app.config.get("EMS_CACHE_SIZE", 10000), app.config.get("EMS_CACHE_TTL_SECONDS", 300.0))
+    bus.subscribe(cache.invalidate)
+
+    def voter_changed(topic, key):
+        roll = app.extensions.get("ems_voter_roll")
+        if topic == VOTERS and roll is not None:
+            roll.invalidate(key)
+
+    bus.subscribe(voter_changed)
+    app.extensions[BUS_KEY] = bus
+    app.extensions[CACHE_KEY] = cache
+    return bus
+
+
+def get_cache(app=None):
+    app = app or current_app
+    return app.extensions[CACHE_KEY]
+
+
+def publish(*invalidations, app=None):
+    """Publishes ``(topic, key)`` invalidations on the app's bus."""
+    bus = (app or current_app).extensions[BUS_KEY]
+    for topic, key in invalidations:
+        bus.publish(topic, key)
@@ -0,0 +1,111 @@
+"""
+JSON provider with native BSON type support.
+
+``ObjectId`` values are serialized as their hex string and ``datetime``/``date``
+values as ISO 8601, so handlers can return documents without converting fields
+by hand. When ``orjson`` is installed and ``EMS_FAST_JSON`` is enabled, it
+replaces the stdlib encoder; responses are always compact, even in debug mode.
+
+API clients that send ``Accept: application/msgpack`` get the same data as
+MessagePack when the optional ``msgpack`` package is installed (disable with
+``EMS_MSGPACK = False``).
+"""
+
+import dataclasses
+import decimal
+import uuid
+from datetime import date
+from bson.objectid import ObjectId
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional fast encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional compact encoding for API clients
+    msgpack = None
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+MSGPACK_MIMETYPE = "application/msgpack"
+MSGPACK_MIMETYPES = [MSGPACK_MIMETYPE, "application/x-msgpack"]
+
+
+def response_data(response):
+    """The data a JSON or MessagePack response carries."""
+    if msgpack is not None and response.mimetype in MSGPACK_MIMETYPES:
+        # Maps may be keyed by ints (e.g. candidate IDs), which the default strict_map_key rejects
+        return msgpack.unpackb(response.get_data(), strict_map_key=False)
+    return response.get_json()
+
+
+def bson_default(o):
+    """Serializes BSON and date types, plus the other types Flask's encoder handles."""
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, date):
+        return o.isoformat()
+    # Same as Flask's private ``flask.json.provider._default``, minus the date case
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def response_obj(args, kwargs):
+    """The value ``response(*args, **kwargs)`` serializes, as in ``jsonify``."""
+    if args and kwargs:
+        raise TypeError("app.json.response() takes either args or kwargs, not both")
+    if not args and not kwargs:
+        return None
+    if len(args) == 1:
+        return args[0]
+    return args or kwargs
+
+
+class EMSJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider used by ``format_response`` and ``jsonify``."""
+
+    default = staticmethod(bson_default)
+    sort_keys = False
+    compact = True
+
+    @property
+    def fast(self):
+        """True when orjson is available and enabled for this app."""
+        return orjson is not None and self._app.config.get("EMS_FAST_JSON", True)
+
+    def dumps(self, obj, **kwargs):
+        if self.fast:
+            return orjson.dumps(obj, default=bson_default, option=ORJSON_OPTIONS).decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.fast and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def wants_msgpack(self):
+        """True when the client prefers MessagePack over JSON and it is available."""
+        if msgpack is None or not self._app.config.get("EMS_MSGPACK", True) or not has_request_context():
+            return False
+        best = request.accept_mimetypes.best_match([self.mimetype] + MSGPACK_MIMETYPES)
+        return best in MSGPACK_MIMETYPES
+
+    def response(self, *args, **kwargs):
+        if self.wants_msgpack():
+            obj = response_obj(args, kwargs)
+            response = self._app.response_class(msgpack.packb(obj, default=bson_default), mimetype=MSGPACK_MIMETYPE)
+            response.vary.add("Accept")
+            return response
+        if not self.fast:
+            return super().response(*args, **kwargs)
+        obj = response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=bson_default, option=ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
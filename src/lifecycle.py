@@ -0,0 +1,170 @@
+"""
+Election lifecycle: scheduled -> open -> closed -> certified.
+
+``advance`` moves every election whose boundary has passed to its next state.
+When an election closes, its tally is computed once and stored as
+``final_results``, so ``/get_results`` serves a frozen result from then on.
+Transitions are conditional updates, so running several schedulers (or
+calling ``advance`` from a request) never applies one twice.
+
+``LifecycleScheduler`` runs ``advance`` in a background thread, waking at the
+next start/end boundary (or every ``EMS_SCHEDULER_INTERVAL`` seconds).
+Certification is an explicit admin action (``certify``). When warm-up is
+configured, the scheduler also warms elections ahead of their start (see
+``warmup.py``).
+"""
+
+import logging
+import threading
+from datetime import datetime
+from db import mongo
+from results import compute_results
+from invalidation import publish, ELECTIONS, RESULTS, ALL
+
+SCHEDULED = 'scheduled'
+OPEN = 'open'
+CLOSED = 'closed'
+CERTIFIED = 'certified'
+
+# Elections created before lifecycle tracking have no status yet
+NOT_STARTED = [None, SCHEDULED]
+NOT_CLOSED = [None, SCHEDULED, OPEN]
+FINAL = [CLOSED, CERTIFIED]
+
+logger = logging.getLogger(__name__)
+
+
+def initial_status(start_date, end_date, now=None):
+    """The status a newly scheduled election starts in."""
+    now = now or datetime.now()
+    if now > end_date:
+        return CLOSED
+    if now >= start_date:
+        return OPEN
+    return SCHEDULED
+
+
+def close_election(db, election_id, now=None):
+    """Closes an election and freezes its tally. Returns the frozen results, or None if already frozen."""
+    db.elections.update_one(
+        {"_id": election_id, "status": {"$in": NOT_CLOSED}},
+        {"$set": {"status": CLOSED, "closed_at": now or datetime.now()}}
+    )
+    # Votes are only accepted while the status is not final, so the tally read
+    # here can no longer change
+    election = db.elections.find_one({"_id": election_id, "final_results": {"$exists": False}})
+    if election is None:
+        return None
+    final_results = compute_results(election)
+    db.elections.update_one(
+        {"_id": election_id, "final_results": {"$exists": False}},
+        {"$set": {"final_results": final_results}}
+    )
+    return final_results
+
+
+def advance(db, now=None, election_ids=None):
+    """Applies every due transition. Returns the number of elections opened and closed.
+
+    ``election_ids`` limits the transitions to those elections.
+    """
+    now = now or datetime.now()
+    scope = {} if election_ids is None else {"_id": {"$in": list(election_ids)}}
+    opened = db.elections.update_many(
+        dict(scope, status={"$in": NOT_STARTED}, start_date={"$lte": now}, end_date={"$gte": now}),
+        {"$set": {"status": OPEN}}
+    ).modified_count
+
+    due = db.elections.find(
+        dict(scope, **{"$or": [
+            {"status": {"$in": NOT_CLOSED}, "end_date": {"$lt": now}},
+            {"status": CLOSED, "final_results": {"$exists": False}}
+        ]}),
+        {"_id": 1}
+    )
+    closed = 0
+    for election in due:
+        if close_election(db, election["_id"], now) is not None:
+            closed += 1
+    return opened, closed
+
+
+def certify(db, election_id, now=None):
+    """Certifies a closed election. Returns False if it is not closed with frozen results."""
+    result = db.elections.update_one(
+        {"_id": election_id, "status": CLOSED, "final_results": {"$exists": True}},
+        {"$set": {"status": CERTIFIED, "certified_at": now or datetime.now()}}
+    )
+    return result.modified_count == 1
+
+
+def next_boundary(db, now=None):
+    """The next start or end date at which a transition becomes due, or None."""
+    now = now or datetime.now()
+    upcoming = []
+    starting = db.elections.find_one(
+        {"status": {"$in": NOT_STARTED}, "start_date": {"$gt": now}},
+        {"start_date": 1}, sort=[("start_date", 1)]
+    )
+    if starting:
+        upcoming.append(starting["start_date"])
+    ending = db.elections.find_one(
+        {"status": {"$in": NOT_CLOSED}, "end_date": {"$gte": now}},
+        {"end_date": 1}, sort=[("end_date", 1)]
+    )
+    if ending:
+        upcoming.append(ending["end_date"])
+    return min(upcoming) if upcoming else None
+
+
+class LifecycleScheduler:
+    """Background thread that advances election lifecycles at their boundaries."""
+
+    def __init__(self, app, interval=60.0):
+        self.app = app
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def tick(self, now=None):
+        """Runs one round of transitions and returns the seconds until the next one is due."""
+        now = now or datetime.now()
+        with self.app.app_context():
+            db = mongo.db
+            opened, closed = advance(db, now)
+            if opened or closed:
+                logger.info("Lifecycle: opened %d, closed %d elections", opened, closed)
+                publish((ELECTIONS, ALL), (RESULTS, ALL), app=self.app)
+            boundary = next_boundary(db, now)
+            # Elections about to open are warmed up ahead of their boundary
+            warmup = self.app.extensions.get("ems_warmup")
+            next_warmup = warmup.tick(db, now) if warmup is not None else None
+        delays = [self.interval]
+        if boundary is not None:
+            delays.append(max((boundary - now).total_seconds(), 0.0))
+        if next_warmup is not None:
+            delays.append(max(next_warmup, 0.0))
+        return min(delays)
+
+    def run(self):
+        """Runs the scheduler loop in the calling thread until stopped."""
+        while not self._stop.is_set():
+            try:
+                delay = self.tick()
+            except Exception:
+                logger.exception("Lifecycle scheduler tick failed")
+                delay = self.interval
+            # Wake just after the boundary so the transition is due
+            self._stop.wait(delay + 0.5)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="ems-lifecycle", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,227 @@
+"""
+Per-request query profiling for development and staging.
+
+With ``EMS_QUERY_PROFILING = True`` a pymongo command listener is attached to
+the app's client. It sees every command, whether it went through ``mongo.db``,
+a read route or a session. Commands issued while a request is handled are
+recorded against that request and reduced to a *shape*: the command, the
+collection and the filter with its values blanked out. After the request:
+
+- shapes run ``EMS_QUERY_REPEAT_THRESHOLD`` or more times are reported as
+  repeated (N+1) queries;
+- the first time a shape is seen, its plan is fetched with ``explain`` and
+  collection scans are reported (``EMS_QUERY_EXPLAIN = False`` to skip);
+- a summary goes to the ``X-Query-Report`` header and the log;
+- routes over their budget in ``EMS_QUERY_BUDGETS`` (endpoint -> max queries)
+  are logged, and with ``EMS_QUERY_BUDGET_STRICT = True`` (CI) the request
+  fails with ``QueryBudgetExceeded``.
+"""
+
+import logging
+import threading
+from collections import Counter
+from flask import g, has_request_context, request
+from pymongo import monitoring
+from db import mongo
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_KEY = "ems_query_profiler"
+REPORT_HEADER = "X-Query-Report"
+
+# Commands that read or write documents; handshakes, getMore and explain are not counted
+PROFILED_COMMANDS = {
+    "find", "aggregate", "count", "distinct", "insert", "update", "delete", "findAndModify"
+}
+EXPLAINABLE_COMMANDS = PROFILED_COMMANDS - {"insert"}
+# Driver-added fields that explain rejects or that are not part of the query
+SESSION_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction"}
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in strict mode when a request runs more queries than its route allows."""
+
+
+def _blank(value):
+    """Replaces literal values with ``?`` while keeping field names and operators."""
+    if isinstance(value, dict):
+        return {key: _blank(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_blank(item) for item in value[:1]]
+    return "?"
+
+
+def query_shape(command_name, command):
+    """A stable description of a query that ignores its literal values."""
+    collection = command.get(command_name)
+    if command_name == "update":
+        criteria = (command.get("updates") or [{}])[0].get("q", {})
+    elif command_name == "delete":
+        criteria = (command.get("deletes") or [{}])[0].get("q", {})
+    elif command_name == "aggregate":
+        first = (command.get("pipeline") or [{}])[0]
+        criteria = first.get("$match", {})
+    elif command_name in ("find", "count", "distinct"):
+        criteria = command.get("filter", command.get("query", {}))
+    elif command_name == "findAndModify":
+        criteria = command.get("query", {})
+    else:
+        criteria = {}
+    return f"{command_name} {collection} {_blank(criteria)}"
+
+
+def _has_collscan(plan):
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_has_collscan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(_has_collscan(item) for item in plan)
+    return False
+
+
+class QueryProfile:
+    """The queries one request issued."""
+
+    def __init__(self):
+        self.queries = []
+        self._pending = {}
+
+    def started(self, event):
+        command = {key: value for key, value in event.command.items()
+                   if not key.startswith("$") and key not in SESSION_FIELDS}
+        self._pending[event.request_id] = len(self.queries)
+        self.queries.append({
+            "shape": query_shape(event.command_name, command),
+            "command_name": event.command_name,
+            "command": command,
+            "ms": None,
+        })
+
+    def finished(self, event):
+        index = self._pending.pop(event.request_id, None)
+        if index is not None:
+            self.queries[index]["ms"] = event.duration_micros / 1000
+
+    def repeated(self, threshold):
+        """Shapes run at least ``threshold`` times, most frequent first."""
+        counts = Counter(query["shape"] for query in self.queries)
+        return [(shape, count) for shape, count in counts.most_common() if count >= threshold]
+
+    def total_ms(self):
+        return sum(query["ms"] or 0 for query in self.queries)
+
+
+class ProfilingListener(monitoring.CommandListener):
+    """Records commands issued during a request onto that request's profile."""
+
+    def _profile(self, event):
+        if event.command_name not in PROFILED_COMMANDS or not has_request_context():
+            return None
+        return g.get("query_profile")
+
+    def started(self, event):
+        profile = self._profile(event)
+        if profile is not None:
+            profile.started(event)
+
+    def succeeded(self, event):
+        profile = self._profile(event)
+        if profile is not None:
+            profile.finished(event)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+class QueryProfiler:
+    """Attaches the profiling listener and reports on each request."""
+
+    def __init__(self, app=None):
+        self.listener = ProfilingListener()
+        self._plans = {}
+        self._lock = threading.Lock()
+        self.violations = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions[EXTENSION_KEY] = self
+        if not app.config.get("EMS_QUERY_PROFILING", False):
+            return
+        self.explain = app.config.get("EMS_QUERY_EXPLAIN", True)
+        self.repeat_threshold = app.config.get("EMS_QUERY_REPEAT_THRESHOLD", 3)
+        self.budgets = app.config.get("EMS_QUERY_BUDGETS") or {}
+        self.strict = app.config.get("EMS_QUERY_BUDGET_STRICT", False)
+        options = dict(app.config.get("MONGO_CLIENT_OPTIONS") or {})
+        options["event_listeners"] = list(options.get("event_listeners", [])) + [self.listener]
+        app.config["MONGO_CLIENT_OPTIONS"] = options
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _start(self):
+        g.query_profile = QueryProfile()
+
+    def collscan(self, db, query):
+        """Whether a query's winning plan scans a whole collection; explained once per shape."""
+        shape = query["shape"]
+        if shape not in self._plans:
+            try:
+                plan = db.command("explain", query["command"], verbosity="queryPlanner")
+                scans = _has_collscan(plan.get("queryPlanner", plan))
+            except Exception:
+                logger.debug("Could not explain %s", shape, exc_info=True)
+                scans = False
+            with self._lock:
+                self._plans[shape] = scans
+        return self._plans[shape]
+
+    def report(self, profile, endpoint, db=None):
+        """Summarizes a request's queries."""
+        collscans = []
+        if db is not None:
+            seen = set()
+            for query in profile.queries:
+                if query["command_name"] in EXPLAINABLE_COMMANDS and query["shape"] not in seen:
+                    seen.add(query["shape"])
+                    if self.collscan(db, query):
+                        collscans.append(query["shape"])
+        budget = self.budgets.get(endpoint)
+        return {
+            "endpoint": endpoint,
+            "queries": len(profile.queries),
+            "ms": round(profile.total_ms(), 2),
+            "repeated": profile.repeated(self.repeat_threshold),
+            "collscans": collscans,
+            "budget": budget,
+            "over_budget": budget is not None and len(profile.queries) > budget,
+        }
+
+    @staticmethod
+    def format(report):
+        parts = [f"queries={report['queries']}", f"ms={report['ms']}"]
+        if report["budget"] is not None:
+            parts.append(f"budget={report['budget']}")
+        parts += [f"repeated={shape} x{count}" for shape, count in report["repeated"]]
+        parts += [f"collscan={shape}" for shape in report["collscans"]]
+        return "; ".join(parts)
+
+    def _finish(self, response):
+        profile = g.pop("query_profile", None)
+        if profile is None:
+            return response
+        db = mongo.db if self.explain and profile.queries else None
+        report = self.report(profile, request.endpoint, db)
+        summary = self.format(report)
+        response.headers[REPORT_HEADER] = summary
+        if report["over_budget"] or report["repeated"] or report["collscans"]:
+            logger.warning("%s %s: %s", request.method, request.path, summary)
+        else:
+            logger.info("%s %s: %s", request.method, request.path, summary)
+        if report["over_budget"]:
+            self.violations.append(report)
+            if self.strict:
+                raise QueryBudgetExceeded(
+                    f"{report['endpoint']} ran {report['queries']} queries (budget {report['budget']})"
+                )
+        return response
@@ -0,0 +1,131 @@
+"""
+Recounts from the ballot log.
+
+The tally in ``election["votes"]`` is updated in place, so it cannot check
+itself. A recount rebuilds per-candidate counts from the stored ballots and
+compares them with that tally.
+
+Only counted ballots are recounted. Pending ballots left behind by a failed
+vote are settled first, so the recount and the tally agree on them.
+
+Ballots are split into partitions: contiguous ``seq`` ranges within a shard,
+each read through the ``(election_id, shard, seq)`` index. Every partition is
+counted on its own into a partial sum, and the partial sums are merged at the
+end. Workers share nothing, so a recount scales with the number of processes.
+Each worker process opens its own MongoDB client rather than inheriting the
+parent's.
+"""
+
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pymongo import MongoClient
+from ballot_log import DEFAULT_SHARDS, COUNTED, settle_pending, is_voter_marker
+
+DEFAULT_PARTITION_SIZE = 250000
+
+_worker_clients = {}
+
+
+def tally(candidate_ids):
+    """Counts an iterable of candidate IDs into a partial sum."""
+    return Counter(candidate_ids)
+
+
+def plan_partitions(db, election_id, shards=DEFAULT_SHARDS, partition_size=DEFAULT_PARTITION_SIZE):
+    """Splits each shard's chain into (shard, first_seq, last_seq) ranges."""
+    partitions = []
+    for shard in range(shards):
+        head = db.ballots.find_one(
+            {"election_id": election_id, "shard": shard}, {"_id": 0, "seq": 1}, sort=[("seq", -1)]
+        )
+        if head is None:
+            continue
+        for first in range(1, head["seq"] + 1, partition_size):
+            partitions.append((shard, first, min(first + partition_size - 1, head["seq"])))
+    return partitions
+
+
+def count_partition(db, election_id, shard, first, last):
+    """The partial sum of one partition."""
+    cursor = db.ballots.find(
+        {"election_id": election_id, "shard": shard, "seq": {"$gte": first, "$lte": last}, "status": COUNTED},
+        {"_id": 0, "candidate_id": 1}
+    ).batch_size(10000)
+    return tally(ballot["candidate_id"] for ballot in cursor)
+
+
+def _count_remote(uri, dbname, election_id, partition):
+    # Runs in a worker process; one client per process, reused across partitions
+    client = _worker_clients.get(uri)
+    if client is None:
+        client = _worker_clients[uri] = MongoClient(uri)
+    return count_partition(client[dbname], election_id, *partition)
+
+
+def parallel_tally(function, tasks, workers=None, mp_context=None):
+    """Runs ``function(*task)`` for every task on a process pool and merges the partial sums."""
+    total = Counter()
+    if workers == 1:
+        for task in tasks:
+            total.update(function(*task))
+        return total
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+        for partial in executor.map(function, *zip(*tasks)) if tasks else ():
+            total.update(partial)
+    return total
+
+
+def stored_tally(election):
+    """The per-candidate counts in an election's ``votes`` map (voter markers are skipped)."""
+    return {
+        key: count for key, count in (election.get('votes') or {}).items()
+        if isinstance(count, int) and not isinstance(count, bool)
+    }
+
+
+def compare(election, counts):
+    """Compares recounted totals with the stored tally. Returns the discrepancies."""
+    stored = stored_tally(election)
+    names = {str(candidate['_id']): candidate.get('name') for candidate in election.get('candidates', [])}
+    discrepancies = []
+    for candidate_id in sorted(set(stored) | set(counts) | set(names)):
+        if stored.get(candidate_id, 0) != counts.get(candidate_id, 0):
+            discrepancies.append({
+                "candidate_id": candidate_id,
+                "name": names.get(candidate_id),
+                "stored": stored.get(candidate_id, 0),
+                "recounted": counts.get(candidate_id, 0),
+            })
+    return discrepancies
+
+
+def recount(db, election, shards=DEFAULT_SHARDS, workers=None, partition_size=DEFAULT_PARTITION_SIZE, source=None):
+    """Rebuilds an election's tally from its ballots and compares it with the stored one.
+
+    ``source`` is ``(uri, dbname)``. Workers use it to open their own connections.
+    Without it, or with ``workers=1``, partitions are counted in this process
+    through ``db``.
+    """
+    election_id = election["_id"]
+    if settle_pending(db, election_id):
+        election = db.elections.find_one({"_id": election_id})
+    partitions = plan_partitions(db, election_id, shards, partition_size)
+    if source is None or workers == 1:
+        counts = parallel_tally(lambda *partition: count_partition(db, election_id, *partition),
+                                partitions, workers=1)
+    else:
+        uri, dbname = source
+        tasks = [(uri, dbname, election_id, partition) for partition in partitions]
+        counts = parallel_tally(_count_remote, tasks, workers, multiprocessing.get_context("spawn"))
+
+    voters_marked = sum(1 for value in (election.get('votes') or {}).values() if is_voter_marker(value))
+    discrepancies = compare(election, counts)
+    return {
+        "ballots": sum(counts.values()),
+        "voters_marked": voters_marked,
+        "partitions": len(partitions),
+        "counts": dict(counts),
+        "discrepancies": discrepancies,
+        "ok": not discrepancies and voters_marked == sum(counts.values()),
+    }
@@ -9,6 +9,8 @@ from functools import wraps
 from flask import Flask, request, jsonify, render_template, session, redirect, url_for
 from flask_pymongo import PyMongo
 from bson.objectid import ObjectId
+from voter_roll import VoterRoll
+from eligibility import is_eligible, eligible_from, VOTING_AGE, CANDIDATE_AGE
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'fallback_secret_key')
@@ -19,6 +21,7 @@ app.config["MONGO_URI"] = (
 )
 app.config["MONGO_DBNAME"] = "evote"
 mongo = PyMongo(app)
+voter_roll = VoterRoll(lambda: mongo.db.voters)
 
 def format_response(success, message, data=None):
     """Formats the JSON response returned by API endpoints."""
@@ -50,8 +53,8 @@ def login():
     cnic = data.get('cnic')
     dob = data.get('dob')
 
-    user = mongo.db.voters.find_one({"cnic": cnic, "dob": dob})
-    if user:
+    user = voter_roll.lookup(cnic)
+    if user and user['dob'] == dob:
         session['user'] = {"id": user['cnic'], "role": "voter"}
         return format_response(True, "Login successful", {"role": "voter"})
 
@@ -72,15 +75,14 @@ def register_voter():
     cnic = data.get('cnic')
     dob = data.get('dob')
 
-    dob_date = datetime.strptime(dob, "%Y-%m-%d")
-    age = (datetime.now() - dob_date).days // 365
-
-    if mongo.db.voters.find_one({"cnic": cnic}):
+    if voter_roll.is_registered(cnic):
         return format_response(False, "Voter already registered.")
-    if age < 18:
+    if not is_eligible(dob, VOTING_AGE):
         return format_response(False, "Voter must be at least 18 years old.")
 
-    mongo.db.voters.insert_one({"name": name, "cnic": cnic, "dob": dob, "age": age, "voted": False})
+    voter = {"name": name, "cnic": cnic, "dob": dob, "eligible_from": eligible_from(dob, VOTING_AGE), "voted": False}
+    mongo.db.voters.insert_one(voter)
+    voter_roll.add(voter)
     return format_response(True, "Voter registered successfully.")
 
 # Candidate Management
@@ -95,12 +97,11 @@ def add_candidate():
     dob = data.get('dob')
 
     try:
-        dob_date = datetime.strptime(dob, "%Y-%m-%d")
-        age = (datetime.now() - dob_date).days // 365
-    except ValueError:
+        eligible = is_eligible(dob, CANDIDATE_AGE)
+    except (TypeError, ValueError):
         return format_response(False, "Invalid date format. Use YYYY-MM-DD.")
 
-    if age < 25:
+    if not eligible:
         return format_response(False, "Candidate must be at least 25 years old.")
 
     if mongo.db.candidates.find_one({"cnic": cnic, "dob": dob}):
@@ -111,7 +112,7 @@ def add_candidate():
         "party": party,
         "cnic": cnic,
         "dob": dob,
-        "age": age
+        "eligible_from": eligible_from(dob, CANDIDATE_AGE)
     })
     return format_response(True, "Candidate added successfully.")
 
@@ -281,7 +282,7 @@ def cast_vote():
 # Helper Functions
 def is_voter_registered(voter_id):
     """Checks if the voter is registered."""
-    return mongo.db.voters.find_one({"cnic": voter_id}) is not None
+    return voter_roll.is_registered(voter_id)
 
 
 def has_already_voted(election_id, voter_id):
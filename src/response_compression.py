@@ -0,0 +1,92 @@
+"""
+HTTP response compression.
+
+Responses at least ``EMS_COMPRESSION_MIN_BYTES`` long (default 1024) are
+compressed with the best encoding the client accepts: brotli when the optional
+``brotli`` package is installed, otherwise gzip. Smaller bodies are sent as-is,
+because compressing them costs more than it saves. Only text, JSON and
+MessagePack bodies are compressed; streamed files and responses that already
+have a ``Content-Encoding`` are left alone. Set ``EMS_COMPRESSION = False`` to
+turn it off, e.g. when a reverse proxy compresses instead.
+"""
+
+import gzip
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+EXTENSION_KEY = "ems_compression"
+DEFAULT_MIN_BYTES = 1024
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = {"application/json", "application/msgpack", "application/x-msgpack", "application/javascript"}
+
+
+def _compressible(mimetype):
+    return mimetype is not None and (mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES)
+
+
+def choose_encoding(accept_encoding, available):
+    """The client's preferred encoding among ``available`` (in server preference order), or None."""
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            weights[name.lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class ResponseCompressor:
+    """Compresses eligible responses after each request."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions[EXTENSION_KEY] = self
+        if not app.config.get("EMS_COMPRESSION", True):
+            return
+        self.min_bytes = app.config.get("EMS_COMPRESSION_MIN_BYTES", DEFAULT_MIN_BYTES)
+        self.gzip_level = app.config.get("EMS_COMPRESSION_GZIP_LEVEL", DEFAULT_GZIP_LEVEL)
+        self.brotli_quality = app.config.get("EMS_COMPRESSION_BROTLI_QUALITY", DEFAULT_BROTLI_QUALITY)
+        self.encodings = (["br"] if brotli is not None else []) + ["gzip"]
+        app.after_request(self._compress)
+
+    def compress(self, data, encoding):
+        if encoding == "br":
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level)
+
+    def _compress(self, response):
+        if (response.direct_passthrough or response.is_streamed or not _compressible(response.mimetype)
+                or not 200 <= response.status_code < 300 or response.status_code == 204
+                or "Content-Encoding" in response.headers):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"), self.encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_bytes:
+            return response
+        response.set_data(self.compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,35 @@
+"""
+Tallying of election results.
+
+``compute_results`` turns an election document's ``votes`` map into the payload
+served by ``/get_results``. It is used for live results and, once an election
+closes, to compute the frozen ``final_results`` stored on the election.
+"""
+
+
+def compute_results(election):
+    """Returns {"results": [...], "winner": ...}; both are empty when no votes have been cast."""
+    votes = election.get('votes') or {}
+    if not votes:
+        return {"results": [], "winner": None}
+
+    results = []
+    for candidate in election.get('candidates', []):
+        candidate_id = str(candidate['_id'])
+        results.append({
+            "name": candidate['name'],
+            "party": candidate['party'],
+            "votes": votes.get(candidate_id, 0)
+        })
+    if not results:
+        return {"results": [], "winner": None}
+
+    max_votes = max(results, key=lambda x: x['votes'])['votes']
+    winners = [candidate for candidate in results if candidate['votes'] == max_votes]
+
+    if len(winners) > 1:
+        winner = {"name": "Draw", "party": "N/A", "votes": max_votes}
+    else:
+        winner = winners[0]
+
+    return {"results": results, "winner": winner}
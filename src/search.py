@@ -0,0 +1,273 @@
+"""
+Voter and candidate search.
+
+Names are split into normalized words (case-folded, accents stripped) and
+kept in a sorted in-memory list of ``(word, id)`` pairs. A prefix search is
+then a binary search to the first matching word followed by a short forward
+scan, independent of the number of records. Multi-word queries scan the
+word with the fewest matches and keep records that also have the others.
+Results come in word order and are paginated with an opaque cursor.
+
+Each index is built from the database on first use and picks up records
+inserted by other processes with an incremental refresh (new ``_id`` values,
+at most every ``EMS_SEARCH_REFRESH_SECONDS``). Edits and deletions arrive as
+invalidations on the app's bus; the affected records are re-read before the
+next search.
+
+Only one thread builds or refreshes an index at a time; concurrent searches
+on a cold index wait for that build instead of each scanning the collection.
+
+CNIC prefixes, with or without the dashes of ``XXXXX-XXXXXXX-X``, are answered
+by the ``cnic`` index in MongoDB instead.
+"""
+
+import re
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from flask import current_app
+from db import mongo
+from invalidation import BUS_KEY, CANDIDATES, VOTERS, ALL
+
+VOTERS_KEY = "ems_voter_search"
+CANDIDATES_KEY = "ems_candidate_search"
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+CURSOR_SEPARATOR = "|"
+
+# ObjectIds from other writers can trail our clock slightly; re-reading a short
+# overlap is harmless because adding a record again replaces it.
+REFRESH_OVERLAP = timedelta(seconds=30)
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def words(text):
+    """Normalized words of ``text``: case-folded, accents stripped, split on anything else."""
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode().casefold()
+    return [word for word in _NON_WORD.split(text) if word]
+
+
+class PrefixIndex:
+    """A sorted list of ``(word, id)`` pairs searched by prefix."""
+
+    def __init__(self):
+        self._entries = []
+        self._words = {}
+
+    def __len__(self):
+        return len(self._words)
+
+    def build(self, items):
+        """Replaces the index with ``(id, text)`` items, sorting once."""
+        self._words = {}
+        for record_id, text in items:
+            self._words[record_id] = tuple(sorted({sys.intern(word) for word in words(text)}))
+        self._entries = sorted((word, record_id) for record_id, found in self._words.items() for word in found)
+
+    def add(self, record_id, text):
+        self.remove(record_id)
+        found = tuple(sorted({sys.intern(word) for word in words(text)}))
+        self._words[record_id] = found
+        for word in found:
+            insort(self._entries, (word, record_id))
+
+    def remove(self, record_id):
+        for word in self._words.pop(record_id, ()):
+            index = bisect_left(self._entries, (word, record_id))
+            if index < len(self._entries) and self._entries[index] == (word, record_id):
+                del self._entries[index]
+
+    def _matches(self, prefix):
+        """How many entries have a word starting with ``prefix``."""
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return bisect_left(self._entries, (end,)) - bisect_left(self._entries, (prefix,))
+
+    def search(self, query, limit=DEFAULT_LIMIT, cursor=None):
+        """Ids of records with a word starting with each query word. Returns ``(ids, next_cursor)``."""
+        query_words = words(query)
+        if not query_words:
+            return [], None
+        # Scan the word with the fewest matches and check the others per record
+        driver = min(query_words, key=self._matches)
+        others = [word for word in query_words if word is not driver]
+
+        entries = self._entries
+        if cursor is None:
+            position = bisect_left(entries, (driver,))
+        else:
+            word, _, record_id = cursor.partition(CURSOR_SEPARATOR)
+            position = bisect_right(entries, (word, record_id))
+
+        ids = []
+        while position < len(entries) and len(ids) < limit:
+            word, record_id = entries[position]
+            position += 1
+            if not word.startswith(driver):
+                return ids, None
+            found = self._words[record_id]
+            # A record is listed once, under its first word that matches
+            if next(w for w in found if w.startswith(driver)) != word:
+                continue
+            if all(any(w.startswith(other) for w in found) for other in others):
+                ids.append(record_id)
+        if position < len(entries) and entries[position][0].startswith(driver):
+            word, record_id = entries[position - 1]
+            return ids, f"{word}{CURSOR_SEPARATOR}{record_id}"
+        return ids, None
+
+
+class SearchIndex:
+    """A ``PrefixIndex`` over one collection, kept in step with the database.
+
+    ``collection`` is a callable returning the collection, so the index can be
+    created before a database connection exists. ``key`` is the field that
+    identifies a record and ``fields`` the fields whose words are indexed.
+    """
+
+    def __init__(self, collection, key, fields, refresh_interval=5.0):
+        self._collection = collection
+        self.key = key
+        self.fields = fields
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._index = None
+        self._stale = set()
+        self._refreshed_at = None
+        self._last_refresh = 0.0
+
+    def _projection(self):
+        projection = {field: 1 for field in self.fields}
+        projection[self.key] = 1
+        return projection
+
+    def _item(self, record):
+        return str(record[self.key]), " ".join(str(record.get(field) or "") for field in self.fields)
+
+    def _key_value(self, record_id):
+        return ObjectId(record_id) if self.key == "_id" and ObjectId.is_valid(record_id) else record_id
+
+    def build(self):
+        """(Re)builds the index from every record in the collection."""
+        started = datetime.utcnow()
+        index = PrefixIndex()
+        index.build(self._item(record) for record in self._collection().find({}, self._projection()))
+        with self._lock:
+            self._index = index
+            self._stale.clear()
+            self._refreshed_at = started
+            self._last_refresh = time.monotonic()
+        return index
+
+    def invalidate(self, record_id):
+        """Marks a record as changed elsewhere; ``ALL`` rebuilds the index on next use."""
+        with self._lock:
+            if record_id == ALL:
+                self._index = None
+            else:
+                self._stale.add(str(record_id))
+
+    def _refresh(self):
+        """Returns the index, after building it or applying changes made since the last search."""
+        index = self._index
+        if index is None:
+            with self._build_lock:
+                index = self._index
+                if index is None:
+                    return self.build()
+        with self._lock:
+            stale, self._stale = self._stale, set()
+        if stale:
+            found = {str(record[self.key]): record for record in self._collection().find(
+                {self.key: {"$in": [self._key_value(record_id) for record_id in stale]}}, self._projection())}
+            with self._lock:
+                for record_id in stale:
+                    if record_id in found:
+                        index.add(*self._item(found[record_id]))
+                    else:
+                        index.remove(record_id)
+        last_refresh = self._last_refresh
+        if time.monotonic() - last_refresh >= self.refresh_interval:
+            with self._build_lock:
+                # Another search may have refreshed while this one waited
+                if self._last_refresh == last_refresh:
+                    self._add_recent(index)
+        return index
+
+    def _add_recent(self, index):
+        """Adds records inserted since the last build or refresh."""
+        started = datetime.utcnow()
+        since = ObjectId.from_datetime(self._refreshed_at - REFRESH_OVERLAP)
+        records = list(self._collection().find({"_id": {"$gte": since}}, self._projection()))
+        with self._lock:
+            for record in records:
+                index.add(*self._item(record))
+            self._refreshed_at = started
+            self._last_refresh = time.monotonic()
+
+    def search(self, query, limit=DEFAULT_LIMIT, cursor=None):
+        index = self._refresh()
+        with self._lock:
+            return index.search(query, limit, cursor)
+
+    def fetch(self, record_ids, projection):
+        """The records for ``record_ids``, in the same order."""
+        found = {str(record[self.key]): record for record in self._collection().find(
+            {self.key: {"$in": [self._key_value(record_id) for record_id in record_ids]}}, projection)}
+        return [found[record_id] for record_id in record_ids if record_id in found]
+
+
+def is_cnic_prefix(query):
+    """Whether a search query is a CNIC prefix: digits, optionally dashed."""
+    return query.replace("-", "").isdigit()
+
+
+def cnic_prefix_pattern(prefix):
+    """An anchored regex for CNICs starting with ``prefix``, stored with or without dashes."""
+    digits = prefix.replace("-", "")
+    parts = [digits[:5], digits[5:12], digits[12:]]
+    return "^" + "-?".join(part for part in parts if part)
+
+
+def search_cnic(collection, prefix, limit=DEFAULT_LIMIT, cursor=None):
+    """Voters whose CNIC starts with ``prefix`` (digits, dashes optional), using the ``cnic`` index."""
+    query = {"cnic": {"$regex": cnic_prefix_pattern(prefix)}}
+    if cursor:
+        query["cnic"]["$gt"] = cursor
+    voters = list(collection.find(query, {"_id": 0, "cnic": 1, "name": 1, "constituency": 1})
+                  .sort("cnic", 1).limit(limit + 1))
+    next_cursor = voters[limit - 1]["cnic"] if len(voters) > limit else None
+    return voters[:limit], next_cursor
+
+
+def init_app(app):
+    """Creates the voter and candidate indexes and subscribes them to the app's bus."""
+    interval = app.config.get("EMS_SEARCH_REFRESH_SECONDS", 5.0)
+    voters = SearchIndex(lambda: mongo.db.voters, "cnic", ["name"], interval)
+    candidates = SearchIndex(lambda: mongo.db.candidates, "_id", ["name", "party"], interval)
+
+    def changed(topic, key):
+        if topic == VOTERS:
+            voters.invalidate(key)
+        elif topic == CANDIDATES:
+            candidates.invalidate(key)
+
+    app.extensions[BUS_KEY].subscribe(changed)
+    app.extensions[VOTERS_KEY] = voters
+    app.extensions[CANDIDATES_KEY] = candidates
+
+
+def get_voter_search(app=None):
+    return (app or current_app).extensions[VOTERS_KEY]
+
+
+def get_candidate_search(app=None):
+    return (app or current_app).extensions[CANDIDATES_KEY]
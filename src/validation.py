@@ -0,0 +1,188 @@
+"""
+Declarative request validation for the JSON endpoints.
+
+Schemas are compiled once at import time into a flat tuple of field checks, so
+validating a request is a single pass over the payload with no database calls.
+Handlers decorated with ``validate_json`` read the cleaned payload from
+``g.payload``; malformed payloads are rejected with a 400 before the handler runs.
+"""
+
+import re
+from datetime import datetime
+from functools import wraps
+from flask import request, g, jsonify
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+CNIC_PATTERN = r'^[0-9]{1,13}$|^[0-9]{5}-[0-9]{7}-[0-9]$'
+DATE_PATTERN = re.compile(r'^(\d{4})-(\d{2})-(\d{2})$')
+
+
+class ValidationError(ValueError):
+    """Raised when a payload does not match its schema."""
+
+
+class Field:
+    """Base field: required by default, converts a raw JSON value or raises ValidationError."""
+
+    message = "Invalid value for '{name}'."
+
+    def __init__(self, required=True, message=None):
+        self.required = required
+        if message:
+            self.message = message
+
+    def convert(self, value):
+        return value
+
+
+class String(Field):
+    """A non-empty string, optionally bounded in length and matched against a pattern."""
+
+    def __init__(self, max_length=200, pattern=None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_length = max_length
+        self.pattern = re.compile(pattern) if pattern else None
+
+    def convert(self, value):
+        if not isinstance(value, str):
+            raise ValidationError
+        value = value.strip()
+        if not value or len(value) > self.max_length:
+            raise ValidationError
+        if self.pattern and not self.pattern.match(value):
+            raise ValidationError
+        return value
+
+
+class Date(Field):
+    """A ``YYYY-MM-DD`` date. The original string is kept; the parsed date is checked."""
+
+    message = "Invalid date format. Use YYYY-MM-DD."
+
+    def convert(self, value):
+        match = DATE_PATTERN.match(value) if isinstance(value, str) else None
+        if not match:
+            raise ValidationError
+        try:
+            datetime(*map(int, match.groups()))
+        except ValueError:
+            raise ValidationError from None
+        return value
+
+
+class DateTime(Field):
+    """An ISO 8601 date-time string, returned as a naive local ``datetime``.
+
+    Stored dates are naive and compared with ``datetime.now()``, so a value
+    with a UTC offset is converted to local time and its offset dropped.
+    """
+
+    message = "Invalid value for '{name}'. Use an ISO 8601 date and time."
+
+    def convert(self, value):
+        if not isinstance(value, str):
+            raise ValidationError
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValidationError from None
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone().replace(tzinfo=None)
+        return parsed
+
+
+class ObjectIdField(Field):
+    """A MongoDB ObjectId given as its 24-character hex string."""
+
+    def convert(self, value):
+        if not isinstance(value, str):
+            raise ValidationError
+        try:
+            return ObjectId(value)
+        except InvalidId:
+            raise ValidationError from None
+
+
+class ListOf(Field):
+    """A list whose items all match ``item``."""
+
+    def __init__(self, item, max_items=500, **kwargs):
+        super().__init__(**kwargs)
+        self.item = item
+        self.max_items = max_items
+
+    def convert(self, value):
+        if not isinstance(value, list) or len(value) > self.max_items:
+            raise ValidationError
+        convert = self.item.convert
+        return [convert(v) for v in value]
+
+
+class Schema:
+    """A compiled set of named fields."""
+
+    def __init__(self, **fields):
+        self._fields = tuple(
+            (name, field.required, field.convert, field.message.format(name=name))
+            for name, field in fields.items()
+        )
+
+    def validate(self, data):
+        """Returns the cleaned payload or raises ValidationError with a user-facing message."""
+        if not isinstance(data, dict):
+            raise ValidationError("Invalid JSON payload.")
+        cleaned = {}
+        for name, required, convert, message in self._fields:
+            value = data.get(name)
+            if value is None:
+                if required:
+                    raise ValidationError(f"Missing required field '{name}'.")
+                continue
+            try:
+                cleaned[name] = convert(value)
+            except ValidationError:
+                raise ValidationError(message) from None
+        return cleaned
+
+
+def validate_json(schema):
+    """Decorator that validates ``request.json`` against ``schema`` into ``g.payload``."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            try:
+                g.payload = schema.validate(request.get_json(silent=True))
+            except ValidationError as e:
+                return jsonify({"success": False, "message": str(e), "data": None}), 400
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+REGISTER_VOTER = Schema(
+    name=String(),
+    cnic=String(max_length=15, pattern=CNIC_PATTERN),
+    dob=Date(),
+    constituency=String(max_length=50, required=False),
+)
+
+ADD_CANDIDATE = Schema(
+    name=String(),
+    party=String(),
+    cnic=String(max_length=15, pattern=CNIC_PATTERN),
+    dob=Date(),
+)
+
+ELECTION = Schema(
+    name=String(),
+    start_date=DateTime(),
+    end_date=DateTime(),
+    candidate_ids=ListOf(ObjectIdField()),
+    constituency=String(max_length=50, required=False),
+)
+
+CAST_VOTE = Schema(
+    election_id=ObjectIdField(),
+    candidate_id=ObjectIdField(),
+)
@@ -0,0 +1,213 @@
+"""
+In-process voter roll membership.
+
+A bloom filter over every registered CNIC answers "not registered" without a
+database round trip, and a bounded LRU of recent voter records serves repeated
+lookups of the same voters. Only bloom-filter positives that miss the LRU reach
+MongoDB.
+
+Voters registered by another process are picked up by an incremental refresh
+(new ``_id`` values since the last refresh), run at most once every
+``EMS_VOTER_ROLL_REFRESH_SECONDS`` when the filter answers negative. Only one
+thread builds or refreshes the filter at a time; during a cold-start burst
+the others wait for the build instead of each scanning the collection. Bits
+are only set under the roll's lock, so concurrent registrations never lose one.
+
+The incremental refresh only sees new documents. Voters deleted elsewhere stay
+in the filter (a false positive, answered by MongoDB), and cached records of
+voters edited elsewhere are only dropped by an invalidation on the bus. To
+bound both, the first refresh due after ``EMS_VOTER_ROLL_REBUILD_SECONDS``
+(default an hour) rebuilds the filter from scratch and clears the record cache.
+
+The filter can lag behind other processes, so it is never the final word on
+whether a CNIC is taken: the unique ``cnic`` index is.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from flask import current_app
+from db import mongo
+
+EXTENSION_KEY = "ems_voter_roll"
+VOTER_FIELDS = {"_id": 0, "cnic": 1, "dob": 1, "name": 1, "constituency": 1, "eligible_from": 1}
+
+# ObjectIds from other writers can trail our clock slightly; re-reading a short
+# overlap is harmless because adding to the filter is idempotent.
+REFRESH_OVERLAP = timedelta(seconds=30)
+
+
+class BloomFilter:
+    """A fixed-size bloom filter over strings, using blake2b double hashing."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(int(capacity), 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.capacity = capacity
+        self.count = 0
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, item):
+        bits = self.bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+
+class VoterRoll:
+    """Bloom filter plus LRU record cache in front of the ``voters`` collection.
+
+    ``collection`` is a callable returning the voters collection, so the roll
+    can be created before a database connection exists.
+    """
+
+    def __init__(self, collection, capacity=1000000, cache_size=10000, refresh_interval=5.0,
+                 rebuild_interval=3600.0):
+        self._collection = collection
+        self.capacity = capacity
+        self.cache_size = cache_size
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._records = OrderedDict()
+        self._bloom = None
+        self._refreshed_at = None
+        self._last_refresh = 0.0
+        self._last_build = 0.0
+
+    def build(self):
+        """(Re)builds the filter from every CNIC in the collection."""
+        collection = self._collection()
+        started = datetime.utcnow()
+        capacity = max(self.capacity, collection.estimated_document_count() * 2)
+        bloom = BloomFilter(capacity)
+        for voter in collection.find({}, {"_id": 0, "cnic": 1}):
+            bloom.add(voter["cnic"])
+        with self._lock:
+            self._bloom = bloom
+            self._records.clear()
+            self._refreshed_at = started
+            self._last_refresh = self._last_build = time.monotonic()
+        return bloom
+
+    def refresh(self):
+        """Adds voters inserted since the last build or refresh; concurrent callers wait for one refresh."""
+        last_refresh = self._last_refresh
+        with self._build_lock:
+            if self._last_refresh == last_refresh:
+                self._refresh()
+
+    def _refresh(self):
+        if time.monotonic() - self._last_build >= self.rebuild_interval:
+            self.build()
+            return
+        started = datetime.utcnow()
+        since = ObjectId.from_datetime(self._refreshed_at - REFRESH_OVERLAP)
+        cnics = [voter["cnic"] for voter in self._collection().find({"_id": {"$gte": since}}, {"_id": 0, "cnic": 1})]
+        with self._lock:
+            for cnic in cnics:
+                self._bloom.add(cnic)
+        self._refreshed_at = started
+        self._last_refresh = time.monotonic()
+        if self._bloom.count > self._bloom.capacity:
+            self.build()
+
+    def warm(self):
+        """Builds the filter now if it has not been built yet; concurrent callers wait for one build."""
+        if self._bloom is None:
+            with self._build_lock:
+                if self._bloom is None:
+                    self.build()
+
+    def _might_contain(self, cnic):
+        self.warm()
+        if cnic in self._bloom:
+            return True
+        if time.monotonic() - self._last_refresh < self.refresh_interval:
+            return False
+        self.refresh()
+        return cnic in self._bloom
+
+    def lookup(self, cnic):
+        """Returns the voter record for ``cnic``, or None if not registered."""
+        if not isinstance(cnic, str):
+            return None
+        with self._lock:
+            record = self._records.get(cnic)
+            if record is not None:
+                self._records.move_to_end(cnic)
+                return record
+        if not self._might_contain(cnic):
+            return None
+        record = self._collection().find_one({"cnic": cnic}, VOTER_FIELDS)
+        if record is not None:
+            self._remember(cnic, record)
+        return record
+
+    def is_registered(self, cnic):
+        """Checks if the voter is registered."""
+        return self.lookup(cnic) is not None
+
+    def add(self, voter):
+        """Records a newly registered voter."""
+        self._add_to_filter(voter["cnic"])
+        self._remember(voter["cnic"], {k: voter.get(k) for k in VOTER_FIELDS if k != "_id"})
+
+    def discard(self, cnic):
+        """Drops a cached record so the next lookup reads it again."""
+        with self._lock:
+            self._records.pop(cnic, None)
+
+    def invalidate(self, cnic):
+        """Handles a voter changed elsewhere: re-reads the record, and counts it as possibly registered."""
+        if cnic == "*":
+            with self._lock:
+                self._records.clear()
+            return
+        self.discard(cnic)
+        self._add_to_filter(cnic)
+
+    def _add_to_filter(self, cnic):
+        # Setting a bit is a read-modify-write of its byte; unlocked, two adds can lose one
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(cnic)
+
+    def _remember(self, cnic, record):
+        with self._lock:
+            self._records[cnic] = record
+            self._records.move_to_end(cnic)
+            while len(self._records) > self.cache_size:
+                self._records.popitem(last=False)
+
+
+def get_voter_roll(app=None):
+    """The voter roll for the current app, created on first use."""
+    app = app or current_app._get_current_object()
+    roll = app.extensions.get(EXTENSION_KEY)
+    if roll is None:
+        roll = app.extensions.setdefault(EXTENSION_KEY, VoterRoll(
+            lambda: mongo.db.voters,
+            capacity=app.config.get("EMS_VOTER_ROLL_CAPACITY", 1000000),
+            cache_size=app.config.get("EMS_VOTER_CACHE_SIZE", 10000),
+            refresh_interval=app.config.get("EMS_VOTER_ROLL_REFRESH_SECONDS", 5.0),
+            rebuild_interval=app.config.get("EMS_VOTER_ROLL_REBUILD_SECONDS", 3600.0),
+        ))
+    return roll
@@ -0,0 +1,214 @@
+"""
+Election warm-up.
+
+When an election opens, its voters arrive at once. If that happens while the
+connection pool, the caches and the database working set are cold, the first
+minutes are the slowest. A warm-up run for one election:
+
+- opens ``EMS_WARMUP_CONNECTIONS`` pooled connections (default: the client's
+  ``minPoolSize``, or 10);
+- caches the election document, its ballot candidates and the candidate
+  list, and runs the election's ``/available_elections`` query;
+- builds the voter roll filter and reads the constituency's voters (every
+  voter, for an election without a constituency), at most
+  ``EMS_WARMUP_MAX_VOTERS`` (default 1,000,000), so the pages vote
+  validation reads are in memory.
+
+With ``EMS_WARMUP_LEAD_SECONDS`` set, the lifecycle scheduler warms each
+election that long before it opens; admins can also warm one on demand with
+``POST /warmup/<election_id>``. ``/healthz/ready`` answers 503 while an
+election that is open or due within the lead time has not been warmed in this
+process, so load balancers only route voters to warm instances. A probe that
+finds such an election starts its warm-up, so every instance warms itself
+even when the scheduler runs in another process.
+
+Readiness never waits on a warm-up that cannot help: an instance already
+serving an open election it has warmed stays ready while it warms the next
+one, and an election whose warm-up failed is reported under ``failed`` and
+served cold rather than keeping the instance out of rotation.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from db import mongo
+from invalidation import (
+    get_cache, load_candidate_list, load_election, load_open_elections, ELECTIONS, CANDIDATES, ALL
+)
+from lifecycle import FINAL
+from voter_roll import get_voter_roll
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_KEY = "ems_warmup"
+DEFAULT_CONNECTIONS = 10
+DEFAULT_MAX_VOTERS = 1000000
+
+
+class WarmupError(Exception):
+    """Raised when the election to warm up does not exist."""
+
+
+class Warmup:
+    """Runs warm-ups and tracks which elections this process has warmed."""
+
+    def __init__(self, app):
+        self.app = app
+        self.lead = app.config.get("EMS_WARMUP_LEAD_SECONDS")
+        options = app.config.get("MONGO_CLIENT_OPTIONS") or {}
+        connections = app.config.get("EMS_WARMUP_CONNECTIONS") or options.get("minPoolSize") or DEFAULT_CONNECTIONS
+        self.connections = min(connections, options.get("maxPoolSize", 100))
+        self.max_voters = app.config.get("EMS_WARMUP_MAX_VOTERS", DEFAULT_MAX_VOTERS)
+        self.reports = {}
+        self.failed = {}
+        self._running = set()
+        self._lock = threading.Lock()
+        app.extensions[EXTENSION_KEY] = self
+
+    def open_pool(self, client):
+        """Checks out ``connections`` connections at the same time, so the pool opens them all."""
+        barrier = threading.Barrier(self.connections)
+
+        def ping(_):
+            barrier.wait(timeout=10)
+            client.admin.command("ping")
+
+        with ThreadPoolExecutor(self.connections) as executor:
+            list(executor.map(ping, range(self.connections)))
+
+    def warm(self, election_id):
+        """Warms the app for one election. Returns a report with the time each step took."""
+        key = str(election_id)
+        with self._lock:
+            self._running.add(key)
+        steps = {}
+        started = time.perf_counter()
+
+        def step(name, f):
+            step_started = time.perf_counter()
+            result = f()
+            steps[name] = round((time.perf_counter() - step_started) * 1000, 2)
+            return result
+
+        try:
+            with self.app.app_context():
+                db = mongo.db
+                cache = get_cache(self.app)
+                step("pool", lambda: self.open_pool(mongo.cx))
+                election = step("election", lambda: load_election(db, election_id))
+                if election is None:
+                    raise WarmupError("Election not found.")
+                cache.set(ELECTIONS, election_id, election)
+                step("candidates", lambda: self._candidates(db, cache, election))
+                step("schedule", lambda: load_open_elections(
+                    db, election["start_date"], [election.get("constituency"), None]))
+                step("voter_roll", lambda: self._voters(db, election.get("constituency")))
+        except WarmupError:
+            raise
+        except Exception as e:
+            with self._lock:
+                self.failed[key] = {"election_id": key, "error": str(e), "failed_at": datetime.now()}
+            raise
+        finally:
+            with self._lock:
+                self._running.discard(key)
+
+        report = {
+            "election_id": key,
+            "name": election["name"],
+            "start_date": election["start_date"],
+            "warmed_at": datetime.now(),
+            "ms": round((time.perf_counter() - started) * 1000, 2),
+            "steps": steps,
+        }
+        with self._lock:
+            self.reports[key] = report
+            self.failed.pop(key, None)
+        logger.info("Warmed up election %s in %s ms: %s", key, report["ms"], steps)
+        return report
+
+    def warm_in_background(self, election_id):
+        def run():
+            try:
+                self.warm(election_id)
+            except Exception:
+                logger.exception("Warm-up failed for election %s", election_id)
+
+        with self._lock:
+            if str(election_id) in self._running:
+                return
+            self._running.add(str(election_id))
+        threading.Thread(target=run, name="ems-warmup", daemon=True).start()
+
+    def _candidates(self, db, cache, election):
+        ids = [candidate["_id"] for candidate in election.get("candidates", [])]
+        # Ballot candidates are cached under the IDs votes refer to them by
+        for candidate in db.candidates.find({"_id": {"$in": [_object_id(c) for c in ids]}}, {"name": 1, "party": 1}):
+            cache.set(CANDIDATES, candidate["_id"], candidate)
+        cache.set(CANDIDATES, ALL, load_candidate_list(db))
+
+    def _voters(self, db, constituency):
+        """Reads the voters who can vote in the election; everyone, if it has no constituency."""
+        get_voter_roll(self.app).warm()
+        query = {} if constituency is None else {"constituency": constituency}
+        for _ in db.voters.find(query, {"_id": 0, "cnic": 1}).limit(self.max_voters).batch_size(10000):
+            pass
+
+    def due(self, db, now=None):
+        """Elections open now, or opening within the lead time."""
+        now = now or datetime.now()
+        horizon = now + timedelta(seconds=self.lead or 0)
+        return list(db.elections.find(
+            {"start_date": {"$lte": horizon}, "end_date": {"$gte": now}, "status": {"$nin": FINAL}},
+            {"start_date": 1}
+        ))
+
+    def tick(self, db, now=None):
+        """Warms every due election not yet warmed. Returns the seconds until the next one is due, or None."""
+        if self.lead is None:
+            return None
+        now = now or datetime.now()
+        for election in self.due(db, now):
+            if str(election["_id"]) not in self.reports:
+                try:
+                    self.warm(election["_id"])
+                except Exception:
+                    logger.exception("Warm-up failed for election %s", election["_id"])
+        upcoming = db.elections.find_one(
+            {"start_date": {"$gt": now + timedelta(seconds=self.lead)}}, {"start_date": 1}, sort=[("start_date", 1)]
+        )
+        if upcoming is None:
+            return None
+        return (upcoming["start_date"] - timedelta(seconds=self.lead) - now).total_seconds()
+
+    def readiness(self, db, now=None):
+        """Whether this process should receive voters, and why not."""
+        now = now or datetime.now()
+        with self._lock:
+            running = sorted(self._running)
+            warmed, failed = dict(self.reports), dict(self.failed)
+        cold, serving = [], False
+        if self.lead is not None:
+            for election in self.due(db, now):
+                key = str(election["_id"])
+                if key in warmed:
+                    serving = serving or election["start_date"] <= now
+                elif key not in failed:
+                    cold.append(key)
+            # Each instance warms itself, even when the scheduler runs elsewhere
+            for key in cold:
+                if key not in running:
+                    self.warm_in_background(_object_id(key))
+        return {"ready": serving or not cold, "warming": running, "cold": cold,
+                "failed": list(failed.values()), "warmed": list(warmed.values())}
+
+
+def _object_id(value):
+    return ObjectId(value) if ObjectId.is_valid(value) else value
+
+
+def get_warmup(app):
+    return app.extensions[EXTENSION_KEY]
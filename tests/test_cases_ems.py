@@ -2,26 +2,51 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 from dotenv import load_dotenv
-from app import app, format_response, login_required, admin_required
+from app import app, create_app, format_response, login_required, admin_required
+from db import mongo
+from voter_roll import BloomFilter, VoterRoll, get_voter_roll
+from indexes import ensure_indexes
+from lifecycle import advance, initial_status, OPEN, CLOSED, CERTIFIED
+from admission import AdmissionClass
+from ballot_log import append_ballot, record_vote, settle, settle_pending, verify_election, COUNTED, VOID
+from recount import parallel_tally, tally, recount
+from datagen import DatasetGenerator, populate
+from query_profiling import QueryBudgetExceeded, REPORT_HEADER
+from invalidation import get_cache, Cache, LocalBus, invalidations_for, ELECTIONS, CANDIDATES, RESULTS, ALL
+from edge import EdgeStore, EdgeSyncer, encode_batch, APPLIED, DUPLICATE, CONFLICT
+from search import PrefixIndex, SearchIndex
+from warmup import get_warmup
+from response_compression import choose_encoding
+import gzip
+from validation import ValidationError, REGISTER_VOTER, ELECTION, CNIC_PATTERN
+import eligibility
+from eligibility import age_on, eligible_from, ages_on, eligibility_dates, turnout_by_age_band
 import pytest
-from flask import session
-from datetime import datetime
+import time
+import re
+from flask import current_app, session, g, Response
+from json_provider import response_data
+import threading
+from types import SimpleNamespace
+from datetime import datetime, date, timedelta, timezone
+from decimal import Decimal
 from bson.objectid import ObjectId
-from flask_pymongo import PyMongo
+from pymongo.read_preferences import Primary, SecondaryPreferred, Nearest
     
 load_dotenv()
 
 # Create a fixture to initialize the Flask app and MongoDB
 @pytest.fixture
 def client():
-    app.config['TESTING'] = True
-    app.config['SECRET_KEY'] = 'test_secret_key'
-    app.config["MONGO_URI"] = os.getenv("MONGO_URI")
-    app.config["MONGO_DBNAME"] = "test"  # Use the test database
-    mongo = PyMongo(app)  # Initialize PyMongo here
-
-    with app.test_client() as client:
-        with app.app_context():
+    test_app = create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test_secret_key',
+        "MONGO_URI": os.getenv("MONGO_URI"),
+        "MONGO_DBNAME": "test",  # Use the test database
+    })
+
+    with test_app.test_client() as client:
+        with test_app.app_context():
             yield client, mongo  # Pass both client and mongo to the tests
 
 # UNIT TESTS
@@ -35,6 +60,106 @@ def test_format_response_with_data():
         response = format_response(True, "Success", data={"id": 1})
         assert response.json == {"success": True, "message": "Success", "data": {"id": 1}}
 
+@pytest.mark.parametrize("fast_json", [True, False])
+def test_format_response_serializes_bson_types(fast_json):
+    test_app = create_app({'TESTING': True, 'EMS_FAST_JSON': fast_json})
+    object_id = ObjectId("6760a2f1c2b7a1d9e4f0a111")
+    with test_app.app_context():
+        response = format_response(True, "Success", {
+            "election_id": object_id,
+            "start_date": datetime(2024, 12, 12, 11, 53),
+            "turnout": Decimal("0.5")
+        })
+    assert response.json["data"] == {
+        "election_id": "6760a2f1c2b7a1d9e4f0a111",
+        "start_date": "2024-12-12T11:53:00",
+        "turnout": "0.5"
+    }
+
+def test_validation_schema_cleans_payload():
+    payload = ELECTION.validate({
+        "name": " pti election ",
+        "start_date": "2024-12-12 11:53:00",
+        "end_date": "2024-12-24T01:54",
+        "candidate_ids": ["6760a2f1c2b7a1d9e4f0a111"]
+    })
+    assert payload["name"] == "pti election"
+    assert payload["start_date"] == datetime(2024, 12, 12, 11, 53)
+    assert payload["candidate_ids"] == [ObjectId("6760a2f1c2b7a1d9e4f0a111")]
+
+@pytest.mark.parametrize("payload, message", [
+    (None, "Invalid JSON payload."),
+    ({"name": "John Doe", "cnic": "11111"}, "Missing required field 'dob'."),
+    ({"name": "John Doe", "cnic": "11111", "dob": "01-01-2000"}, "Invalid date format. Use YYYY-MM-DD."),
+    ({"name": "John Doe", "cnic": "11111", "dob": "2000-02-30"}, "Invalid date format. Use YYYY-MM-DD."),
+    ({"name": "John Doe", "cnic": "abc", "dob": "2000-01-01"}, "Invalid value for 'cnic'."),
+    ({"name": 5, "cnic": "11111", "dob": "2000-01-01"}, "Invalid value for 'name'."),
+])
+def test_validation_schema_rejects(payload, message):
+    with pytest.raises(ValidationError) as excinfo:
+        REGISTER_VOTER.validate(payload)
+    assert str(excinfo.value) == message
+
+def test_cast_vote_rejects_bad_object_id():
+    test_app = create_app({'TESTING': True, 'MONGO_URI': 'mongodb://localhost:27017/test'})
+    with test_app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['user'] = {"id": "33333", "role": "voter"}
+        response = client.post('/cast_vote', json={"election_id": "not-an-id", "candidate_id": "x"})
+        assert response.status_code == 400
+        assert response.json['message'] == "Invalid value for 'election_id'."
+        # Rejected before any database call
+        assert mongo.is_connected(test_app) is False
+
+def test_routes_reject_malformed_election_ids():
+    test_app = create_app({'TESTING': True, 'MONGO_URI': 'mongodb://localhost:27017/test'})
+    with test_app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['user'] = {"id": "admin123", "role": "admin"}
+        for method, path in (('delete', '/delete_election/not-an-id'), ('get', '/get_results/not-an-id'),
+                             ('get', '/get_election/not-an-id')):
+            response = getattr(client, method)(path)
+            assert response.status_code == 200
+            assert response.json == {"success": False, "message": "Election not found.", "data": None}
+        assert mongo.is_connected(test_app) is False
+
+def test_bloom_filter_membership():
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    members = [f"35202-{i:07d}-1" for i in range(10000)]
+    for cnic in members:
+        bloom.add(cnic)
+    assert all(cnic in bloom for cnic in members)
+    false_positives = sum(f"61101-{i:07d}-3" in bloom for i in range(10000))
+    assert false_positives < 300
+
+def test_admission_class_sheds_when_queue_is_full():
+    admission_class = AdmissionClass("listing", limit=1, queue=0, timeout=0.01)
+    assert admission_class.acquire() is True
+    assert admission_class.acquire() is False
+    admission_class.release()
+    assert admission_class.acquire() is True
+    assert admission_class.metrics()["shed"] == 1
+
+    threads = [threading.Thread(target=lambda: [admission_class.reject() for _ in range(1000)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert admission_class.metrics()["shed"] == 8001
+
+def test_admission_sheds_listings_with_retry_after():
+    test_app = create_app({
+        'TESTING': True,
+        'EMS_ADMISSION': {"listing": {"limit": 0, "queue": 0}},
+    })
+    with test_app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['user'] = {"id": "voter123", "role": "voter"}
+        response = client.get('/get_candidates')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+    assert test_app.extensions['ems_admission'].metrics()["listing"]["shed"] == 1
+
 def test_login_required_decorator():
     def mock_protected_route():
         return "Protected"
@@ -89,6 +214,99 @@ def test_login_admin(client):
     assert response.json['success'] == True
     mongo.db.admins.delete_one({"cnic": "99999"})  # Clean up
 
+def test_voter_roll_lookup(client):
+    client, mongo = client  # Get client and mongo from fixture
+    mongo.db.voters.insert_one({"name": "Roll Voter", "cnic": "77777", "dob": "1990-01-01"})
+    try:
+        roll = get_voter_roll()
+        assert roll.lookup("77777")["dob"] == "1990-01-01"
+        assert roll.lookup("77778") is None
+
+        # Registered through the app: visible without rebuilding the filter
+        roll.add({"name": "New Voter", "cnic": "77779", "dob": "1995-05-05"})
+        assert roll.is_registered("77779")
+    finally:
+        mongo.db.voters.delete_one({"cnic": "77777"})
+
+def test_voter_roll_builds_once_under_concurrent_lookups(client):
+    client, mongo = client  # Get client and mongo from fixture
+    voters = mongo.db.voters
+    builds = []
+
+    def collection():
+        builds.append(threading.current_thread().name)
+        return voters
+
+    roll = VoterRoll(collection, refresh_interval=3600)
+    threads = [threading.Thread(target=roll.lookup, args=(f"7777{i}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+
+def test_search_index_builds_once_under_concurrent_searches(client):
+    client, mongo = client  # Get client and mongo from fixture
+    candidates = mongo.db.candidates
+    builds = []
+
+    def collection():
+        builds.append(threading.current_thread().name)
+        return candidates
+
+    index = SearchIndex(collection, "_id", ["name", "party"], refresh_interval=3600)
+    threads = [threading.Thread(target=index.search, args=("unity",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+
+def test_voter_roll_keeps_concurrent_registrations(client):
+    client, mongo = client  # Get client and mongo from fixture
+    roll = VoterRoll(lambda: mongo.db.voters, capacity=1000, refresh_interval=3600)
+    roll.warm()
+    cnics = [f"66{thread}{i:04d}" for thread in range(8) for i in range(500)]
+
+    def register(offset):
+        for cnic in cnics[offset * 500:(offset + 1) * 500]:
+            roll.add({"cnic": cnic, "name": "Concurrent"})
+
+    threads = [threading.Thread(target=register, args=(offset,)) for offset in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(roll._might_contain(cnic) for cnic in cnics)
+
+def test_voter_roll_rebuilds_to_drop_voters_deleted_elsewhere(client):
+    client, mongo = client  # Get client and mongo from fixture
+    mongo.db.voters.insert_one({"name": "Deleted Elsewhere", "cnic": "77781", "dob": "1990-01-01"})
+    roll = VoterRoll(lambda: mongo.db.voters, refresh_interval=0, rebuild_interval=0)
+    try:
+        assert roll.lookup("77781")["name"] == "Deleted Elsewhere"
+        mongo.db.voters.delete_one({"cnic": "77781"})
+        # A negative answer refreshes; past the rebuild interval that rebuilds and clears cached records
+        assert roll.lookup("77782") is None
+        assert roll.lookup("77781") is None
+    finally:
+        mongo.db.voters.delete_many({"cnic": "77781"})
+
+def test_register_voter_is_unique_even_with_a_stale_roll(client):
+    client, mongo = client  # Get client and mongo from fixture
+    ensure_indexes(current_app, mongo.db)
+    get_voter_roll().warm()
+    # Registered by another node since this node's roll was built
+    mongo.db.voters.insert_one({"name": "Other Node", "cnic": "77771", "dob": "1990-01-01"})
+    with client.session_transaction() as sess:
+        sess['user'] = {"id": "admin123", "role": "admin"}
+    try:
+        response = client.post('/register_voter', json={"name": "Other Node", "cnic": "77771", "dob": "1990-01-01"})
+        assert response.json == {"success": False, "message": "Voter already registered.", "data": None}
+        assert mongo.db.voters.count_documents({"cnic": "77771"}) == 1
+    finally:
+        mongo.db.voters.delete_many({"cnic": "77771"})
+
 # Voter Management
 def test_register_voter(client):
     client, mongo = client  # Get client and mongo from fixture
@@ -184,6 +402,70 @@ def test_create_election(client):
     mongo.db.elections.delete_one({"name": "pti election"})  # Clean up
     mongo.db.candidates.delete_one({"_id": candidate_id})  # Clean up
 
+def test_create_election_conflicts_are_per_constituency(client):
+    client, mongo = client  # Get client and mongo from fixture
+    with client.session_transaction() as sess:
+        sess['user'] = {"id": "admin123", "role": "admin"}
+    # Constituencies only this test uses, so other elections in the database cannot clash
+    constituencies = ["CONFLICT-1", "CONFLICT-2"]
+    mongo.db.elections.delete_many({"constituency": {"$in": constituencies}})
+
+    schedule = {"start_date": "2024-12-12 08:00:00", "end_date": "2024-12-12 17:00:00", "candidate_ids": []}
+    try:
+        first = client.post('/create_election', json=dict(schedule, name="First election", constituency="CONFLICT-1"))
+        second = client.post('/create_election', json=dict(schedule, name="Second election", constituency="CONFLICT-2"))
+        clash = client.post('/create_election', json=dict(schedule, name="By-election", constituency="CONFLICT-1"))
+        assert first.json['success'] == True
+        assert second.json['success'] == True
+        assert clash.json['success'] == False
+    finally:
+        mongo.db.elections.delete_many({"constituency": {"$in": constituencies}})
+
+def test_create_election_accepts_utc_offsets(client):
+    client, mongo = client  # Get client and mongo from fixture
+    with client.session_transaction() as sess:
+        sess['user'] = {"id": "admin123", "role": "admin"}
+    mongo.db.elections.delete_many({"constituency": "OFFSET-1"})
+    try:
+        response = client.post('/create_election', json={
+            "name": "Offset election", "constituency": "OFFSET-1", "candidate_ids": [],
+            "start_date": "2030-01-01T00:00:00+00:00", "end_date": "2030-01-01T17:00:00+05:00"})
+        assert response.status_code == 200 and response.json['success'] == True
+        election = mongo.db.elections.find_one({"constituency": "OFFSET-1"})
+        # Stored as naive local time, like every other date the app compares with datetime.now()
+        assert election["start_date"] == datetime(2030, 1, 1, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+        assert election["end_date"] == datetime(2030, 1, 1, 12, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    finally:
+        mongo.db.elections.delete_many({"constituency": "OFFSET-1"})
+
+def test_available_elections_scoped_to_constituency(client):
+    client, mongo = client  # Get client and mongo from fixture
+    mongo.db.voters.insert_one({"name": "Ali", "cnic": "88888", "dob": "1990-01-01", "constituency": "NA-1"})
+    active = {"start_date": datetime(2000, 1, 1), "end_date": datetime(2100, 1, 1), "candidates": [], "votes": {}}
+    own_id = mongo.db.elections.insert_one(dict(active, name="NA-1 election", constituency="NA-1")).inserted_id
+    other_id = mongo.db.elections.insert_one(dict(active, name="NA-2 election", constituency="NA-2")).inserted_id
+    # An election without a constituency is open to every voter
+    national_id = mongo.db.elections.insert_one(dict(active, name="National election")).inserted_id
+    candidate_id = mongo.db.candidates.insert_one({"name": "alizay", "party": "A", "cnic": "44444"}).inserted_id
+
+    with client.session_transaction() as sess:
+        sess['user'] = {"id": "88888", "role": "voter"}
+    try:
+        response = client.get('/available_elections')
+        names = [e['name'] for e in response.json['data']]
+        assert "NA-1 election" in names and "National election" in names and "NA-2 election" not in names
+
+        response = client.post('/cast_vote', json={"election_id": str(other_id), "candidate_id": str(candidate_id)})
+        assert response.json['message'] == "Election is not open to this voter's constituency."
+        response = client.post('/cast_vote', json={"election_id": str(national_id), "candidate_id": str(candidate_id)})
+        assert response.json['success'] == True
+    finally:
+        mongo.db.elections.delete_many({"_id": {"$in": [own_id, other_id, national_id]}})
+        mongo.db.ballots.delete_many({"election_id": national_id})
+        mongo.db.ballot_counters.delete_many({"_id": {"$regex": f"^{national_id}:"}})
+        mongo.db.candidates.delete_one({"_id": candidate_id})
+        mongo.db.voters.delete_one({"cnic": "88888"})
+
 def test_edit_election(client):
     client, mongo = client  # Get client and mongo from fixture
 
@@ -232,6 +514,741 @@ def test_edit_election(client):
         mongo.db.candidates.delete_one({"_id": candidate_id})  # Clean up candidate
 
 
+# Vote casting
+def test_cast_vote_idempotent_retry(client):
+    client, mongo = client  # Get client and mongo from fixture
+    mongo.db.voters.insert_one({"name": "Ali", "cnic": "33333", "dob": "1990-01-01"})
+    candidate_id = mongo.db.candidates.insert_one({
+        "name": "alizay",
+        "party": "A",
+        "cnic": "44444",
+        "dob": "1990-01-01"
+    }).inserted_id
+    election_id = mongo.db.elections.insert_one({
+        "name": "idempotency election",
+        "start_date": datetime(2000, 1, 1),
+        "end_date": datetime(2100, 1, 1),
+        "candidates": [{"_id": str(candidate_id), "name": "alizay", "party": "A"}],
+        "votes": {}
+    }).inserted_id
+
+    with client.session_transaction() as sess:
+        sess['user'] = {"id": "33333", "role": "voter"}
+
+    try:
+        payload = {"election_id": str(election_id), "candidate_id": str(candidate_id)}
+        headers = {"Idempotency-Key": "retry-1"}
+        first = client.post('/cast_vote', json=payload, headers=headers)
+        retry = client.post('/cast_vote', json=payload, headers=headers)
+        assert first.json['success'] == True
+        assert retry.json == first.json
+        assert retry.headers.get('Idempotent-Replayed') == 'true'
+
+        # A new key is a new request and hits the duplicate-vote check
+        again = client.post('/cast_vote', json=payload, headers={"Idempotency-Key": "retry-2"})
+        assert again.json['success'] == False
+
+        # A claim still within its lease is in progress; one whose worker died is taken over once it lapses
+        now = datetime.utcnow()
+        mongo.db.idempotency_keys.insert_many([
+            {"_id": "cast_vote:33333:retry-3", "status": "pending", "claimed_at": now,
+             "expires_at": now + timedelta(seconds=30)},
+            {"_id": "cast_vote:33333:retry-4", "status": "pending", "claimed_at": now - timedelta(minutes=5),
+             "expires_at": now - timedelta(minutes=4, seconds=30)},
+        ])
+        busy = client.post('/cast_vote', json=payload, headers={"Idempotency-Key": "retry-3"})
+        assert busy.status_code == 409 and busy.headers['Retry-After'] == '1'
+        lapsed = client.post('/cast_vote', json=payload, headers={"Idempotency-Key": "retry-4"})
+        assert lapsed.status_code == 200 and lapsed.json['message'] == "Voter has already cast a vote in this election."
+        assert mongo.db.idempotency_keys.find_one({"_id": "cast_vote:33333:retry-4"})["status"] == "complete"
+
+        election = mongo.db.elections.find_one({"_id": election_id})
+        assert election['votes'][str(candidate_id)] == 1
+    finally:
+        mongo.db.elections.delete_one({"_id": election_id})
+        mongo.db.candidates.delete_one({"_id": candidate_id})
+        mongo.db.voters.delete_one({"cnic": "33333"})
+        mongo.db.idempotency_keys.delete_many({"_id": {"$in": [f"cast_vote:33333:{key}"
+                                                               for key in ("retry-1", "retry-2", "retry-3",
+                                                                           "retry-4")]}})
+        mongo.db.ballots.delete_many({"election_id": election_id})
+
+def test_lifecycle_freezes_results_at_close(client):
+    client, mongo = client  # Get client and mongo from fixture
+    candidate = {"_id": "6760a2f1c2b7a1d9e4f0a111", "name": "alizay", "party": "A"}
+    election_id = mongo.db.elections.insert_one({
+        "name": "lifecycle election",
+        "start_date": datetime(2024, 1, 1, 8),
+        "end_date": datetime(2024, 1, 1, 17),
+        "status": initial_status(datetime(2024, 1, 1, 8), datetime(2024, 1, 1, 17), now=datetime(2023, 12, 31)),
+        "candidates": [candidate],
+        "votes": {}
+    }).inserted_id
+    try:
+        assert advance(mongo.db, now=datetime(2024, 1, 1, 9), election_ids=[election_id]) == (1, 0)
+        assert mongo.db.elections.find_one({"_id": election_id})["status"] == OPEN
+
+        mongo.db.elections.update_one({"_id": election_id}, {"$set": {"votes": {candidate["_id"]: 3, "11111": True}}})
+        assert advance(mongo.db, now=datetime(2024, 1, 1, 18), election_ids=[election_id]) == (0, 1)
+        election = mongo.db.elections.find_one({"_id": election_id})
+        assert election["status"] == CLOSED
+        assert election["final_results"]["winner"]["votes"] == 3
+
+        # Later writes to the tally do not change the frozen result
+        mongo.db.elections.update_one({"_id": election_id}, {"$set": {"votes": {candidate["_id"]: 10}}})
+        assert advance(mongo.db, now=datetime(2024, 1, 2), election_ids=[election_id]) == (0, 0)
+
+        with client.session_transaction() as sess:
+            sess['user'] = {"id": "admin123", "role": "admin"}
+        response = client.get(f'/get_results/{election_id}')
+        assert response.json['data']['winner']['votes'] == 3
+
+        response = client.post(f'/certify_election/{election_id}')
+        assert response.json['success'] == True
+        assert mongo.db.elections.find_one({"_id": election_id})["status"] == CERTIFIED
+    finally:
+        mongo.db.elections.delete_one({"_id": election_id})
+
+def test_ballot_log_verifies_incrementally_and_detects_tampering(client):
+    client, mongo = client  # Get client and mongo from fixture
+    election_id = ObjectId()
+    try:
+        for i in range(20):
+            append_ballot(mongo.db, election_id, f"voter-{i}", "candidate-a", shards=4)
+        report = verify_election(mongo.db, election_id, shards=4, workers=1, batch_size=3)
+        assert all(shard["ok"] for shard in report)
+        assert sum(shard["verified"] for shard in report) == 20
+
+        # Only ballots appended since the last checkpoint are re-checked
+        appended = append_ballot(mongo.db, election_id, "voter-20", "candidate-a", shards=4)
+        report = verify_election(mongo.db, election_id, shards=4, workers=1)
+        assert sum(shard["verified"] for shard in report) == 1
+
+        # Tampering at the checkpoint is caught incrementally, anywhere else by a full pass
+        mongo.db.ballots.update_one({"_id": appended["_id"]}, {"$set": {"candidate_id": "candidate-b"}})
+        report = verify_election(mongo.db, election_id, shards=4, workers=1)
+        broken = [shard for shard in report if not shard["ok"]]
+        assert [shard["shard"] for shard in broken] == [appended["shard"]]
+        assert broken[0]["error"] == f"Ballot chain broken at seq {appended['seq']}."
+
+        mongo.db.ballots.update_one({"_id": appended["_id"]}, {"$set": {"candidate_id": "candidate-a"}})
+        first = mongo.db.ballots.find_one({"seq": 1, "election_id": election_id})
+        mongo.db.ballots.update_one({"_id": first["_id"]}, {"$set": {"candidate_id": "candidate-b"}})
+        assert all(shard["ok"] for shard in verify_election(mongo.db, election_id, shards=4, workers=1))
+        report = verify_election(mongo.db, election_id, shards=4, workers=1, full=True)
+        assert [shard["shard"] for shard in report if not shard["ok"]] == [first["shard"]]
+    finally:
+        mongo.db.ballots.delete_many({"election_id": election_id})
+        mongo.db.ballot_counters.delete_many({"_id": {"$regex": f"^{election_id}:"}})
+        mongo.db.ballot_checkpoints.delete_many({"_id": {"$regex": f"^{election_id}:"}})
+
+def test_parallel_tally_merges_partial_sums():
+    tasks = [(["a", "b", "a"],), (["b"],), ([],)]
+    assert parallel_tally(tally, tasks, workers=1) == {"a": 2, "b": 2}
+    assert parallel_tally(tally, tasks, workers=2) == {"a": 2, "b": 2}
+
+def test_recount_reports_discrepancies(client):
+    client, mongo = client  # Get client and mongo from fixture
+    election_id = mongo.db.elections.insert_one({
+        "name": "recount election",
+        "start_date": datetime(2000, 1, 1),
+        "end_date": datetime(2100, 1, 1),
+        "candidates": [{"_id": "candidate-a", "name": "alizay", "party": "A"},
+                       {"_id": "candidate-b", "name": "bilal", "party": "B"}],
+        "votes": {}
+    }).inserted_id
+    with client.session_transaction() as sess:
+        sess['user'] = {"id": "admin123", "role": "admin"}
+    try:
+        for i in range(5):
+            assert record_vote(mongo.db, election_id, f"voter-{i}", "candidate-a" if i < 3 else "candidate-b")
+        response = client.post(f'/recount/{election_id}')
+        assert response.json['success'] == True
+        assert response.json['data']['counts'] == {"candidate-a": 3, "candidate-b": 2}
+
+        mongo.db.elections.update_one({"_id": election_id}, {"$inc": {"votes.candidate-b": 4}})
+        response = client.post(f'/recount/{election_id}')
+        assert response.json['success'] == False
+        assert response.json['data']['discrepancies'] == [
+            {"candidate_id": "candidate-b", "name": "bilal", "stored": 6, "recounted": 2}
+        ]
+    finally:
+        mongo.db.elections.delete_one({"_id": election_id})
+        mongo.db.ballots.delete_many({"election_id": election_id})
+        mongo.db.ballot_counters.delete_many({"_id": {"$regex": f"^{election_id}:"}})
+
+def test_record_vote_settles_ballots_left_pending(client):
+    client, mongo = client  # Get client and mongo from fixture
+    election_id = mongo.db.elections.insert_one({
+        "name": "pending ballot election",
+        "start_date": datetime(2000, 1, 1),
+        "end_date": datetime(2100, 1, 1),
+        "candidates": [{"_id": "candidate-a", "name": "alizay", "party": "A"}],
+        "votes": {}
+    }).inserted_id
+    try:
+        # A vote that failed after its ballot was written is completed by the retry
+        append_ballot(mongo.db, election_id, "voter-1", "candidate-a", pending=True)
+        assert record_vote(mongo.db, election_id, "voter-1", "candidate-a")
+        # One that failed after the tally update only has its ballot finalized
+        pending = append_ballot(mongo.db, election_id, "voter-2", "candidate-a", pending=True)
+        mongo.db.elections.update_one({"_id": election_id},
+                                      {"$inc": {"votes.candidate-a": 1}, "$set": {"votes.voter-2": pending["_id"]}})
+        assert settle_pending(mongo.db, election_id) == 1
+        assert mongo.db.ballots.find_one({"_id": pending["_id"]})["status"] == COUNTED
+        assert not record_vote(mongo.db, election_id, "voter-2", "candidate-a")
+
+        # A second request that passed the voted check before the first finalized is void, not counted twice
+        assert record_vote(mongo.db, election_id, "voter-4", "candidate-a")
+        late = append_ballot(mongo.db, election_id, "voter-4", "candidate-a", pending=True)
+        assert not settle(mongo.db, late)
+        assert mongo.db.ballots.find_one({"_id": late["_id"]})["status"] == VOID
+
+        # A ballot never counted before the election closed is void
+        void = append_ballot(mongo.db, election_id, "voter-3", "candidate-a", pending=True)
+        mongo.db.elections.update_one({"_id": election_id}, {"$set": {"status": CLOSED}})
+        election = mongo.db.elections.find_one({"_id": election_id})
+        report = recount(mongo.db, election, workers=1)
+        assert report["ok"] and report["counts"] == {"candidate-a": 3} and report["voters_marked"] == 3
+        assert mongo.db.ballots.find_one({"_id": void["_id"]})["status"] == VOID
+        assert mongo.db.ballots.count_documents({"election_id": election_id, "voter_id": {"$exists": True}}) == 0
+        assert all(shard["ok"] for shard in verify_election(mongo.db, election_id, workers=1))
+    finally:
+        mongo.db.elections.delete_one({"_id": election_id})
+        mongo.db.ballots.delete_many({"election_id": election_id})
+        mongo.db.ballot_counters.delete_many({"_id": {"$regex": f"^{election_id}:"}})
+        mongo.db.ballot_checkpoints.delete_many({"_id": {"$regex": f"^{election_id}:"}})
+
+def test_dataset_generator_is_deterministic():
+    first = list(DatasetGenerator(seed=7).voters(2000))
+    assert first == list(DatasetGenerator(seed=7).voters(2000))
+    assert first != list(DatasetGenerator(seed=8).voters(2000))
+    assert len({voter["cnic"] for voter in first}) == 2000
+    assert all(re.match(CNIC_PATTERN, voter["cnic"]) and len(voter["cnic"]) == 15 for voter in first)
+    assert max(voter["eligible_from"] for voter in first) <= DatasetGenerator(seed=7).now
+
+def test_populate_loads_consistent_ballots(client):
+    client, mongo = client  # Get client and mongo from fixture
+    collections = ("voters", "candidates", "elections", "ballots", "ballot_counters")
+    before = {name: set(mongo.db[name].distinct("_id")) for name in collections}
+    try:
+        report = populate(mongo.db, seed=3, voters=600, candidates=40, elections=12, constituencies=6)
+        assert report["voters"] == 600 and report["elections"] == 12 and report["ballots"] > 0
+        closed = mongo.db.elections.find_one({"status": CLOSED, "name": {"$regex": "^NA-"}})
+        assert recount(mongo.db, closed, workers=1)["ok"]
+        assert all(shard["ok"] for shard in verify_election(mongo.db, closed["_id"], workers=1))
+        mongo.db.ballot_checkpoints.delete_many({"_id": {"$regex": f"^{closed['_id']}:"}})
+    finally:
+        for name in collections:
+            mongo.db[name].delete_many({"_id": {"$nin": list(before[name])}})
+
+def test_query_profiler_flags_repeated_queries_and_budgets():
+    test_app = create_app({
+        'TESTING': True,
+        'EMS_QUERY_PROFILING': True,
+        'EMS_QUERY_EXPLAIN': False,
+        'EMS_QUERY_BUDGETS': {'ems.home': 2},
+        'EMS_QUERY_BUDGET_STRICT': True,
+    })
+    profiler = test_app.extensions['ems_query_profiler']
+    assert profiler.listener in test_app.config['MONGO_CLIENT_OPTIONS']['event_listeners']
+
+    with test_app.test_request_context('/'):
+        profiler._start()
+        for request_id in range(3):
+            command = {"find": "candidates", "filter": {"_id": ObjectId()}, "lsid": {"id": 1}, "$db": "test"}
+            profiler.listener.started(SimpleNamespace(command_name="find", command=command, request_id=request_id))
+            profiler.listener.succeeded(SimpleNamespace(command_name="find", request_id=request_id,
+                                                        duration_micros=1500))
+        report = profiler.report(g.query_profile, 'ems.home')
+        assert report["queries"] == 3 and report["ms"] == 4.5
+        assert report["repeated"] == [("find candidates {'_id': '?'}", 3)]
+        assert report["over_budget"] is True
+
+        response = Response()
+        with pytest.raises(QueryBudgetExceeded):
+            profiler._finish(response)
+        assert response.headers[REPORT_HEADER].startswith("queries=3; ms=4.5; budget=2; repeated=")
+
+def test_age_counts_leap_day_birthdays():
+    assert age_on("2006-02-28", date(2024, 2, 27)) == 17
+    assert age_on("2006-02-28", date(2024, 2, 28)) == 18
+    assert age_on("2004-02-29", date(2022, 2, 28)) == 17
+    assert age_on("2004-02-29", date(2022, 3, 1)) == 18
+    assert eligible_from("2004-02-29", 18) == datetime(2022, 3, 1)
+    assert eligible_from("2006-02-28", 18) == datetime(2024, 2, 28)
+
+@pytest.mark.parametrize("vectorized", [True, False])
+def test_bulk_eligibility_matches_single(monkeypatch, vectorized):
+    if not vectorized:
+        monkeypatch.setattr(eligibility, "numpy", None)
+    elif eligibility.numpy is None:
+        pytest.skip("numpy not installed")
+    dobs = ["2004-02-29", "2000-02-29", "2006-12-31", "1950-01-01", "2005-03-01"]
+    on = date(2023, 2, 28)
+    assert eligibility_dates(dobs, 18) == [eligible_from(dob, 18) for dob in dobs]
+    assert ages_on(dobs, on) == [age_on(dob, on) for dob in dobs]
+
+def test_turnout_by_age_band(client):
+    client, mongo = client  # Get client and mongo from fixture
+    # Constituency only this test uses; datagen's NA-* constituencies can share the database
+    voters = [("91001", "2000-01-01", True), ("91002", "2001-06-01", False),
+              ("91003", "1960-01-01", True), ("91004", "2010-01-01", False),
+              ("91005", "1998-06-01", False), ("91006", "1998-06-02", True)]
+    mongo.db.voters.insert_many([
+        {"name": "Turnout Voter", "cnic": cnic, "dob": dob, "constituency": "TURNOUT-1",
+         "eligible_from": eligible_from(dob, 18)}
+        for cnic, dob, _ in voters
+    ])
+    election_id = mongo.db.elections.insert_one({
+        "name": "turnout election",
+        "start_date": datetime(2024, 6, 1),
+        "end_date": datetime(2024, 6, 2),
+        "constituency": "TURNOUT-1",
+        "candidates": [],
+        "votes": {cnic: True for cnic, _, voted in voters if voted}
+    }).inserted_id
+    with client.session_transaction() as sess:
+        sess['user'] = {"id": "admin123", "role": "admin"}
+    try:
+        bands = {row["band"]: row for row in client.get(f'/turnout/{election_id}').json['data']}
+        assert bands["18-25"] == {"band": "18-25", "eligible": 3, "voted": 2, "turnout": 66.67}
+        assert bands["26-35"] == {"band": "26-35", "eligible": 1, "voted": 0, "turnout": 0.0}  # 26 on the day
+        assert bands["56-65"]["voted"] == 1
+        assert sum(row["eligible"] for row in bands.values()) == 5  # the 14-year-old is not eligible
+        chunked = turnout_by_age_band(mongo.db, mongo.db.elections.find_one({"_id": election_id}), chunk_size=1)
+        assert chunked == client.get(f'/turnout/{election_id}').json['data']
+    finally:
+        mongo.db.elections.delete_one({"_id": election_id})
+        mongo.db.voters.delete_many({"constituency": "TURNOUT-1"})
+
+def test_cache_drops_invalidated_entries():
+    bus = LocalBus()
+    cache = Cache()
+    bus.subscribe(cache.invalidate)
+    cache.set(CANDIDATES, ALL, ["list"])
+    cache.set(CANDIDATES, "c1", "one")
+    cache.set(CANDIDATES, "c2", "two")
+    cache.set(RESULTS, "e1", "results")
+
+    bus.publish(CANDIDATES, "c1")
+    assert cache.get(CANDIDATES, "c1") is None and cache.get(CANDIDATES, ALL) is None
+    assert cache.get(CANDIDATES, "c2") == "two" and cache.get(RESULTS, "e1") == "results"
+    bus.publish(RESULTS)
+    assert cache.get(RESULTS, "e1") is None
+
+    # A value loaded while an invalidation for its topic arrives is returned but not cached
+    def load_during_invalidation():
+        bus.publish(CANDIDATES, "c3")
+        return "stale"
+
+    assert cache.get_or_load(CANDIDATES, "c3", load_during_invalidation) == "stale"
+    assert cache.get(CANDIDATES, "c3") is None
+    assert cache.get_or_load(CANDIDATES, "c3", lambda: "fresh") == "fresh" and cache.get(CANDIDATES, "c3") == "fresh"
+
+    election_id = ObjectId()
+    change = {"operationType": "update", "ns": {"db": "test", "coll": "elections"},
+              "documentKey": {"_id": election_id}}
+    assert invalidations_for(change) == [(ELECTIONS, election_id), (RESULTS, election_id)]
+    # Counting a vote changes the results, not the cached election details
+    change["updateDescription"] = {"updatedFields": {"votes.c1": 3, "votes.12345": True}, "removedFields": []}
+    assert invalidations_for(change) == [(RESULTS, election_id)]
+    change["updateDescription"]["updatedFields"]["end_date"] = datetime.now()
+    assert invalidations_for(change) == [(ELECTIONS, election_id), (RESULTS, election_id)]
+
+def test_cast_vote_checks_the_stored_schedule(client):
+    client, mongo = client  # Get client and mongo from fixture
+    mongo.db.voters.insert_one({"name": "Ali", "cnic": "77711", "dob": "1990-01-01"})
+    candidate_id = mongo.db.candidates.insert_one({"name": "alizay", "party": "A"}).inserted_id
+    election_id = mongo.db.elections.insert_one({
+        "name": "rescheduled election", "start_date": datetime(2000, 1, 1), "end_date": datetime(2100, 1, 1),
+        "candidates": [{"_id": str(candidate_id), "name": "alizay", "party": "A"}], "votes": {}
+    }).inserted_id
+    with client.session_transaction() as sess:
+        sess['user'] = {"id": "77711", "role": "voter"}
+    try:
+        # Another process ends the election early; this worker's cache still has the old end date
+        cached = get_cache(client.application).get_or_load(
+            ELECTIONS, election_id, lambda: mongo.db.elections.find_one({"_id": election_id}, {"votes": 0}))
+        assert cached["end_date"] == datetime(2100, 1, 1)
+        mongo.db.elections.update_one({"_id": election_id}, {"$set": {"end_date": datetime(2001, 1, 1)}})
+        response = client.post('/cast_vote', json={"election_id": str(election_id),
+                                                   "candidate_id": str(candidate_id)})
+        assert response.json == {"success": False, "message": "Election is not active.", "data": None}
+        election = mongo.db.elections.find_one({"_id": election_id})
+        assert election["votes"] == {}
+        assert mongo.db.ballots.count_documents({"election_id": election_id, "status": COUNTED}) == 0
+    finally:
+        mongo.db.elections.delete_one({"_id": election_id})
+        mongo.db.candidates.delete_one({"_id": candidate_id})
+        mongo.db.voters.delete_one({"cnic": "77711"})
+        mongo.db.ballots.delete_many({"election_id": election_id})
+        mongo.db.ballot_counters.delete_many({"_id": {"$regex": f"^{election_id}:"}})
+
+def test_writes_on_one_node_invalidate_another(client):
+    client, mongo = client  # Get client and mongo from fixture
+    bus = LocalBus()
+    nodes = [create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test_secret_key',
+        "MONGO_URI": os.getenv("MONGO_URI"),
+        "MONGO_DBNAME": "test",
+        "EMS_INVALIDATION_BUS": bus,
+    }) for _ in range(2)]
+    election_id = mongo.db.elections.insert_one({
+        "name": "cached election",
+        "start_date": datetime(2024, 12, 12, 8),
+        "end_date": datetime(2024, 12, 12, 17),
+        "candidates": [],
+        "votes": {}
+    }).inserted_id
+    try:
+        reader, writer = (node.test_client() for node in nodes)
+        for node_client in (reader, writer):
+            with node_client.session_transaction() as sess:
+                sess['user'] = {"id": "admin123", "role": "admin"}
+        assert reader.get(f'/get_election/{election_id}').json['data']['name'] == "cached election"
+        assert writer.patch(f'/edit_election/{election_id}', json={"name": "renamed"}).json['success'] == True
+        assert reader.get(f'/get_election/{election_id}').json['data']['name'] == "renamed"
+    finally:
+        mongo.db.elections.delete_one({"_id": election_id})
+
+def test_edge_store_records_one_vote_per_voter():
+    store = EdgeStore(":memory:")
+    first = store.record_vote("e1", "3520212345671", "c1", "key-1")
+    assert first is not None
+    assert store.record_vote("e1", "3520212345671", "c2") is None
+    assert store.record_vote("e2", "3520212345671", "c2") is not None
+    assert store.existing_vote("e1", "3520212345671")["idempotency_key"] == "key-1"
+
+    pending = store.pending()
+    assert [vote["ballot_id"] for vote in pending] == [first[0], pending[1]["ballot_id"]]
+    store.mark([{"ballot_id": first[0], "status": APPLIED},
+                {"ballot_id": pending[1]["ballot_id"], "status": CONFLICT, "reason": "closed"}])
+    assert store.pending() == [] and store.counts() == {"synced": 1, "conflict": 1}
+
+def test_edge_station_syncs_votes_to_central(client):
+    client, mongo = client  # Get client and mongo from fixture
+    now = datetime.now()
+    candidate_id = str(ObjectId())
+    voters = [{"name": f"Edge Voter {i}", "cnic": f"352021234567{i}", "dob": "1990-01-01",
+               "constituency": "EDGE-1", "eligible_from": datetime(2008, 1, 1)} for i in range(2)]
+    mongo.db.voters.insert_many([dict(voter) for voter in voters])
+    election_id = mongo.db.elections.insert_one({
+        "name": "edge election", "constituency": "EDGE-1", "status": "open",
+        "start_date": now - timedelta(hours=1), "end_date": now + timedelta(hours=1),
+        "candidates": [{"_id": candidate_id, "name": "Edge Candidate", "party": "P"}], "votes": {}
+    }).inserted_id
+    central = create_app({'TESTING': True, 'SECRET_KEY': 'test_secret_key', "MONGO_URI": os.getenv("MONGO_URI"),
+                          "MONGO_DBNAME": "test", "EMS_EDGE_STATIONS": {"station-1": "token-1"},
+                          "EMS_EDGE_MAX_BATCH_BYTES": 64 * 1024})
+    station = create_app({'TESTING': True, 'SECRET_KEY': 'test_secret_key', "MONGO_URI": os.getenv("MONGO_URI"),
+                          "MONGO_DBNAME": "test", "EMS_EDGE_MODE": True, "EMS_EDGE_DB": ":memory:",
+                          "EMS_EDGE_STATION": "station-1", "EMS_EDGE_TOKEN": "token-1"})
+    central_client = central.test_client()
+
+    def transport(url, token, station_name, body):
+        return central_client.post("/edge/sync", data=body, headers={
+            "Authorization": f"Bearer {token}", "X-Edge-Station": station_name, "Content-Encoding": "gzip"}).json
+
+    try:
+        with station.app_context():
+            store = station.extensions["ems_edge_store"]
+            assert store.provision(mongo.db, "EDGE-1") == {"voters": 2, "elections": 1}
+        # The second voter votes centrally while the station is offline
+        record_vote(mongo.db, election_id, voters[1]["cnic"], candidate_id)
+
+        station_client = station.test_client()
+        vote = {"election_id": str(election_id), "candidate_id": candidate_id}
+        for voter in voters:
+            with station_client.session_transaction() as sess:
+                sess['user'] = {"id": voter["cnic"], "role": "voter"}
+            response = station_client.post('/cast_vote', json=vote, headers={"Idempotency-Key": voter["cnic"]})
+            assert response.json['success'] == True
+            replay = station_client.post('/cast_vote', json=vote, headers={"Idempotency-Key": voter["cnic"]})
+            assert replay.json['success'] == True and replay.headers['Idempotent-Replayed'] == 'true'
+            assert station_client.post('/cast_vote', json=vote).json['success'] == False
+
+        pending = store.pending()
+        assert transport("", "wrong", "station-1", encode_batch("station-1", pending))["success"] == False
+        assert EdgeSyncer(station, transport).sync_once() == {APPLIED: 1, DUPLICATE: 0, CONFLICT: 1}
+        # A batch re-sent after a lost reply is not counted again
+        outcomes = transport("", "token-1", "station-1", encode_batch("station-1", pending))['data']['outcomes']
+        assert [outcome["status"] for outcome in outcomes] == [DUPLICATE, CONFLICT]
+
+        # A ballot left pending by a sync that stopped before counting it is not taken
+        # as counted just because its voter voted elsewhere
+        stale = dict(pending[1], ballot_id="stale-ballot")
+        mongo.db.edge_ballots.insert_one({"_id": "stale-ballot", "station": "station-1", "status": "pending",
+                                          "election_id": str(election_id), "voter_id": stale["voter_id"]})
+        outcomes = transport("", "token-1", "station-1", encode_batch("station-1", [stale]))['data']['outcomes']
+        assert [outcome["status"] for outcome in outcomes] == [CONFLICT]
+
+        election = mongo.db.elections.find_one({"_id": election_id})
+        assert election["votes"][candidate_id] == 2
+        assert mongo.db.ballots.count_documents({"election_id": election_id, "status": COUNTED}) == 2
+        assert store.counts() == {"synced": 1, "conflict": 1}
+
+        # Malformed and oversized batches are rejected before any vote is applied
+        for body in (gzip.compress(b"not json"), b"\x1f\x8b garbage",
+                     gzip.compress(b'{"station": "station-1", "votes": [{"ballot_id": 1}]}'),
+                     gzip.compress(b" " * (65 * 1024))):
+            response = central_client.post("/edge/sync", data=body, headers={
+                "Authorization": "Bearer token-1", "X-Edge-Station": "station-1", "Content-Encoding": "gzip"})
+            assert response.status_code == 400 and response.json['success'] == False
+    finally:
+        mongo.db.voters.delete_many({"cnic": {"$in": [voter["cnic"] for voter in voters]}})
+        mongo.db.elections.delete_one({"_id": election_id})
+        mongo.db.ballots.delete_many({"election_id": election_id})
+        mongo.db.ballot_counters.delete_many({"_id": {"$regex": f"^{election_id}:"}})
+        mongo.db.edge_ballots.delete_many({"election_id": str(election_id)})
+
+def test_prefix_index_pages_through_matches():
+    index = PrefixIndex()
+    index.build([("1", "Ali Khan"), ("2", "Alia Ahmed"), ("3", "Zoë Ali"), ("4", "Bilal Khan")])
+    assert index.search("ali")[0] == ["1", "3", "2"]
+    assert index.search("zoe")[0] == ["3"]
+    assert index.search("khan al")[0] == ["1"]
+
+    first, cursor = index.search("al", limit=2)
+    second, cursor = index.search("al", limit=2, cursor=cursor)
+    assert first + second == ["1", "3", "2"] and cursor is None
+
+    index.remove("1")
+    index.add("5", "Alam Shah")
+    assert index.search("ala")[0] == ["5"] and index.search("khan")[0] == ["4"]
+
+def test_search_voters_and_candidates(client):
+    client, mongo = client  # Get client and mongo from fixture
+    with client.session_transaction() as sess:
+        sess['user'] = {"id": "admin123", "role": "admin"}
+    cnic = "4210198765432"
+    candidate_id = mongo.db.candidates.insert_one({"name": "Searchable Candidate", "party": "Unity"}).inserted_id
+    try:
+        assert client.get('/search/voters?q=zubaida').json['data'] == {"results": [], "next": None}
+        response = client.post('/register_voter', json={
+            "name": "Zubaida Searchable", "cnic": cnic, "dob": "1990-01-01", "constituency": "NA-1"})
+        assert response.json['success'] == True
+
+        # A registration shows up in the next search, by name or CNIC prefix
+        for query in ("zubaida", "Search zub", "42101987", "42101-987"):
+            results = client.get('/search/voters', query_string={"q": query}).json['data']['results']
+            assert [voter['cnic'] for voter in results] == [cnic]
+
+        # CNICs stored in the dashed format match a prefix typed with or without dashes
+        mongo.db.voters.insert_one({"name": "Dashed Cnic", "cnic": "35299-1112223-1", "dob": "1990-01-01"})
+        for query in ("3529911", "35299-111", "35299-1112223-1"):
+            results = client.get('/search/voters', query_string={"q": query}).json['data']['results']
+            assert [voter['cnic'] for voter in results] == ["35299-1112223-1"]
+
+        results = client.get('/search/candidates?q=unity').json['data']['results']
+        assert results == [{"candidate_id": str(candidate_id), "name": "Searchable Candidate", "party": "Unity"}]
+    finally:
+        mongo.db.voters.delete_many({"cnic": {"$in": [cnic, "35299-1112223-1"]}})
+        mongo.db.candidates.delete_one({"_id": candidate_id})
+
+def test_readiness_waits_for_warm_up(client):
+    client, mongo = client  # Get client and mongo from fixture
+    test_app = create_app({'TESTING': True, 'SECRET_KEY': 'test_secret_key', "MONGO_URI": os.getenv("MONGO_URI"),
+                           "MONGO_DBNAME": "test", "EMS_WARMUP_LEAD_SECONDS": 600, "EMS_WARMUP_CONNECTIONS": 4})
+    candidate_id = mongo.db.candidates.insert_one({"name": "Warm Candidate", "party": "P"}).inserted_id
+    start = datetime.now() + timedelta(minutes=5)
+    election_id = mongo.db.elections.insert_one({
+        "name": "warm election", "constituency": "WARM-1", "status": "scheduled",
+        "start_date": start, "end_date": start + timedelta(hours=8),
+        "candidates": [{"_id": str(candidate_id), "name": "Warm Candidate", "party": "P"}], "votes": {}
+    }).inserted_id
+    try:
+        test_client = test_app.test_client()
+        with test_client.session_transaction() as sess:
+            sess['user'] = {"id": "admin123", "role": "admin"}
+        report = test_client.post(f'/warmup/{election_id}').json['data']
+        assert set(report['steps']) == {"pool", "election", "candidates", "schedule", "voter_roll"}
+
+        cache = get_cache(test_app)
+        assert cache.get(ELECTIONS, election_id)['name'] == "warm election"
+        assert cache.get(CANDIDATES, candidate_id)['name'] == "Warm Candidate"
+        response = test_client.get('/healthz/ready')
+        assert response.status_code == 200 and response.json['data']['cold'] == []
+
+        # An election due soon that this instance has not warmed makes it unready, and starts its warm-up
+        get_warmup(test_app).reports.clear()
+        response = test_client.get('/healthz/ready')
+        assert response.status_code == 503 and response.json['data']['cold'] == [str(election_id)]
+        for _ in range(100):
+            if test_client.get('/healthz/ready').status_code == 200:
+                break
+            time.sleep(0.05)
+        assert test_client.get('/healthz/ready').status_code == 200
+
+        # A warm-up that fails is reported, and the instance serves the election cold instead of staying unready
+        warmup = get_warmup(test_app)
+        warmup.reports.clear()
+
+        def unreachable(_):
+            raise RuntimeError("pool unavailable")
+
+        warmup.open_pool = unreachable
+        for _ in range(100):
+            response = test_client.get('/healthz/ready')
+            if response.status_code == 200:
+                break
+            time.sleep(0.05)
+        assert response.status_code == 200
+        assert [failure["election_id"] for failure in response.json['data']['failed']] == [str(election_id)]
+        assert response.json['data']['cold'] == []
+    finally:
+        mongo.db.elections.delete_one({"_id": election_id})
+        mongo.db.candidates.delete_one({"_id": candidate_id})
+
+def test_create_app_is_isolated():
+    first = create_app({'TESTING': True, 'MONGO_URI': 'mongodb://localhost:27017/first'})
+    second = create_app({'TESTING': True, 'MONGO_URI': 'mongodb://localhost:27017/second'})
+    assert first is not second
+    assert first.config["MONGO_URI"] != second.config["MONGO_URI"]
+
+def test_create_app_does_not_connect():
+    test_app = create_app({'TESTING': True, 'MONGO_URI': 'mongodb://localhost:27017/test'})
+    assert mongo.is_connected(test_app) is False
+    with test_app.app_context():
+        assert mongo.db.name == "test"
+    assert mongo.is_connected(test_app) is True
+
+def test_read_routing_defaults():
+    test_app = create_app({'TESTING': True, 'MONGO_URI': 'mongodb://localhost:27017/test'})
+    with test_app.app_context():
+        listings = mongo.reader('listings').elections.read_preference
+        validation = mongo.reader('vote_validation').voters.read_preference
+    assert listings == SecondaryPreferred(max_staleness=90)
+    assert validation == Primary()
+
+def test_read_routing_is_configurable():
+    test_app = create_app({
+        'TESTING': True,
+        'MONGO_URI': 'mongodb://localhost:27017/test?replicaSet=rs0',
+        'MONGO_READ_ROUTING': {
+            "results": {"mode": "nearest", "max_staleness": 120},
+            "listings": "primary",
+        },
+    })
+    with test_app.app_context():
+        assert mongo.reader('results').read_preference == Nearest(max_staleness=120)
+        assert mongo.reader('listings').read_preference == Primary()
+        assert mongo.reader('unknown').read_preference == Primary()
+
+def test_mongo_wire_compression_is_configurable():
+    test_app = create_app({'TESTING': True, 'MONGO_URI': 'mongodb://localhost:27017/test',
+                           'MONGO_COMPRESSORS': "zstd,snappy,zlib", 'MONGO_ZLIB_COMPRESSION_LEVEL': 6})
+    options = mongo.client_options(test_app)
+    assert options["compressors"] == "zstd,snappy,zlib" and options["zlibCompressionLevel"] == 6
+    assert "compressors" not in mongo.client_options(create_app({'TESTING': True}))
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate, br", ["br", "gzip"]) == "br"
+    assert choose_encoding("gzip;q=1.0, br;q=0.5", ["br", "gzip"]) == "gzip"
+    assert choose_encoding("*;q=0.1, br;q=0", ["br", "gzip"]) == "gzip"
+    assert choose_encoding("identity", ["br", "gzip"]) is None
+    assert choose_encoding(None, ["br", "gzip"]) is None
+
+def test_large_responses_are_compressed(client):
+    client, mongo = client  # Get client and mongo from fixture
+    with client.session_transaction() as sess:
+        sess['user'] = {"id": "admin123", "role": "admin"}
+    candidate_ids = mongo.db.candidates.insert_many(
+        [{"name": f"Compressed Candidate {i}", "party": "Party"} for i in range(100)]).inserted_ids
+    try:
+        plain = client.get('/get_candidates')
+        assert 'Content-Encoding' not in plain.headers and 'Accept-Encoding' in plain.headers['Vary']
+        compressed = client.get('/get_candidates', headers={"Accept-Encoding": "gzip"})
+        assert compressed.headers['Content-Encoding'] == 'gzip'
+        assert len(compressed.data) < len(plain.data) / 3
+        assert gzip.decompress(compressed.data) == plain.data
+
+        # Small bodies are not worth compressing
+        small = client.get('/get_election/not-an-id', headers={"Accept-Encoding": "gzip"})
+        assert small.json['message'] == "Election not found." and len(small.data) < 1024
+        assert 'Content-Encoding' not in small.headers
+    finally:
+        mongo.db.candidates.delete_many({"_id": {"$in": candidate_ids}})
+
+def test_msgpack_responses(client):
+    msgpack = pytest.importorskip("msgpack")
+    client, mongo = client  # Get client and mongo from fixture
+    with client.session_transaction() as sess:
+        sess['user'] = {"id": "admin123", "role": "admin"}
+    candidate_id = mongo.db.candidates.insert_one({"name": "Packed Candidate", "party": "P"}).inserted_id
+    try:
+        response = client.get('/get_candidates', headers={"Accept": "application/msgpack"})
+        assert response.mimetype == "application/msgpack"
+        data = msgpack.unpackb(response.data)
+        assert {"candidate_id": str(candidate_id), "name": "Packed Candidate", "party": "P"} in data["data"]
+        assert client.get('/get_candidates').mimetype == "application/json"
+        packed = Response(msgpack.packb({"data": {1: "one"}}), mimetype="application/msgpack")
+        assert response_data(packed) == {"data": {1: "one"}}
+    finally:
+        mongo.db.candidates.delete_one({"_id": candidate_id})
+
+def test_patch_election_renames_only(client):
+    client, mongo = client  # Get client and mongo from fixture
+    election_id = mongo.db.elections.insert_one({
+        "name": "pti election",
+        "start_date": datetime(2024, 12, 12, 8),
+        "end_date": datetime(2024, 12, 12, 17),
+        "candidates": [{"_id": "6760a2f1c2b7a1d9e4f0a111", "name": "alizay", "party": "A"}],
+        "votes": {}
+    }).inserted_id
+    with client.session_transaction() as sess:
+        sess['user'] = {"id": "admin123", "role": "admin"}
+    try:
+        response = client.patch(f'/edit_election/{election_id}', json={"name": "renamed election"})
+        assert response.json['success'] == True
+        assert response.json['data'] == {"name": "renamed election"}
+        election = mongo.db.elections.find_one({"_id": election_id})
+        assert election['name'] == "renamed election"
+        assert len(election['candidates']) == 1
+
+        response = client.patch(f'/edit_election/{election_id}', json={"end_date": "2024-12-12 07:00:00"})
+        assert response.json['message'] == "Invalid election schedule."
+    finally:
+        mongo.db.elections.delete_one({"_id": election_id})
+
+def test_admin_batch_adds_and_attaches_candidates(client):
+    client, mongo = client  # Get client and mongo from fixture
+    election_id = mongo.db.elections.insert_one({
+        "name": "batch election",
+        "start_date": datetime(2024, 12, 12, 8),
+        "end_date": datetime(2024, 12, 12, 17),
+        "candidates": [],
+        "votes": {}
+    }).inserted_id
+    with client.session_transaction() as sess:
+        sess['user'] = {"id": "admin123", "role": "admin"}
+    try:
+        response = client.post('/admin/batch', json={"operations": [
+            {"op": "add_candidate", "ref": "c1", "name": "alizay", "party": "A", "cnic": "91919", "dob": "1980-01-01"},
+            {"op": "attach_candidates", "election_id": str(election_id), "candidate_ids": ["@c1"]},
+            {"op": "reschedule", "election_id": str(election_id),
+             "start_date": "2024-12-13 08:00:00", "end_date": "2024-12-13 17:00:00"},
+        ]})
+        assert response.json['success'] == True
+        election = mongo.db.elections.find_one({"_id": election_id})
+        assert [c['name'] for c in election['candidates']] == ["alizay"]
+        assert election['start_date'] == datetime(2024, 12, 13, 8)
+
+        response = client.post('/admin/batch', json={"operations": [{"op": "drop_tables"}]})
+        assert response.json['message'] == "Operation 0: unknown operation."
+
+        # Without transactions (the default), operations before a failure stay applied
+        response = client.post('/admin/batch', json={"operations": [
+            {"op": "add_candidate", "ref": "c2", "name": "bilal", "party": "B", "cnic": "92929", "dob": "1980-01-01"},
+            {"op": "drop_tables"},
+        ]})
+        assert response.status_code == 200 and response.json['message'] == "Operation 1: unknown operation."
+        assert mongo.db.candidates.find_one({"cnic": "92929"})["name"] == "bilal"
+    finally:
+        mongo.db.elections.delete_one({"_id": election_id})
+        mongo.db.candidates.delete_many({"cnic": {"$in": ["91919", "92929"]}})
+
 def test_access_denied(client):
     client, mongo = client  # Get client and mongo from fixture
     # No session set (unauthorized)